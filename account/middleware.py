@@ -1,4 +1,7 @@
 import logging
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qs
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
@@ -10,10 +13,88 @@ from django.contrib.auth.models import AnonymousUser
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Stateless, so one instance serves every connection
+token_backend = TokenBackend(
+    algorithm='HS256',
+    signing_key=settings.SECRET_KEY
+)
+
+
+class _LRUCache:
+    """Thread-safe LRU mapping with optional per-entry expiry (monotonic deadline)."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires: float = None):
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+# Verified token -> user id, kept until the token expires (or the TTL, whichever is sooner)
+_tokens = _LRUCache(settings.JWT_AUTH_CACHE_SIZE)
+# User id -> user snapshot; dropped when the user is saved or deleted (account.signals)
+_users = _LRUCache(settings.JWT_AUTH_CACHE_SIZE)
+
+
+def invalidate_user(user_id):
+    """Forget the cached snapshot of a user, e.g. after deactivation."""
+    _users.discard(str(user_id))
+
+
+def _verify_token(token: str):
+    """Return the user id of a valid access token, verifying each distinct token once per TTL."""
+    user_id = _tokens.get(token)
+    if user_id is not None:
+        return user_id
+    decoded = token_backend.decode(token, verify=True)
+    user_id = decoded.get("user_id")
+    if user_id:
+        ttl = settings.JWT_AUTH_CACHE_TTL
+        if "exp" in decoded:
+            ttl = min(ttl, decoded["exp"] - time.time())
+        if ttl > 0:
+            _tokens.set(token, user_id, time.monotonic() + ttl)
+    return user_id
+
+
+async def _get_user(user_id):
+    # Token claims may carry the id as a string; key snapshots consistently
+    key = str(user_id)
+    user = _users.get(key)
+    if user is None:
+        user = await database_sync_to_async(User.objects.get)(id=user_id)
+        _users.set(key, user, time.monotonic() + settings.JWT_AUTH_CACHE_TTL)
+    return user
+
 
 class JwtAuthMiddleware(BaseMiddleware):
     """ 
     Custom middleware that takes a JWT token from the query string or headers and authenticates via SimpleJWT
+
+    Verified tokens and user lookups are cached for ``JWT_AUTH_CACHE_TTL``
+    seconds, so reconnecting clients are authenticated without a database query.
     """
     async def __call__(self, scope, receive, send):
         scope['user'] = AnonymousUser()
@@ -36,14 +117,13 @@ class JwtAuthMiddleware(BaseMiddleware):
                 token = auth_header
 
             try:
-                token_backend = TokenBackend(
-                    algorithm='HS256',
-                    signing_key=settings.SECRET_KEY
-                )
-                decoded = token_backend.decode(token, verify=True)
-                user_id = decoded.get("user_id")
+                user_id = _verify_token(token)
                 if user_id:
-                    scope['user'] = await database_sync_to_async(User.objects.get)(id=user_id)
+                    user = await _get_user(user_id)
+                    if user.is_active:
+                        scope['user'] = user
+                    else:
+                        logger.warning(f"WS auth failed: user {user_id} is inactive")
             except Exception as exc:
                 logger.warning(f"WS auth failed: {exc}")
                 scope['user'] = AnonymousUser()
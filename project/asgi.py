@@ -22,10 +22,12 @@ django_asgi_app = get_asgi_application()
 
 def build_application():
     from account.middleware import JwtAuthMiddleware
+    from rag.lifespan import LifespanApp
     import rag.routing  
 
     return ProtocolTypeRouter({
         "http": django_asgi_app,
+        "lifespan": LifespanApp(),
         "websocket": JwtAuthMiddleware(
             URLRouter(rag.routing.websocket_urlpatterns)
         ),
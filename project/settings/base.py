@@ -3,6 +3,7 @@ Base settings for Django PDF RAG Chat project.
 Contains common settings shared across all environments.
 """
 
+import os
 from pathlib import Path
 from decouple import config
 from datetime import timedelta
@@ -76,6 +77,10 @@ SIMPLE_JWT = {
     "UPDATE_LAST_LOGIN": True,                       
 }
 
+# WebSocket auth caches verified tokens and user snapshots for this long (bounded by token expiry)
+JWT_AUTH_CACHE_TTL = config('JWT_AUTH_CACHE_TTL', default=60, cast=int)
+JWT_AUTH_CACHE_SIZE = config('JWT_AUTH_CACHE_SIZE', default=10000, cast=int)
+
 # Database
 DATABASES = {
     'default': {
@@ -87,7 +92,9 @@ DATABASES = {
 # Channels
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        # Shared answer streams are fanned out as one message per delta; a full channel drops them
+        "CONFIG": {"capacity": config('CHANNEL_LAYER_CAPACITY', default=1000, cast=int)},
     }
 }
 
@@ -125,6 +132,103 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # OpenAI Configuration
 OPENAI_API_KEY = config('OPENAI_API_KEY')
+OPENAI_API_BASE = config('OPENAI_API_BASE', default='https://api.openai.com/v1')
+
+# Shared async OpenAI connection pool (seconds for timeouts and keep-alive)
+RAG_OPENAI_POOL_SIZE = config('RAG_OPENAI_POOL_SIZE', default=100, cast=int)
+RAG_OPENAI_KEEPALIVE = config('RAG_OPENAI_KEEPALIVE', default=30, cast=float)
+RAG_OPENAI_CONNECT_TIMEOUT = config('RAG_OPENAI_CONNECT_TIMEOUT', default=5, cast=float)
+RAG_OPENAI_READ_TIMEOUT = config('RAG_OPENAI_READ_TIMEOUT', default=60, cast=float)
+
+# RAG ingestion pipeline
+RAG_INGESTION_WORKERS = config('RAG_INGESTION_WORKERS', default=2, cast=int)
+RAG_INGESTION_QUEUE_SIZE = config('RAG_INGESTION_QUEUE_SIZE', default=64, cast=int)
+# Chunks embedded and stored together, and batches buffered between pipeline stages
+RAG_INGESTION_BATCH_SIZE = config('RAG_INGESTION_BATCH_SIZE', default=64, cast=int)
+RAG_INGESTION_STAGE_QUEUE_SIZE = config('RAG_INGESTION_STAGE_QUEUE_SIZE', default=4, cast=int)
+
+# Chunking: estimated tokens per chunk and tokens shared between consecutive chunks
+RAG_CHUNK_TOKENS = config('RAG_CHUNK_TOKENS', default=400, cast=int)
+RAG_CHUNK_OVERLAP_TOKENS = config('RAG_CHUNK_OVERLAP_TOKENS', default=60, cast=int)
+
+# Parallel PDF text extraction (process pool); smaller PDFs are read in-process
+RAG_EXTRACTION_WORKERS = config('RAG_EXTRACTION_WORKERS', default=min(8, os.cpu_count() or 1), cast=int)
+RAG_PARALLEL_EXTRACTION_MIN_PAGES = config('RAG_PARALLEL_EXTRACTION_MIN_PAGES', default=64, cast=int)
+RAG_EXTRACTION_PAGES_PER_TASK = config('RAG_EXTRACTION_PAGES_PER_TASK', default=16, cast=int)
+
+# Embedding requests
+RAG_EMBEDDING_BATCH_SIZE = config('RAG_EMBEDDING_BATCH_SIZE', default=256, cast=int)
+RAG_EMBEDDING_BATCH_TOKENS = config('RAG_EMBEDDING_BATCH_TOKENS', default=100000, cast=int)
+RAG_EMBEDDING_CONCURRENCY = config('RAG_EMBEDDING_CONCURRENCY', default=4, cast=int)
+RAG_EMBEDDING_MAX_RETRIES = config('RAG_EMBEDDING_MAX_RETRIES', default=3, cast=int)
+
+# Vector store backend: "chroma" (default) or "numpy" (in-process memory-mapped index)
+RAG_VECTOR_BACKEND = config('RAG_VECTOR_BACKEND', default='chroma')
+RAG_NUMPY_INDEX_DIR = config('RAG_NUMPY_INDEX_DIR', default=str(BASE_DIR / 'numpy_index'))
+RAG_NUMPY_MAX_SEGMENTS = config('RAG_NUMPY_MAX_SEGMENTS', default=16, cast=int)
+
+# Embedding profile: shortened vectors from the model (0 = full size), and how the NumPy backend stores them
+RAG_EMBEDDING_DIMENSIONS = config('RAG_EMBEDDING_DIMENSIONS', default=0, cast=int)
+RAG_NUMPY_VECTOR_DTYPE = config('RAG_NUMPY_VECTOR_DTYPE', default='float32')
+RAG_NUMPY_RESCORE_FACTOR = config('RAG_NUMPY_RESCORE_FACTOR', default=4, cast=int)
+
+# Open the vector store and load its index at startup instead of on the first query
+RAG_WARMUP = config('RAG_WARMUP', default=False, cast=bool)
+
+# Give each owner a separate collection so searches only scan that owner's chunks
+RAG_TENANT_SHARDING = config('RAG_TENANT_SHARDING', default=False, cast=bool)
+
+# Hybrid retrieval: fuse vector hits with BM25 hits from an inverted index built at ingestion
+RAG_HYBRID_SEARCH = config('RAG_HYBRID_SEARCH', default=True, cast=bool)
+RAG_LEXICAL_INDEX_DIR = config('RAG_LEXICAL_INDEX_DIR', default=str(BASE_DIR / 'lexical_index'))
+
+# Result diversification: over-fetch candidates, drop weak matches, then pick top_k by MMR
+RAG_FETCH_K = config('RAG_FETCH_K', default=20, cast=int)
+RAG_MMR_LAMBDA = config('RAG_MMR_LAMBDA', default=0.7, cast=float)
+RAG_MIN_SIMILARITY = config('RAG_MIN_SIMILARITY', default=0.2, cast=float)
+RAG_MAX_TOP_K = config('RAG_MAX_TOP_K', default=20, cast=int)
+RAG_MAX_FETCH_K = config('RAG_MAX_FETCH_K', default=100, cast=int)
+# "hierarchical" first picks the documents whose centroid is closest to the query, then searches their chunks
+RAG_RETRIEVAL_MODE = config('RAG_RETRIEVAL_MODE', default='flat')
+RAG_HIERARCHICAL_DOCUMENTS = config('RAG_HIERARCHICAL_DOCUMENTS', default=5, cast=int)
+
+# Prompt size: retrieved context is packed into this many tokens, and answers are capped separately
+RAG_CONTEXT_MAX_TOKENS = config('RAG_CONTEXT_MAX_TOKENS', default=3000, cast=int)
+RAG_ANSWER_MAX_TOKENS = config('RAG_ANSWER_MAX_TOKENS', default=1024, cast=int)
+RAG_MAX_QUERY_TOKENS = config('RAG_MAX_QUERY_TOKENS', default=1000, cast=int)
+
+# Chroma writes are split into batches of at most this many chunks
+RAG_CHROMA_BATCH_SIZE = config('RAG_CHROMA_BATCH_SIZE', default=1000, cast=int)
+
+# Embedding cache (in-memory LRU in front of SQLite)
+RAG_EMBEDDING_CACHE_ENABLED = config('RAG_EMBEDDING_CACHE_ENABLED', default=True, cast=bool)
+RAG_EMBEDDING_CACHE_PATH = config('RAG_EMBEDDING_CACHE_PATH', default=str(BASE_DIR / 'embedding_cache.sqlite3'))
+RAG_EMBEDDING_CACHE_MEMORY_ITEMS = config('RAG_EMBEDDING_CACHE_MEMORY_ITEMS', default=10000, cast=int)
+RAG_EMBEDDING_CACHE_DISK_ITEMS = config('RAG_EMBEDDING_CACHE_DISK_ITEMS', default=1000000, cast=int)
+
+# Process-wide admission control for upstream OpenAI calls (0 tokens per minute = no token budget)
+RAG_UPSTREAM_CHAT_CONCURRENCY = config('RAG_UPSTREAM_CHAT_CONCURRENCY', default=32, cast=int)
+RAG_UPSTREAM_CHAT_TPM = config('RAG_UPSTREAM_CHAT_TPM', default=200000, cast=int)
+RAG_UPSTREAM_EMBEDDING_CONCURRENCY = config('RAG_UPSTREAM_EMBEDDING_CONCURRENCY', default=8, cast=int)
+RAG_UPSTREAM_EMBEDDING_TPM = config('RAG_UPSTREAM_EMBEDDING_TPM', default=1000000, cast=int)
+RAG_UPSTREAM_MAX_RETRIES = config('RAG_UPSTREAM_MAX_RETRIES', default=3, cast=int)
+RAG_UPSTREAM_MAX_BACKOFF = config('RAG_UPSTREAM_MAX_BACKOFF', default=30, cast=float)
+
+# WebSocket framing: 'batched' joins deltas arriving within the flush interval into one frame
+RAG_WS_STREAM_MODE = config('RAG_WS_STREAM_MODE', default='batched')
+RAG_WS_FLUSH_INTERVAL_MS = config('RAG_WS_FLUSH_INTERVAL_MS', default=30, cast=int)
+RAG_WS_FLUSH_BYTES = config('RAG_WS_FLUSH_BYTES', default=512, cast=int)
+
+# Completed answers are replayed for repeated questions over the same chunks
+RAG_RESPONSE_CACHE_ENABLED = config('RAG_RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RAG_RESPONSE_CACHE_TTL = config('RAG_RESPONSE_CACHE_TTL', default=3600, cast=int)
+RAG_RESPONSE_CACHE_MAX_ENTRIES = config('RAG_RESPONSE_CACHE_MAX_ENTRIES', default=5000, cast=int)
+RAG_RESPONSE_CACHE_MAX_BYTES = config('RAG_RESPONSE_CACHE_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+
+# Metrics endpoint (/metrics, Prometheus text format, served only once RAG_METRICS_TOKEN is set) and per-request timing log lines (logger 'rag.timing')
+RAG_METRICS_ENABLED = config('RAG_METRICS_ENABLED', default=True, cast=bool)
+RAG_METRICS_TOKEN = config('RAG_METRICS_TOKEN', default='')
+RAG_TIMING_LOG = config('RAG_TIMING_LOG', default=False, cast=bool)
 
 # Logging Configuration
 LOGGING = {
@@ -162,5 +266,10 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': False,
         },
+        'rag.timing': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
\ No newline at end of file
@@ -1,6 +1,29 @@
+import os
+import sys
 from django.apps import AppConfig
 
 
+def _serves_requests() -> bool:
+    """Whether this process will serve requests, as opposed to running a management command."""
+    command = os.path.basename(sys.argv[0]) if sys.argv else ""
+    if command not in ("manage.py", "django-admin"):
+        return True
+    if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+        return False
+    # The autoreloader's parent process only watches files
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+
+
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+
+        if settings.RAG_WARMUP and _serves_requests():
+            from .helpers.vector_store import warm_up_in_background
+
+            warm_up_in_background()
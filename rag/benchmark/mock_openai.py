@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import re
+import numpy as np
+from aiohttp import web
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    """
+    Deterministic bag-of-words embedding: each word is hashed to a signed dimension.
+
+    Texts sharing words get a positive cosine similarity, so retrieval over
+    mock embeddings behaves like retrieval over real ones, only cruder.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class MockOpenAI:
+    """
+    aiohttp stand-in for ``/v1/embeddings`` and streaming ``/v1/chat/completions``.
+
+    Answers start after ``first_token_latency`` seconds and then stream
+    ``answer_tokens`` tokens (fewer if the request's ``max_tokens`` is lower)
+    at ``token_rate`` tokens per second. ``GET /stats`` reports request counts.
+    """
+
+    def __init__(self, dim: int = 1536, embedding_latency: float = 0.02, first_token_latency: float = 0.3,
+                 token_rate: float = 50.0, answer_tokens: int = 100):
+        self.dim = dim
+        self.embedding_latency = embedding_latency
+        self.first_token_latency = first_token_latency
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.stats = {
+            "embedding_requests": 0,
+            "embedding_inputs": 0,
+            "chat_requests": 0,
+            "chat_completed": 0,
+            "chat_aborted": 0,
+            "chat_tokens": 0,
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    async def embeddings(self, request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or self.dim
+        self.stats["embedding_requests"] += 1
+        self.stats["embedding_inputs"] += len(inputs)
+        await asyncio.sleep(self.embedding_latency)
+        data = [
+            {"object": "embedding", "index": i, "embedding": hashed_embedding(text, dim).tolist()}
+            for i, text in enumerate(inputs)
+        ]
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def chat(self, request):
+        body = await request.json()
+        self.stats["chat_requests"] += 1
+        tokens = min(body.get("max_tokens") or self.answer_tokens, self.answer_tokens)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            await asyncio.sleep(self.first_token_latency)
+            interval = 1.0 / self.token_rate if self.token_rate > 0 else 0
+            for i in range(tokens):
+                chunk = {"choices": [{"index": 0, "delta": {"content": f"token{i} "}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.stats["chat_tokens"] += 1
+                if interval:
+                    await asyncio.sleep(interval)
+            await response.write(b"data: [DONE]\n\n")
+            self.stats["chat_completed"] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.stats["chat_aborted"] += 1
+            raise
+        return response
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, **config):
+    """Run a mock server until the process is terminated."""
+    web.run_app(MockOpenAI(**config).app(), host=host, port=port, print=None, access_log=None)
\ No newline at end of file
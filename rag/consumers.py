@@ -1,31 +1,28 @@
-import json
+import asyncio
 import logging
-import aiohttp
+from urllib.parse import parse_qs
+import orjson
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 
-from .helpers.vector_store import get_chroma_collection, embed_texts
+from .helpers.context import CONTEXT_SEPARATOR, context_budget, pack_context
+from .helpers.metrics import QUERIES, QUERY_STAGE_SECONDS, StageTimer
+from .helpers.response_cache import ResponseCache, get_response_cache
+from .helpers.retrieval import retrieve
+from .helpers.single_flight import join_flight, leave_flight
+from .helpers.streaming import STREAM_BATCHED, STREAM_MODES, DeltaBuffer
+from .helpers.text_processing import estimate_tokens
+from .helpers.vector_store import get_vector_store, aembed_texts
 
 logger = logging.getLogger(__name__)
 
 # Constants
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 DEFAULT_TOP_K = 3
 DEFAULT_MODEL = "gpt-4o-mini"
-
-
-# Global collection cache to reuse across requests
-_collection = None
-
-
-def get_collection():
-    """Get or create ChromaDB collection for caching."""
-    global _collection
-    if _collection is None:
-        _collection = get_chroma_collection()
-    return _collection
+# Bump when _build_prompt changes so answers cached under the old template are not replayed
+PROMPT_VERSION = 1
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -41,20 +38,47 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close(code=4001)
             return
 
+        # The running query (retrieval) task and the answer stream it subscribed to
+        self._query_task = None
+        self._flight = None
+        self._flight_seen = 0
+        self._flight_watch = None
+        # Keeps replayed and live flight events in order
+        self._flight_lock = asyncio.Lock()
+        # Stage timings of the current query; first-token time is taken on the first delta
+        self._timing = None
+        self._awaiting_first_token = False
+
+        # Delta framing negotiated with ?stream=raw|batched
+        query_params = parse_qs(self.scope.get("query_string", b"").decode())
+        self._stream_mode = query_params.get("stream", [settings.RAG_WS_STREAM_MODE])[0]
+        if self._stream_mode not in STREAM_MODES:
+            self._stream_mode = settings.RAG_WS_STREAM_MODE
+        self._deltas = None
+        if self._stream_mode == STREAM_BATCHED:
+            self._deltas = DeltaBuffer(
+                self._send_delta,
+                interval=settings.RAG_WS_FLUSH_INTERVAL_MS / 1000,
+                max_bytes=settings.RAG_WS_FLUSH_BYTES,
+            )
+
         await self.accept()
         logger.info(f"WS accepted user_id={getattr(user, 'id', None)}")
         
         username = getattr(user, 'username', 'Unknown') if user else 'Unknown'
         welcome_message = {
             "type": "welcome",
-            "message": f"Connected as {username}"
+            "message": f"Connected as {username}",
+            "stream": self._stream_mode,
         }
-        await self.send(text_data=json.dumps(welcome_message))
+        await self._send_json(welcome_message)
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection."""
         user_id = getattr(self.scope.get('user', None), 'id', None)
         logger.info(f"WS disconnect user={user_id} code={close_code}")
+        if hasattr(self, "_query_task"):
+            await self._cancel_query(notify=False)
 
     async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages and process chat queries."""
@@ -66,62 +90,306 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # Parse JSON payload
             try:
-                payload = json.loads(text_data)
-            except json.JSONDecodeError:
+                payload = orjson.loads(text_data)
+            except orjson.JSONDecodeError:
                 await self._send_error("Invalid JSON", "Message must be valid JSON format")
                 return
 
+            if payload.get("type") == "cancel":
+                await self._cancel_query(notify=True)
+                return
+
             # Extract and validate query parameters
             query = payload.get("query")
-            top_k = int(payload.get("top_k", DEFAULT_TOP_K))
+            pdf_ids = payload.get("pdf_ids")
+            try:
+                top_k = int(payload.get("top_k", DEFAULT_TOP_K))
+                fetch_k = int(payload.get("fetch_k", settings.RAG_FETCH_K))
+                lambda_mult = float(payload.get("lambda", settings.RAG_MMR_LAMBDA))
+            except (TypeError, ValueError):
+                await self._send_error("Invalid retrieval options", "Fields 'top_k', 'fetch_k' and 'lambda' must be numbers")
+                return
+            if top_k < 1 or fetch_k < 1 or not 0.0 <= lambda_mult <= 1.0:
+                await self._send_error(
+                    "Invalid retrieval options",
+                    "'top_k' and 'fetch_k' must be positive and 'lambda' must be between 0 and 1",
+                )
+                return
 
             if not query or not query.strip():
                 await self._send_error("Missing query", "Field 'query' is required and cannot be empty")
                 return
 
-            # Process the query through RAG pipeline
-            await self._process_query(query, top_k)
+            if estimate_tokens(query) > settings.RAG_MAX_QUERY_TOKENS:
+                await self._send_error("Query too long", f"Field 'query' must be at most {settings.RAG_MAX_QUERY_TOKENS} tokens")
+                return
+
+            if pdf_ids is not None and (
+                not isinstance(pdf_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in pdf_ids)
+            ):
+                await self._send_error("Invalid pdf_ids", "Field 'pdf_ids' must be a list of document ids")
+                return
+            top_k = min(top_k, settings.RAG_MAX_TOP_K)
+            fetch_k = min(fetch_k, settings.RAG_MAX_FETCH_K)
+
+            # A new question supersedes the one still being answered
+            await self._cancel_query(notify=True)
+            self._query_task = asyncio.create_task(self._run_query(query, top_k, pdf_ids, fetch_k, lambda_mult))
 
         except Exception as exc:
             logger.exception("Error in receive")
             await self._send_error("Internal server error", "An error occurred while processing your request")
 
-    async def _process_query(self, query: str, top_k: int):
-        """Process user query through the RAG pipeline."""
+    async def _run_query(self, *args):
+        """Run ``_process_query`` as the socket's tracked query task."""
+        try:
+            await self._process_query(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error processing query")
+            self._finish_timing("error")
+            await self._send_error("Internal server error", "An error occurred while processing your request")
+
+    async def _cancel_query(self, notify: bool):
+        """
+        Stop the current query, if any: cancel its task and leave its answer stream.
+
+        The upstream stream itself is cancelled once no other socket follows it.
+        Sends ``{"type": "cancelled"}`` when ``notify`` is set and something was running.
+        """
+        active = False
+        task = self._query_task
+        self._query_task = None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait([task])
+            active = True
+        if self._flight is not None:
+            await self._leave_flight()
+            active = True
+        if self._deltas is not None:
+            self._deltas.reset()
+        self._finish_timing("cancelled")
+        if active and notify:
+            await self._send_json({"type": "cancelled"})
+
+    async def _process_query(self, query: str, top_k: int, pdf_ids: list[int] = None,
+                             fetch_k: int = None, lambda_mult: float = None):
+        """
+        Process user query through the RAG pipeline, limited to the user's own documents.
+
+        Returns once the answer is subscribed to; its deltas arrive through ``chat_flight``.
+        """
         # Step 1: Generate query embedding
-        query_embeddings = await sync_to_async(embed_texts)([query])
+        owner_id = self.scope["user"].id
+        timing = self._timing = StageTimer("query", QUERY_STAGE_SECONDS, QUERIES, user_id=owner_id)
+        query_embeddings = await aembed_texts([query], user=owner_id, on_queued=self._queued_reporter("embedding"))
         query_embedding = query_embeddings[0]
+        timing.mark("embed")
 
         # Step 2: Retrieve relevant documents from vector store
-        collection = get_collection()
-        results = await sync_to_async(collection.query)(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=["documents", "metadatas"]
+        # The first query for a collection opens it, which must not block the event loop
+        collection = await sync_to_async(get_vector_store, thread_sensitive=False)(owner_id=owner_id)
+        results = await sync_to_async(retrieve, thread_sensitive=False)(
+            collection, query, query_embedding, owner_id, pdf_ids, top_k, fetch_k, lambda_mult
         )
+        timing.mark("retrieve")
 
         # Step 3: Extract documents and build context
-        documents = results.get("documents", [[]])[0]
+        documents = results["documents"]
         if not documents:
+            self._finish_timing("no_context")
             await self._send_error("No relevant context found", "No matching documents found in the knowledge base")
             return
 
-        # Step 4: Build prompt with context
-        context = "\n\n---\n\n".join(documents)
-        prompt = self._build_prompt(context, query)
-
-        # Step 5: Stream LLM response
-        await self._stream_openai_response(prompt)
-
-    def _build_prompt(self, context: str, query: str) -> str:
-        """Build the prompt for the LLM with context and query."""
-        return (
-            "Answer using ONLY the provided context. "
-            "If the answer is not in the context, respond 'I don't know.'\n\n"
-            f"Context:\n{context}\n\n"
-            f"Question: {query}\n\n"
-            f"Answer:"
+        # Step 4: Replay a cached answer to the same question over the same chunks
+        cache = get_response_cache()
+        key = ResponseCache.make_key(query, results["ids"], DEFAULT_MODEL, PROMPT_VERSION)
+        on_complete = None
+        if cache is not None:
+            generation = cache.generation
+            cached = cache.get(key)
+            if cached is not None:
+                self._awaiting_first_token = True
+                await self._replay_response(cached)
+                self._finish_timing("cached")
+                return
+            sources = {metadata["pdf_id"] for metadata in results["metadatas"] if metadata.get("pdf_id") is not None}
+            on_complete = lambda deltas: cache.put(key, deltas, sources, generation)
+
+        # Step 5: Build prompt with as much context as the model budget allows
+        prompt = self._build_prompt(documents, query)
+        timing.mark("prompt")
+        if prompt is None:
+            self._finish_timing("too_long")
+            await self._send_error("Query too long", "The question does not fit in the model's context window")
+            return
+
+        # Step 6: Stream LLM response, sharing one upstream stream between identical concurrent questions
+        payload = {
+            "model": DEFAULT_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+            "max_tokens": settings.RAG_ANSWER_MAX_TOKENS,
+        }
+        flight, started = join_flight(
+            key, payload, self.channel_name, on_complete,
+            user=owner_id, tokens=estimate_tokens(prompt) + settings.RAG_ANSWER_MAX_TOKENS,
         )
+        if not started:
+            logger.info(f"Joined in-flight answer {key[:12]} with {len(flight.events)} events buffered")
+        self._awaiting_first_token = True
+        await self._subscribe(flight)
+
+    def _queued_reporter(self, stage: str):
+        """Build an ``on_queued`` callback telling the client its upstream call is waiting."""
+        async def report(queue_depth: int, waited_ms: int):
+            await self._send_json({"type": "queued", "stage": stage, "queue_depth": queue_depth, "waited_ms": waited_ms})
+        return report
+
+    async def _subscribe(self, flight):
+        """Follow a flight: join its group, then replay what it already produced."""
+        self._flight = flight
+        self._flight_seen = 0
+        async with self._flight_lock:
+            await self.channel_layer.group_add(flight.group, self.channel_name)
+            if await self._catch_up(len(flight.events)):
+                return
+            self._flight_watch = asyncio.create_task(self._watch_flight(flight))
+
+    async def _leave_flight(self):
+        flight, self._flight = self._flight, None
+        watch, self._flight_watch = self._flight_watch, None
+        if watch is not None and watch is not asyncio.current_task():
+            watch.cancel()
+        await self.channel_layer.group_discard(flight.group, self.channel_name)
+        leave_flight(flight, self.channel_name)
+
+    async def chat_flight(self, message):
+        """Channel layer handler for events of the flight this socket follows."""
+        async with self._flight_lock:
+            if self._flight is None or message["flight"] != self._flight.group:
+                return
+            # Group sends are best effort (a full channel or an expired message is
+            # dropped silently), so anything skipped is taken from the flight's log
+            await self._catch_up(message["seq"])
+
+    async def _catch_up(self, seq: int) -> bool:
+        """Send the flight's unsent events up to ``seq``; returns True once the flight has ended."""
+        for event in self._flight.events[self._flight_seen:seq]:
+            if await self._deliver_flight_event(event):
+                return True
+        return False
+
+    async def _watch_flight(self, flight):
+        """
+        Finish the answer from the flight's log once its stream ends.
+
+        Covers a ``done`` or ``error`` group message that never arrived, and a
+        stream task that ended without publishing either.
+        """
+        await asyncio.wait([flight.task])
+        async with self._flight_lock:
+            if self._flight is not flight:
+                return
+            if await self._catch_up(len(flight.events)):
+                return
+            logger.warning(f"Answer stream {flight.group} ended without a final event")
+            await self._deliver_flight_event({
+                "seq": len(flight.events) + 1,
+                "event": "error",
+                "error": "Streaming error",
+                "details": "The response stream ended unexpectedly",
+            })
+
+    async def _deliver_flight_event(self, event: dict) -> bool:
+        """Send one flight event unless already sent; returns True once the flight has ended."""
+        if event["seq"] <= self._flight_seen:
+            return False
+        self._flight_seen = event["seq"]
+        if event["event"] == "delta":
+            await self._add_delta(event["text"])
+            return False
+        if event["event"] == "queued":
+            await self._send_json({
+                "type": "queued",
+                "stage": event["stage"],
+                "queue_depth": event["queue_depth"],
+                "waited_ms": event["waited_ms"],
+            })
+            return False
+        await self._end_answer()
+        if event["event"] == "done":
+            await self._send_json({"type": "done"})
+            if self._timing is not None and not self._awaiting_first_token:
+                self._timing.mark("stream")
+            self._finish_timing("answered")
+        else:
+            await self._send_error(event["error"], event["details"])
+            self._finish_timing("error")
+        await self._leave_flight()
+        return True
+
+    async def _replay_response(self, deltas):
+        """Send a cached answer with the same messages as a live stream."""
+        for delta in deltas:
+            await self._add_delta(delta)
+        await self._end_answer()
+        await self._send_json({"type": "done", "cached": True})
+
+    async def _add_delta(self, text: str):
+        """Send a delta now (raw mode) or through the frame buffer (batched mode)."""
+        if self._awaiting_first_token:
+            self._awaiting_first_token = False
+            if self._timing is not None:
+                self._timing.mark("first_token", since_start=True)
+        if self._deltas is None:
+            await self._send_delta(text)
+        else:
+            await self._deltas.add(text)
+
+    async def _end_answer(self):
+        """Flush buffered deltas so they precede the message ending the answer."""
+        if self._deltas is not None:
+            await self._deltas.flush()
+            self._deltas.reset()
+
+    def _finish_timing(self, outcome: str):
+        """Record the current query's total time and outcome, once."""
+        timing, self._timing = self._timing, None
+        self._awaiting_first_token = False
+        if timing is not None:
+            timing.finish(outcome)
+
+    async def _send_delta(self, text: str):
+        await self._send_json({"type": "delta", "text": text})
+
+    async def _send_json(self, message: dict):
+        await self.send(text_data=orjson.dumps(message).decode())
+
+    def _build_prompt(self, documents: list[str], query: str, model: str = DEFAULT_MODEL) -> str:
+        """
+        Build the prompt for the LLM with context and query.
+
+        Chunks are packed best first into the model's context budget, so the
+        prompt size is bounded regardless of how many chunks were retrieved.
+        Returns None if the question alone leaves no room for context.
+        """
+        def render(context: str) -> str:
+            return (
+                "Answer using ONLY the provided context. "
+                "If the answer is not in the context, respond 'I don't know.'\n\n"
+                f"Context:\n{context}\n\n"
+                f"Question: {query}\n\n"
+                f"Answer:"
+            )
+
+        budget = context_budget(model, estimate_tokens(render("")))
+        packed = pack_context(documents, budget) if budget > 0 else []
+        if not packed:
+            return None
+        return render(CONTEXT_SEPARATOR.join(packed))
 
     async def _send_error(self, error: str, details: str):
         """Send error message to client."""
@@ -129,83 +397,4 @@ class ChatConsumer(AsyncWebsocketConsumer):
             "error": error,
             "details": details
         }
-        await self.send(text_data=json.dumps(error_message))
-
-    async def _stream_openai_response(self, prompt: str):
-        """
-        Stream response from OpenAI API.
-        
-        Sends delta chunks as they arrive and a done message when complete.
-        """
-        headers = {
-            "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        
-        payload = {
-            "model": DEFAULT_MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": True
-        }
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(OPENAI_API_URL, headers=headers, json=payload, timeout=None) as response:
-                    await self._handle_openai_response(response)
-                    
-        except Exception as exc:
-            logger.exception("OpenAI streaming error")
-            await self._send_error("Streaming error", "An error occurred while streaming the response")
-
-    async def _handle_openai_response(self, response):
-        """Handle streaming response from OpenAI API."""
-        if response.status != 200:
-            body = await response.text()
-            logger.error(f"OpenAI stream failed: {response.status} {body}")
-            await self._send_error("LLM service error", f"External AI service returned error {response.status}")
-            return
-
-        async for raw_chunk in response.content:
-            if not raw_chunk:
-                continue
-                
-            try:
-                line = raw_chunk.decode("utf-8").strip()
-            except Exception:
-                continue
-
-            await self._process_stream_chunk(line)
-
-        # Send completion signal
-        await self.send(text_data=json.dumps({"type": "done"}))
-
-    async def _process_stream_chunk(self, line: str):
-        """Process individual chunks from the OpenAI stream."""
-        for part in line.splitlines():
-            part = part.strip()
-            if not part or not part.startswith("data: "):
-                continue
-                
-            data_str = part[len("data: "):]
-            if data_str == "[DONE]":
-                await self.send(text_data=json.dumps({"type": "done"}))
-                return
-                
-            try:
-                chunk_data = json.loads(data_str)
-                choices = chunk_data.get("choices", [])
-                
-                if choices:
-                    delta = choices[0].get("delta", {}).get("content")
-                    if delta is None:
-                        delta = choices[0].get("text")
-                        
-                    if delta:
-                        delta_message = {
-                            "type": "delta",
-                            "text": delta
-                        }
-                        await self.send(text_data=json.dumps(delta_message))
-                        
-            except json.JSONDecodeError:
-                continue
\ No newline at end of file
+        await self._send_json(error_message)
\ No newline at end of file
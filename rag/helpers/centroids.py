@@ -0,0 +1,90 @@
+import logging
+import numpy as np
+
+from .vector_store import VectorStore, collection_name_for, get_vector_store, owner_filter
+
+logger = logging.getLogger(__name__)
+
+CENTROID_COLLECTION = "pdf_centroids"
+
+
+def centroid_id(pdf_id: int) -> str:
+    return f"pdf_{pdf_id}"
+
+
+def get_centroid_store(owner_id: int) -> VectorStore:
+    """Return the small secondary index holding one summary vector per PDF of an owner."""
+    return get_vector_store(collection_name_for(owner_id, base_name=CENTROID_COLLECTION))
+
+
+class CentroidBuilder:
+    """
+    Running mean of a document's unit-normalised chunk embeddings.
+
+    Batches are added as they are stored, so the centroid costs one vector of
+    memory regardless of document size.
+    """
+
+    def __init__(self):
+        self.total = None
+        self.count = 0
+
+    def add(self, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if not len(vectors):
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        batch_sum = (vectors / np.where(norms == 0, 1.0, norms)).sum(axis=0)
+        self.total = batch_sum if self.total is None else self.total + batch_sum
+        self.count += len(vectors)
+
+    def vector(self):
+        """Unit-length centroid, or None if nothing was added."""
+        if self.total is None:
+            return None
+        norm = np.linalg.norm(self.total)
+        return self.total / norm if norm else self.total
+
+
+def store_centroid(pdf_id: int, owner_id: int, name: str, builder: CentroidBuilder):
+    """Write (or replace) a PDF's centroid in the owner's centroid index."""
+    vector = builder.vector()
+    if vector is None:
+        return
+    try:
+        get_centroid_store(owner_id).upsert(
+            ids=[centroid_id(pdf_id)],
+            documents=[name],
+            embeddings=[vector.tolist()],
+            metadatas=[{"pdf_id": pdf_id, "owner_id": owner_id, "chunks": builder.count}],
+        )
+    except Exception as e:
+        logger.error(f"Error storing centroid of PDF {pdf_id}: {str(e)}", exc_info=True)
+        raise
+
+
+def delete_centroid(pdf_id: int, owner_id: int):
+    get_centroid_store(owner_id).delete(ids=[centroid_id(pdf_id)])
+
+
+def select_documents(owner_id: int, query_embedding, limit: int) -> list[int]:
+    """
+    Pick the owner's PDFs whose centroids are closest to the query.
+
+    Args:
+        owner_id (int): Owner whose documents are searched.
+        query_embedding (list of float): Embedding of the query.
+        limit (int): Maximum number of PDFs.
+
+    Returns:
+        list of int: PDF ids, closest first; empty if the owner has no centroids yet.
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    hits = get_centroid_store(owner_id).query(
+        query_embeddings=[(query / norm if norm else query).tolist()],
+        n_results=limit,
+        where=owner_filter(owner_id),
+        include=("metadatas",),
+    )
+    return [metadata["pdf_id"] for metadata in hits["metadatas"][0]]
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+from django.conf import settings
+
+from .text_processing import CHARS_PER_TOKEN, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Total context window (prompt + completion) of the chat models we send prompts to
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# A truncated chunk shorter than this carries too little to be worth sending
+MIN_TRUNCATED_TOKENS = 50
+
+
+def context_budget(model: str, prompt_tokens: int) -> int:
+    """
+    Number of tokens available for retrieved context in a prompt.
+
+    Args:
+        model (str): Chat model the prompt is sent to.
+        prompt_tokens (int): Estimated tokens of the prompt without context (instructions and question).
+
+    Returns:
+        int: Token budget for the context, ``RAG_CONTEXT_MAX_TOKENS`` at most; may be zero or negative
+            when the prompt alone does not fit the model.
+    """
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    available = window - settings.RAG_ANSWER_MAX_TOKENS - prompt_tokens
+    return min(settings.RAG_CONTEXT_MAX_TOKENS, available)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Leave room for the ellipsis marking the cut
+    limit = (max_tokens - 1) * CHARS_PER_TOKEN
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + " …"
+
+
+def pack_context(documents: list[str], budget: int, separator: str = CONTEXT_SEPARATOR) -> list[str]:
+    """
+    Fit ranked chunks into a token budget.
+
+    Chunks are taken in the given order (best first) until the budget is
+    spent; the first chunk that does not fit is truncated at a word boundary
+    if a useful amount of budget remains, and everything after it is dropped.
+
+    Args:
+        documents (list of str): Chunk texts, most relevant first.
+        budget (int): Maximum estimated tokens of the joined context.
+        separator (str): Text placed between chunks.
+
+    Returns:
+        list of str: The chunks to send, in order.
+    """
+    separator_tokens = estimate_tokens(separator)
+    packed = []
+    used = 0
+    for document in documents:
+        cost = estimate_tokens(document) + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed.append(document)
+            used += cost
+            continue
+        remaining = budget - used - (separator_tokens if packed else 0)
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            packed.append(_truncate(document, remaining))
+        break
+
+    if len(packed) < len(documents):
+        logger.info(f"Packed {len(packed)} of {len(documents)} chunks into a {budget}-token context")
+    return packed
\ No newline at end of file
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+
+# Rows deleted per statement when trimming the disk tier; the disk lock is released between batches
+EVICTION_BATCH = 1000
+
+# Milliseconds a statement waits for another connection's write lock before failing
+BUSY_TIMEOUT_MS = 5000
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with an in-memory LRU tier in front of SQLite.
+
+    Entries are keyed by ``sha256(model, text)`` and stored as float32 blobs.
+    Both tiers are bounded by entry count; the disk tier evicts least recently
+    accessed rows in small batches once it grows past its limit. Each tier has
+    its own lock, so memory hits never wait for SQLite.
+    """
+
+    def __init__(self, path: str, memory_items: int, disk_items: int, busy_timeout_ms: int = BUSY_TIMEOUT_MS):
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._eviction_lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        return hashlib.sha256(model.encode() + b"\0" + text.encode()).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict:
+        """
+        Look up embeddings for the given keys.
+
+        Args:
+            keys (list of bytes): Keys built with ``make_key``.
+
+        Returns:
+            dict: Mapping of found key to embedding (list of float).
+        """
+        found = self.get_memory(keys)
+        found.update(self.get_disk([key for key in keys if key not in found]))
+        return found
+
+    def get_memory(self, keys: list[bytes]) -> dict:
+        """Look up keys in the in-memory tier only; never touches SQLite."""
+        found = {}
+        with self._memory_lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.memory_hits += len(found)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def get_disk(self, keys: list[bytes]) -> dict:
+        """Look up keys missing from memory in SQLite, promoting hits to the memory tier."""
+        if not keys:
+            return {}
+        rows = []
+        with self._disk_lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall())
+            if rows:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE key = ?", [(now, key) for key, _ in rows]
+                )
+            self.disk_hits += len(rows)
+            self.misses += len(keys) - len(rows)
+
+        found = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+        with self._memory_lock:
+            for key, vector in found.items():
+                self._remember(key, vector)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, items: dict):
+        """
+        Store embeddings in both tiers.
+
+        Args:
+            items (dict): Mapping of key to embedding (sequence of float).
+        """
+        self.put_memory(items)
+        self.put_disk(items)
+
+    def put_memory(self, items: dict):
+        """Store embeddings in the in-memory tier only."""
+        with self._memory_lock:
+            for key, embedding in items.items():
+                self._remember(key, np.asarray(embedding, dtype=np.float32))
+
+    def put_disk(self, items: dict):
+        """Store embeddings in SQLite, then trim it if it grew past ``disk_items``."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(embedding, dtype=np.float32).tobytes(), now) for key, embedding in items.items()]
+        with self._disk_lock:
+            # IMMEDIATE takes the write lock up front instead of failing to upgrade a read lock later
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)", rows
+                )
+                added = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # Never leave the shared connection inside a transaction, or every later write fails
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._disk_count += added
+        if self._disk_count > self.disk_items:
+            self._evict_disk()
+
+    def stats(self) -> dict:
+        with self._memory_lock:
+            memory_items = len(self._memory)
+        return {
+            "memory_items": memory_items,
+            "disk_items": self._disk_count,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def _remember(self, key: bytes, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # One thread trims at a time; others carry on, the table is only briefly over its cap
+        if not self._eviction_lock.acquire(blocking=False):
+            return
+        try:
+            # Trim to 90% of capacity so eviction runs once per batch of inserts, not per insert
+            target = int(self.disk_items * 0.9)
+            evicted = 0
+            while self._disk_count > target:
+                with self._disk_lock:
+                    cursor = self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY accessed LIMIT ?)",
+                        (min(EVICTION_BATCH, self._disk_count - target),),
+                    )
+                    if cursor.rowcount <= 0:
+                        break
+                    self._disk_count -= cursor.rowcount
+                    evicted += cursor.rowcount
+            logger.info(f"Evicted {evicted} embeddings from disk cache")
+        finally:
+            self._eviction_lock.release()
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide embedding cache, or None when caching is disabled.
+    """
+    global _embedding_cache
+    if not settings.RAG_EMBEDDING_CACHE_ENABLED:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=settings.RAG_EMBEDDING_CACHE_PATH,
+                memory_items=settings.RAG_EMBEDDING_CACHE_MEMORY_ITEMS,
+                disk_items=settings.RAG_EMBEDDING_CACHE_DISK_ITEMS,
+            )
+        return _embedding_cache
+
+
+
+def _collect_stats() -> dict:
+    cache = _embedding_cache
+    stats = cache.stats() if cache is not None else {
+        "memory_items": 0, "disk_items": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+    }
+    return {(name,): value for name, value in stats.items()}
+
+
+gauge(
+    "rag_embedding_cache",
+    "Cached embeddings: items per tier, and memory hits, disk hits and misses since start.",
+    _collect_stats,
+    labels=("stat",),
+)
\ No newline at end of file
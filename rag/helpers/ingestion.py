@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+
+from ..models import UploadedPDF
+from .centroids import CentroidBuilder, delete_centroid, store_centroid
+from .lexical_index import LexicalSegmentBuilder, get_lexical_index
+from .metrics import INGESTION_DOCUMENTS, INGESTION_STAGE_SECONDS, StageTimer, gauge
+from .pipeline import run_ingestion_pipeline
+from .response_cache import invalidate_pdf_responses
+from .text_processing import iter_pdf_pages
+from .vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueue:
+    """
+    Bounded in-process queue of PDF ids drained by a fixed pool of worker threads.
+
+    Workers are daemon threads started on first submit, so importing this module
+    (e.g. from management commands) never spawns threads.
+    """
+
+    def __init__(self, workers: int, maxsize: int):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._workers = max(1, workers)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, pdf_id: int):
+        """
+        Enqueue a PDF for indexing.
+
+        Raises:
+            queue.Full: If the queue has no free slot.
+        """
+        self._ensure_started()
+        self._queue.put_nowait(pdf_id)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"rag-ingest-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            pdf_id = self._queue.get()
+            try:
+                index_pdf(pdf_id)
+            except Exception:
+                logger.exception(f"Unhandled error indexing PDF {pdf_id}")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+_ingestion_queue = None
+_ingestion_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """Return the process-wide ingestion queue, creating it on first use."""
+    global _ingestion_queue
+    with _ingestion_queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionQueue(
+                workers=settings.RAG_INGESTION_WORKERS,
+                maxsize=settings.RAG_INGESTION_QUEUE_SIZE,
+            )
+        return _ingestion_queue
+
+
+gauge(
+    "rag_ingestion_queue_depth",
+    "PDFs waiting for an ingestion worker.",
+    lambda: _ingestion_queue.qsize() if _ingestion_queue is not None else 0,
+)
+
+
+def _update_job(pdf_id: int, **fields):
+    UploadedPDF.objects.filter(pk=pdf_id).update(**fields)
+
+
+def _find_indexed_copy(pdf_instance: UploadedPDF):
+    """Another indexed upload with the same content, whose vectors can be reused."""
+    if not pdf_instance.content_hash:
+        return None
+    return (
+        UploadedPDF.objects.filter(content_hash=pdf_instance.content_hash, status=UploadedPDF.Status.INDEXED)
+        .exclude(pk=pdf_instance.pk)
+        .order_by("-pk")
+        .first()
+    )
+
+
+def _copy_chunks(source: UploadedPDF, write_batch) -> int:
+    """
+    Re-store the chunks of an identical, already indexed PDF without embedding anything.
+
+    Args:
+        source (UploadedPDF): Indexed PDF with the same content hash.
+        write_batch (callable): ``write_batch(start, documents, embeddings, metadatas)``.
+
+    Returns:
+        int: Number of chunks copied; 0 if the source has none left.
+    """
+    found = get_vector_store(owner_id=source.owner_id).get(
+        where={"pdf_id": source.pk}, include=("documents", "metadatas", "embeddings")
+    )
+    rows = sorted(
+        zip(found["metadatas"], found["documents"], found["embeddings"]),
+        key=lambda row: row[0].get("chunk_index", 0),
+    )
+    batch_size = settings.RAG_INGESTION_BATCH_SIZE
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        write_batch(
+            start,
+            [document for _, document, _ in batch],
+            [list(embedding) for _, _, embedding in batch],
+            [metadata for metadata, _, _ in batch],
+        )
+    return len(rows)
+
+
+def delete_pdf_index(pdf_id: int, owner_id: int):
+    """
+    Remove every chunk of a PDF from the vector store and lexical index, and its cached answers.
+
+    The vector store delete is a single ``where`` on ``pdf_id``, not one call per chunk.
+    """
+    try:
+        get_vector_store(owner_id=owner_id).delete(where={"pdf_id": pdf_id})
+        delete_centroid(pdf_id, owner_id)
+        get_lexical_index().remove_pdf(pdf_id)
+        invalidate_pdf_responses(pdf_id)
+    except Exception as e:
+        logger.error(f"Error deleting chunks of PDF {pdf_id}: {str(e)}", exc_info=True)
+        raise
+
+
+def _discard_partial_index(pdf_id: int, owner_id: int):
+    """Best-effort removal of whatever a failed indexing attempt already stored."""
+    try:
+        delete_pdf_index(pdf_id, owner_id)
+    except Exception:
+        logger.warning(f"Could not remove partial index of PDF {pdf_id}")
+
+
+def index_pdf(pdf_id: int):
+    """
+    Extract, chunk, embed and store a PDF, recording progress on its UploadedPDF row.
+
+    A PDF whose content hash matches an already indexed upload reuses that
+    upload's chunks and embeddings instead of being processed again. Chunks
+    stored by an attempt that fails are removed again.
+
+    Args:
+        pdf_id (int): Primary key of the UploadedPDF to index.
+    """
+    try:
+        pdf_instance = UploadedPDF.objects.get(pk=pdf_id)
+    except UploadedPDF.DoesNotExist:
+        logger.warning(f"Skipping ingestion of missing PDF {pdf_id}")
+        return
+
+    _update_job(pdf_id, status=UploadedPDF.Status.PROCESSING, chunks_done=0, error="")
+    invalidate_pdf_responses(pdf_id)
+    timer = StageTimer("ingestion", INGESTION_STAGE_SECONDS, INGESTION_DOCUMENTS, pdf_id=pdf_id)
+    timings = {}
+
+    lexical = LexicalSegmentBuilder(pdf_id, pdf_instance.owner_id)
+    centroid = CentroidBuilder()
+
+    def write_batch(start, documents, embeddings, chunk_metadatas):
+        ids = [f"{pdf_id}_{start + i}" for i in range(len(documents))]
+        store.upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[
+                {
+                    **metadata,
+                    "pdf_name": pdf_instance.file.name,
+                    "pdf_id": pdf_id,
+                    "owner_id": pdf_instance.owner_id,
+                    "chunk_index": start + i,
+                }
+                for i, metadata in enumerate(chunk_metadatas)
+            ],
+        )
+        lexical.add(ids, documents)
+        centroid.add(embeddings)
+        # Chunks are searchable as soon as their batch is stored
+        done = start + len(documents)
+        _update_job(pdf_id, chunks_done=done, chunks_total=done)
+
+    def store_batch(start, chunks, embeddings):
+        write_batch(start, [chunk.text for chunk in chunks], embeddings, [chunk.metadata() for chunk in chunks])
+
+    try:
+        store = get_vector_store(owner_id=pdf_instance.owner_id)
+        stored = 0
+        source = _find_indexed_copy(pdf_instance)
+        if source is not None:
+            started = time.perf_counter()
+            try:
+                stored = _copy_chunks(source, write_batch)
+            except Exception:
+                logger.warning(f"Could not reuse chunks of PDF {source.pk} for PDF {pdf_id}, indexing it", exc_info=True)
+                _discard_partial_index(pdf_id, pdf_instance.owner_id)
+                lexical = LexicalSegmentBuilder(pdf_id, pdf_instance.owner_id)
+                centroid = CentroidBuilder()
+                stored = 0
+            timer.record("copy", time.perf_counter() - started)
+            if stored:
+                logger.info(f"Reused {stored} chunks of identical PDF {source.pk} for PDF {pdf_id}")
+
+        if not stored:
+            try:
+                stored = run_ingestion_pipeline(
+                    iter_pdf_pages(pdf_instance.file.path), store_batch, user=pdf_instance.owner_id, timings=timings
+                )
+            finally:
+                for stage, seconds in timings.items():
+                    timer.record(stage, seconds)
+        if not stored:
+            _update_job(pdf_id, status=UploadedPDF.Status.FAILED, error="No text content found in the PDF file")
+            timer.finish("empty")
+            return
+
+        get_lexical_index().add_segment(lexical.build())
+        store_centroid(pdf_id, pdf_instance.owner_id, pdf_instance.file.name, centroid)
+        if not UploadedPDF.objects.filter(pk=pdf_id).exists():
+            # Deleted while being indexed: the delete could not see chunks written since
+            delete_pdf_index(pdf_id, pdf_instance.owner_id)
+            timer.finish("deleted")
+            return
+        # Answers cached while the document was half indexed are stale now
+        invalidate_pdf_responses(pdf_id)
+        logger.info(f"Indexed {stored} chunks of PDF {pdf_id}")
+        _update_job(pdf_id, status=UploadedPDF.Status.INDEXED, is_indexed=True)
+        timer.finish("reused" if source is not None and not timings else "indexed", chunks=stored)
+
+    except Exception as e:
+        logger.error(f"Error processing PDF {pdf_id}: {str(e)}", exc_info=True)
+        # Batches stored before the failure would otherwise stay searchable
+        _discard_partial_index(pdf_id, pdf_instance.owner_id)
+        _update_job(pdf_id, status=UploadedPDF.Status.FAILED, error="Failed to process the PDF file")
+        timer.finish("failed")
\ No newline at end of file
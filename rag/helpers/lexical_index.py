@@ -0,0 +1,293 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Han and kana are written without spaces, so each character is a term of its own
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+# Identifiers such as "A-123.4", "ISO/IEC" or "clause_7" stay whole; their parts are indexed too
+_TOKEN = re.compile(rf"[{_CJK}]|[^\W_{_CJK}]+(?:[-_./:][^\W_{_CJK}]+)*")
+_PART = re.compile(rf"[^\W_{_CJK}]+")
+
+# Directory changes this recent may share a timestamp with a later one, so they are not trusted yet
+_SETTLE_NS = 1_000_000_000
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into case-folded lexical terms, in any script.
+
+    Args:
+        text (str): Text to tokenize.
+
+    Returns:
+        list of str: Terms; compound identifiers yield the whole token followed by its parts.
+    """
+    terms = []
+    for match in _TOKEN.finditer(text.casefold()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(_PART.findall(token))
+    return terms
+
+
+class LexicalSegment:
+    """
+    Inverted index over the chunks of one PDF, stored as flat postings arrays.
+
+    Postings for ``terms[i]`` are ``docs[offsets[i]:offsets[i + 1]]`` (local
+    chunk indices) with matching term frequencies in ``tfs``.
+    """
+
+    def __init__(self, pdf_id: int, owner_id: int, chunk_ids, lengths, terms, offsets, docs, tfs):
+        self.pdf_id = pdf_id
+        self.owner_id = owner_id
+        self.chunk_ids = chunk_ids
+        self.lengths = lengths
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lookup = {term: i for i, term in enumerate(terms.tolist())}
+
+    def postings(self, term: str):
+        i = self.lookup.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def save(self, path: Path):
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            meta=np.array([self.pdf_id, self.owner_id], dtype=np.int64),
+            chunk_ids=self.chunk_ids,
+            lengths=self.lengths,
+            terms=self.terms,
+            offsets=self.offsets,
+            docs=self.docs,
+            tfs=self.tfs,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as data:
+            pdf_id, owner_id = data["meta"].tolist()
+            return cls(pdf_id, owner_id, data["chunk_ids"], data["lengths"], data["terms"],
+                       data["offsets"], data["docs"], data["tfs"])
+
+
+class LexicalSegmentBuilder:
+    """Accumulates postings for one PDF's chunks as they are stored."""
+
+    def __init__(self, pdf_id: int, owner_id: int):
+        self.pdf_id = pdf_id
+        self.owner_id = owner_id
+        self.chunk_ids = []
+        self.lengths = array("I")
+        self.postings = {}
+
+    def add(self, chunk_ids: list[str], texts: list[str]):
+        for chunk_id, text in zip(chunk_ids, texts):
+            doc = len(self.chunk_ids)
+            self.chunk_ids.append(chunk_id)
+            terms = tokenize(text)
+            self.lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = self.postings[term] = (array("I"), array("H"))
+                entry[0].append(doc)
+                entry[1].append(min(tf, 65535))
+
+    def build(self) -> LexicalSegment:
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        docs = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            doc_list, tf_list = self.postings[term]
+            docs[offsets[i]:offsets[i + 1]] = doc_list
+            tfs[offsets[i]:offsets[i + 1]] = tf_list
+        return LexicalSegment(
+            self.pdf_id,
+            self.owner_id,
+            np.array(self.chunk_ids, dtype=str),
+            np.frombuffer(self.lengths, dtype=np.uint32).copy() if self.lengths else np.zeros(0, dtype=np.uint32),
+            np.array(terms, dtype=str),
+            offsets,
+            docs,
+            tfs,
+        )
+
+
+class LexicalIndex:
+    """
+    BM25 index made of one on-disk segment per PDF, grouped by owner in memory.
+
+    Segments are written once per indexed PDF and replaced or removed as a
+    whole, so updates never rewrite other documents' postings. Scoring
+    statistics (document count, average length, document frequency) are taken
+    over the searched owner's segments. Segments written or removed by other
+    processes are picked up when the directory changes.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._by_owner = {}
+        # File name -> (inode, mtime, size) of each loaded segment file
+        self._files = {}
+        self._dir_version = None
+        self._refresh()
+
+    def add_segment(self, segment: LexicalSegment):
+        """Persist and publish a PDF's segment, replacing any previous one."""
+        file = self.path / f"{segment.pdf_id}.npz"
+        segment.save(file)
+        with self._lock:
+            self._publish(segment)
+            self._files[file.name] = _signature(os.stat(file))
+
+    def remove_pdf(self, pdf_id: int):
+        """Drop a PDF's segment from memory and disk."""
+        with self._lock:
+            self._discard(pdf_id)
+            self._files.pop(f"{pdf_id}.npz", None)
+        try:
+            os.remove(self.path / f"{pdf_id}.npz")
+        except FileNotFoundError:
+            pass
+
+    def _refresh(self):
+        """Load segments that appeared or changed on disk and drop removed ones."""
+        version = os.stat(self.path).st_mtime_ns
+        if version == self._dir_version:
+            return
+        with self._lock:
+            if version == self._dir_version:
+                return
+            found = {}
+            for entry in os.scandir(self.path):
+                if not entry.name.endswith(".npz") or entry.name.endswith(".tmp.npz"):
+                    continue
+                try:
+                    found[entry.name] = _signature(entry.stat())
+                except FileNotFoundError:
+                    continue
+            for name in self._files.keys() - found.keys():
+                self._discard(int(name.removesuffix(".npz")))
+            for name, signature in found.items():
+                if self._files.get(name) == signature:
+                    continue
+                try:
+                    self._publish(LexicalSegment.load(self.path / name))
+                except Exception:
+                    logger.exception(f"Skipping unreadable lexical segment {self.path / name}")
+            self._files = found
+            self._dir_version = version if time.time_ns() - version > _SETTLE_NS else None
+
+    def _publish(self, segment: LexicalSegment):
+        self._discard(segment.pdf_id)
+        owned = dict(self._by_owner.get(segment.owner_id, {}))
+        owned[segment.pdf_id] = segment
+        self._by_owner[segment.owner_id] = owned
+
+    def _discard(self, pdf_id: int):
+        for owner_id, owned in self._by_owner.items():
+            if pdf_id in owned:
+                owned = dict(owned)
+                del owned[pdf_id]
+                self._by_owner[owner_id] = owned
+                return
+
+    def search(self, query: str, owner_id: int, pdf_ids: list[int] = None, limit: int = 10) -> list[tuple[str, float]]:
+        """
+        Rank an owner's chunks against a query with BM25.
+
+        Args:
+            query (str): Query text.
+            owner_id (int): Owner whose documents are searched.
+            pdf_ids (list of int): Optionally restrict to these PDFs.
+            limit (int): Maximum number of hits.
+
+        Returns:
+            list of tuple: ``(chunk_id, score)`` pairs, best first.
+        """
+        self._refresh()
+        segments = list(self._by_owner.get(owner_id, {}).values())
+        if pdf_ids:
+            wanted = set(pdf_ids)
+            segments = [s for s in segments if s.pdf_id in wanted]
+        terms = set(tokenize(query))
+        if not segments or not terms:
+            return []
+
+        total_docs = sum(len(s.chunk_ids) for s in segments)
+        avg_length = max(1.0, sum(int(s.lengths.sum()) for s in segments) / max(1, total_docs))
+
+        postings = {}
+        for term in terms:
+            hits = [(s, p) for s in segments if (p := s.postings(term)) is not None]
+            if hits:
+                postings[term] = hits
+
+        scores = {}
+        for term, hits in postings.items():
+            df = sum(len(p[0]) for _, p in hits)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for segment, (docs, tfs) in hits:
+                tf = tfs.astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths[docs] / avg_length)
+                contribution = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                segment_scores = scores.get(segment.pdf_id)
+                if segment_scores is None:
+                    segment_scores = scores[segment.pdf_id] = (segment, np.zeros(len(segment.chunk_ids), dtype=np.float32))
+                # A term's postings list each chunk once, so plain fancy-index += is safe
+                segment_scores[1][docs] += contribution
+
+        candidates = []
+        for segment, segment_scores in scores.values():
+            rows = np.flatnonzero(segment_scores)
+            if len(rows) > limit:
+                rows = rows[np.argpartition(-segment_scores[rows], limit)[:limit]]
+            candidates.extend((float(segment_scores[r]), str(segment.chunk_ids[r])) for r in rows)
+        candidates.sort(reverse=True)
+        return [(chunk_id, score) for score, chunk_id in candidates[:limit]]
+
+
+def _signature(stat: os.stat_result) -> tuple:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Return the process-wide lexical index, loading it from disk on first use."""
+    global _lexical_index
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            _lexical_index = LexicalIndex(settings.RAG_LEXICAL_INDEX_DIR)
+        return _lexical_index
@@ -0,0 +1,270 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger("rag.timing")
+
+# Seconds; spans a cached replay (milliseconds) to a long answer or a large document (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the series for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Cumulative fixed-bucket histogram; ``observe`` is a bisect and three additions under a lock.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        counts, total, count = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+        labels = _format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}"]
+
+
+class Gauge(_Metric):
+    """
+    Gauge read from a callback at scrape time.
+
+    ``collect()`` returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.collect()
+        except Exception:
+            logger.exception(f"Failed to collect gauge {self.name}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of this process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Re-registering (e.g. a module reloaded by the autoreloader) keeps the first instance
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def histogram(name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+def counter(name: str, documentation: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name: str, documentation: str, collect, labels: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, collect, labels))
+
+
+QUERY_STAGE_SECONDS = histogram(
+    "rag_query_stage_seconds",
+    "Chat query latency by stage (embed, retrieve, prompt, first_token, stream, total).",
+    labels=("stage",),
+)
+QUERIES = counter("rag_queries_total", "Chat queries by outcome.", labels=("outcome",))
+INGESTION_STAGE_SECONDS = histogram(
+    "rag_ingestion_stage_seconds",
+    "Time spent per document in each ingestion stage (extract, chunk, embed, store, copy, total).",
+    labels=("stage",),
+)
+INGESTION_DOCUMENTS = counter("rag_ingestion_documents_total", "Indexed documents by outcome.", labels=("outcome",))
+UPLOAD_SECONDS = histogram("rag_upload_seconds", "Time to accept an upload (validate, save, enqueue).")
+VECTOR_UPSERT_BATCH_SECONDS = histogram(
+    "rag_vector_upsert_batch_seconds",
+    "Time to write one batch of vectors to the vector store, by backend.",
+    labels=("backend",),
+)
+
+
+class StageTimer:
+    """
+    Times the consecutive stages of one request.
+
+    ``mark(stage)`` records the time since the previous mark into
+    ``histogram`` under that stage, and ``finish(outcome)`` records the total,
+    counts the outcome and, with ``RAG_TIMING_LOG`` enabled, writes one JSON
+    line with every stage to the ``rag.timing`` logger.
+    """
+
+    __slots__ = ("kind", "histogram", "outcomes", "fields", "stages", "started", "last", "finished")
+
+    def __init__(self, kind: str, histogram: Histogram, outcomes: Counter = None, **fields):
+        self.kind = kind
+        self.histogram = histogram
+        self.outcomes = outcomes
+        self.fields = fields
+        self.stages = {}
+        self.started = self.last = time.perf_counter()
+        self.finished = False
+
+    def mark(self, stage: str, since_start: bool = False) -> float:
+        """Record the time since the previous mark (or since the start) under ``stage``."""
+        now = time.perf_counter()
+        elapsed = now - (self.started if since_start else self.last)
+        self.last = now
+        self.record(stage, elapsed)
+        return elapsed
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.histogram.labels(stage).observe(seconds)
+
+    def finish(self, outcome: str, **fields):
+        """Record the total and the outcome; later calls are ignored."""
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self.started
+        self.histogram.labels("total").observe(total)
+        if self.outcomes is not None:
+            self.outcomes.labels(outcome).inc()
+        if settings.RAG_TIMING_LOG:
+            record = {
+                "kind": self.kind,
+                "outcome": outcome,
+                **self.fields,
+                **fields,
+                **{f"{stage}_ms": round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+                "total_ms": round(total * 1000, 2),
+            }
+            timing_logger.info(json.dumps(record, separators=(",", ":")))
\ No newline at end of file
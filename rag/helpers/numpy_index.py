@@ -0,0 +1,473 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single process per index directory
+    fcntl = None
+
+from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+LOCK_FILE = "lock"
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+_SUFFIXES = {"float32": ".f32", "float16": ".f16", "int8": ".i8"}
+
+# Compact matrices are converted to float32 this many rows at a time while scanning, small enough to stay in cache
+BLOCK_ROWS = 256
+
+
+def _quantize_int8(vectors):
+    """Symmetric int8 quantization with one float32 scale per row."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class _Segment:
+    """
+    One append-only block of rows: a vector matrix on disk plus ids, documents and metadata.
+
+    ``vectors`` is the matrix searches scan: float32, float16, or int8 with a
+    float32 ``scales`` entry per row. ``exact`` is the float32 copy used to
+    rescore the shortlist of a compact segment, or None if it was not kept.
+    """
+
+    def __init__(self, name: str, vectors, ids: list, documents: list, metadatas: list, deleted=(),
+                 scales=None, exact=None):
+        self.name = name
+        self.vectors = vectors
+        self.scales = scales
+        self.exact = vectors if vectors.dtype == np.float32 else exact
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.norms = self._norms() if len(ids) else np.zeros(0, dtype=np.float32)
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.alive[list(deleted)] = False
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def compact(self) -> bool:
+        return self.vectors.dtype != np.float32
+
+    def dequantize(self, rows):
+        """Rows of ``vectors`` as float32 (approximate for compact segments)."""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def exact_vectors(self, rows):
+        """Rows at full precision when available, else dequantized."""
+        return np.asarray(self.exact[rows]) if self.exact is not None else self.dequantize(rows)
+
+    def _blocks(self, rows=None):
+        """Yield the rows (all if None) of a compact matrix as float32 blocks, before scaling."""
+        count = len(self) if rows is None else len(rows)
+        for start in range(0, count, BLOCK_ROWS):
+            index = slice(start, start + BLOCK_ROWS) if rows is None else rows[start:start + BLOCK_ROWS]
+            yield np.asarray(self.vectors[index], dtype=np.float32)
+
+    def dot(self, query, rows=None):
+        """Dot products of ``query`` with the rows (all if None), converting compact matrices block by block."""
+        if not self.compact:
+            return self.vectors @ query if rows is None else self.vectors[rows] @ query
+        products = np.concatenate([block @ query for block in self._blocks(rows)])
+        if self.scales is not None:
+            products *= self.scales if rows is None else self.scales[rows]
+        return products
+
+    def _norms(self):
+        if not self.compact:
+            return np.einsum("ij,ij->i", self.vectors, self.vectors)
+        norms = np.concatenate([np.einsum("ij,ij->i", block, block) for block in self._blocks()])
+        if self.scales is not None:
+            norms *= self.scales ** 2
+        return norms
+
+    def column(self, key: str):
+        """Metadata values for ``key`` as an object array (None where missing), built on first use."""
+        values = self._columns.get(key)
+        if values is None:
+            values = np.empty(len(self.metadatas), dtype=object)
+            values[:] = [metadata.get(key) for metadata in self.metadatas]
+            self._columns[key] = values
+        return values
+
+    def deleted_rows(self) -> list:
+        return np.flatnonzero(~self.alive).tolist()
+
+
+def _compare(column, op: str, value):
+    if op == "$eq":
+        return column == value
+    if op == "$ne":
+        return column != value
+    if op == "$in":
+        mask = np.zeros(len(column), dtype=bool)
+        for item in value:
+            mask |= column == item
+        return mask
+    if op == "$nin":
+        return ~_compare(column, "$in", value)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        numeric = np.array([v if isinstance(v, (int, float)) else np.nan for v in column], dtype=float)
+        with np.errstate(invalid="ignore"):
+            return {
+                "$gt": numeric > value,
+                "$gte": numeric >= value,
+                "$lt": numeric < value,
+                "$lte": numeric <= value,
+            }[op]
+    raise ValueError(f"Unsupported filter operator {op}")
+
+
+def _match(segment: _Segment, where: dict):
+    """Evaluate a Chroma-style ``where`` filter against a segment, returning a row mask."""
+    mask = np.ones(len(segment), dtype=bool)
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                mask &= _match(segment, clause)
+        elif key == "$or":
+            either = np.zeros(len(segment), dtype=bool)
+            for clause in condition:
+                either |= _match(segment, clause)
+            mask &= either
+        elif isinstance(condition, dict):
+            for op, value in condition.items():
+                mask &= _compare(segment.column(key), op, value)
+        else:
+            mask &= segment.column(key) == condition
+    return mask
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector index over memory-mapped segments.
+
+    Each write appends a new segment (``seg-N.f32`` matrix plus ``seg-N.json``
+    rows); overwritten and deleted rows are tombstoned in the manifest. Small
+    segments are merged once there are more than ``max_segments``. Search is a
+    vectorised dot product per segment with ``argpartition`` top-k, and
+    distances are squared L2 to match Chroma's default space.
+
+    With ``dtype`` float16 or int8, new segments are scanned from a half- or
+    quarter-size matrix (``seg-N.f16`` / ``seg-N.i8`` + ``seg-N.scale``). If
+    ``rescore_factor`` is positive the float32 matrix is kept on disk too, and
+    the ``n_results * rescore_factor`` best rows of each segment are re-ranked
+    with it; only those rows are read, so it costs disk but little memory.
+    Segments keep the dtype they were written with until they are compacted.
+
+    Several processes (server workers, management commands) may share a
+    directory: writes hold an exclusive ``flock`` on it while they re-read,
+    change and rewrite the manifest, segment names are unique per writer, and
+    every query or write first reloads the manifest if another process replaced it.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, path, name: str, max_segments: int = 16, dtype: str = "float32", rescore_factor: int = 4):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+        self.name = name
+        self.path = Path(path) / name
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_segments = max_segments
+        self.dtype = dtype
+        self.rescore_factor = max(0, rescore_factor)
+        self._lock = threading.RLock()
+        self._dim = None
+        self._next_segment = 1
+        self._segments = []
+        self._locations = {}
+        self._version = None
+        self._refresh()
+
+    # Persistence
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold this store's lock and the directory's file lock, shared with other processes. Not reentrant."""
+        with self._lock, open(self.path / LOCK_FILE, "a+b") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _manifest_version(self):
+        # The manifest is replaced, never modified in place, so a new inode means new contents
+        try:
+            stat = os.stat(self.path / MANIFEST)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        """Reload the manifest if another process (or store instance) replaced it since it was read."""
+        if self._manifest_version() != self._version:
+            with self._exclusive():
+                self._load_if_changed()
+
+    def _load_if_changed(self):
+        """Re-read the manifest, reusing open segments; callers hold ``_exclusive``."""
+        version = self._manifest_version()
+        if version is None or version == self._version:
+            return
+        manifest = json.loads((self.path / MANIFEST).read_text())
+        self._dim = manifest["dim"]
+        self._next_segment = manifest["next_segment"]
+        opened = {segment.name: segment for segment in self._segments}
+        segments = []
+        for entry in manifest["segments"]:
+            segment = opened.get(entry["name"])
+            if segment is None:
+                segment = self._open_segment(
+                    entry["name"], entry["rows"], entry.get("deleted", []), entry.get("dtype", "float32")
+                )
+            else:
+                alive = np.ones(len(segment), dtype=bool)
+                alive[entry.get("deleted", [])] = False
+                segment.alive = alive
+            segments.append(segment)
+        self._segments = segments
+        self._version = version
+        self._reindex()
+
+    def _open_segment(self, name: str, rows: int, deleted=(), dtype: str = "float32"):
+        rows_data = json.loads((self.path / f"{name}.json").read_text())
+        shape = (rows, self._dim)
+        vectors = np.memmap(self.path / f"{name}{_SUFFIXES[dtype]}", dtype=dtype, mode="r", shape=shape)
+        scales = exact = None
+        if dtype == "int8":
+            scales = np.fromfile(self.path / f"{name}.scale", dtype=np.float32)
+        if dtype != "float32" and (self.path / f"{name}.f32").exists():
+            exact = np.memmap(self.path / f"{name}.f32", dtype=np.float32, mode="r", shape=shape)
+        return _Segment(
+            name, vectors, rows_data["ids"], rows_data["documents"], rows_data["metadatas"], deleted,
+            scales=scales, exact=exact,
+        )
+
+    def _write_segment(self, ids, documents, embeddings, metadatas):
+        # The counter keeps names ordered; the random suffix keeps them unique even across processes
+        name = f"seg-{self._next_segment:06d}-{uuid.uuid4().hex[:8]}"
+        self._next_segment += 1
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        arrays = {}
+        if self.dtype == "float16":
+            arrays[".f16"] = vectors.astype(np.float16)
+        elif self.dtype == "int8":
+            arrays[".i8"], arrays[".scale"] = _quantize_int8(vectors)
+        if self.dtype == "float32" or self.rescore_factor:
+            arrays[".f32"] = vectors
+        for suffix, array in arrays.items():
+            tmp = self.path / f"{name}{suffix}.tmp"
+            array.tofile(tmp)
+            os.replace(tmp, self.path / f"{name}{suffix}")
+        tmp = self.path / f"{name}.json.tmp"
+        tmp.write_text(json.dumps({"ids": ids, "documents": documents, "metadatas": metadatas}))
+        os.replace(tmp, self.path / f"{name}.json")
+        return self._open_segment(name, len(ids), dtype=self.dtype)
+
+    def _save_manifest(self):
+        manifest = {
+            "dim": self._dim,
+            "next_segment": self._next_segment,
+            "segments": [
+                {"name": s.name, "rows": len(s), "deleted": s.deleted_rows(), "dtype": str(s.vectors.dtype)}
+                for s in self._segments
+            ],
+        }
+        tmp = self.path / f"{MANIFEST}.tmp"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, self.path / MANIFEST)
+        self._version = self._manifest_version()
+
+    def _remove_files(self, segment: _Segment):
+        for suffix in (".f32", ".f16", ".i8", ".scale", ".json"):
+            try:
+                os.remove(self.path / f"{segment.name}{suffix}")
+            except FileNotFoundError:
+                pass
+
+    def _reindex(self):
+        locations = {}
+        for segment in self._segments:
+            for row in np.flatnonzero(segment.alive):
+                locations[segment.ids[row]] = (segment, row)
+        self._locations = locations
+
+    def _tombstone(self, ids):
+        for chunk_id in ids:
+            location = self._locations.pop(chunk_id, None)
+            if location is not None:
+                segment, row = location
+                segment.alive[row] = False
+
+    def _compact(self, victims=None):
+        """Merge ``victims`` (default: the smaller half of the segments) into one, dropping tombstoned rows."""
+        if victims is None:
+            by_size = sorted(self._segments, key=lambda s: int(s.alive.sum()))
+            victims = by_size[:max(2, len(by_size) // 2)]
+        ids, documents, metadatas, vectors = [], [], [], []
+        for segment in victims:
+            rows = np.flatnonzero(segment.alive)
+            ids.extend(segment.ids[r] for r in rows)
+            documents.extend(segment.documents[r] for r in rows)
+            metadatas.extend(segment.metadatas[r] for r in rows)
+            vectors.append(segment.exact_vectors(rows))
+
+        merged = [self._write_segment(ids, documents, np.concatenate(vectors), metadatas)] if ids else []
+        victim_names = {s.name for s in victims}
+        self._segments = [s for s in self._segments if s.name not in victim_names] + merged
+        self._reindex()
+        self._save_manifest()
+        for segment in victims:
+            self._remove_files(segment)
+        logger.info(f"Compacted {len(victims)} segments of {self.name} into {len(merged)}")
+
+    # VectorStore API
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        if not ids:
+            return []
+        began = time.perf_counter()
+        with self._exclusive():
+            self._load_if_changed()
+            dim = len(embeddings[0])
+            if self._dim is None:
+                self._dim = dim
+            elif dim != self._dim:
+                raise ValueError(f"Embedding dimension {dim} does not match index dimension {self._dim}")
+
+            segment = self._write_segment(list(ids), list(documents), embeddings, list(metadatas))
+            self._tombstone(ids)
+            self._segments = self._segments + [segment]
+            for row, chunk_id in enumerate(segment.ids):
+                self._locations[chunk_id] = (segment, row)
+            self._save_manifest()
+
+            if len(self._segments) > self.max_segments:
+                self._compact()
+        # The whole call is one segment write
+        return self._record_batches([time.perf_counter() - began])
+
+    def query(self, query_embeddings, n_results, where=None, include=("documents", "metadatas", "distances")):
+        self._refresh()
+        segments = self._segments
+        results = {key: [] for key in ("ids", *include)}
+        for query in query_embeddings:
+            query = np.asarray(query, dtype=np.float32)
+            query_norm = float(query @ query)
+            candidates = []
+            for segment in segments:
+                if not len(segment):
+                    continue
+                mask = segment.alive if where is None else segment.alive & _match(segment, where)
+                rows = np.flatnonzero(mask)
+                if not len(rows):
+                    continue
+                if len(rows) == len(segment):
+                    distances = segment.norms + query_norm - 2.0 * segment.dot(query)
+                else:
+                    distances = segment.norms[rows] + query_norm - 2.0 * segment.dot(query, rows)
+                rescore = segment.compact and segment.exact is not None and self.rescore_factor
+                keep = n_results * self.rescore_factor if rescore else n_results
+                if len(distances) > keep:
+                    top = np.argpartition(distances, keep)[:keep]
+                else:
+                    top = np.arange(len(distances))
+                local_rows = rows[top] if len(rows) != len(segment) else top
+                if rescore:
+                    # Re-rank the shortlist with the float32 vectors, reading only those rows
+                    order = np.argsort(local_rows)
+                    local_rows = local_rows[order]
+                    exact = segment.exact_vectors(local_rows)
+                    distances = np.einsum("ij,ij->i", exact, exact) + query_norm - 2.0 * (exact @ query)
+                    top = np.argsort(distances)[:n_results]
+                    local_rows = local_rows[top]
+                candidates.extend(zip(distances[top].tolist(), [segment] * len(top), local_rows.tolist()))
+
+            candidates.sort(key=lambda c: c[0])
+            hits = candidates[:n_results]
+            results["ids"].append([segment.ids[row] for _, segment, row in hits])
+            if "documents" in include:
+                results["documents"].append([segment.documents[row] for _, segment, row in hits])
+            if "metadatas" in include:
+                results["metadatas"].append([segment.metadatas[row] for _, segment, row in hits])
+            if "distances" in include:
+                results["distances"].append([distance for distance, _, _ in hits])
+            if "embeddings" in include:
+                results["embeddings"].append([segment.exact_vectors([row])[0] for _, segment, row in hits])
+        return results
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        self._refresh()
+        return self._get(ids, where, include)
+
+    def _get(self, ids=None, where=None, include=("documents", "metadatas")):
+        if ids is not None:
+            locations = [self._locations[i] for i in ids if i in self._locations]
+        else:
+            locations = []
+            for segment in self._segments:
+                mask = segment.alive if where is None else segment.alive & _match(segment, where)
+                locations.extend((segment, row) for row in np.flatnonzero(mask).tolist())
+        if ids is not None and where is not None:
+            locations = [(s, r) for s, r in locations if _match(s, where)[r]]
+
+        results = {"ids": [segment.ids[row] for segment, row in locations]}
+        if "documents" in include:
+            results["documents"] = [segment.documents[row] for segment, row in locations]
+        if "metadatas" in include:
+            results["metadatas"] = [segment.metadatas[row] for segment, row in locations]
+        if "embeddings" in include:
+            results["embeddings"] = [segment.exact_vectors([row])[0] for segment, row in locations]
+        return results
+
+    def delete(self, ids=None, where=None):
+        with self._exclusive():
+            self._load_if_changed()
+            if where is not None:
+                ids = self._get(ids=ids, where=where, include=())["ids"]
+            self._tombstone(ids or [])
+            self._save_manifest()
+            self._reclaim()
+
+    def _reclaim(self):
+        """
+        Free the space of deleted rows: drop segments with no live rows, and
+        rewrite the rest once more than half of all stored rows are dead.
+        """
+        dead = [s for s in self._segments if len(s) and not s.alive.any()]
+        if dead:
+            dead_names = {s.name for s in dead}
+            self._segments = [s for s in self._segments if s.name not in dead_names]
+            self._save_manifest()
+            for segment in dead:
+                self._remove_files(segment)
+
+        stored = sum(len(s) for s in self._segments)
+        if stored > 2 * len(self._locations):
+            self._compact([s for s in self._segments if not s.alive.all()])
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._locations)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import aiohttp
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIHTTPError(Exception):
+    """Non-200 response from the OpenAI API."""
+
+    def __init__(self, status: int, body: str, headers=None):
+        super().__init__(f"OpenAI API returned {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class AsyncOpenAIClient:
+    """
+    Async OpenAI client sharing one keep-alive connection pool.
+
+    The underlying ``aiohttp.ClientSession`` is bound to the event loop it was
+    created on; use ``get_openai_client()`` rather than instantiating directly.
+    """
+
+    def __init__(self, api_key: str, base_url: str, pool_size: int, keepalive: float,
+                 connect_timeout: float, read_timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=keepalive),
+            timeout=aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout),
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    async def embed(self, texts: list[str], model: str, dimensions: int = None) -> list[list[float]]:
+        """
+        Embed texts in a single request.
+
+        Args:
+            texts (list of str): Inputs of the request.
+            model (str): Embedding model.
+            dimensions (int): Ask the model for shortened vectors of this size; its default if None.
+
+        Raises:
+            OpenAIHTTPError: If the API does not answer with 200.
+        """
+        payload = {"model": model, "input": texts}
+        if dimensions:
+            payload["dimensions"] = dimensions
+        async with self.session.post(f"{self.base_url}/embeddings", json=payload) as response:
+            if response.status != 200:
+                raise OpenAIHTTPError(response.status, await response.text(), response.headers)
+            body = await response.json()
+        data = sorted(body["data"], key=lambda r: r["index"])
+        return [r["embedding"] for r in data]
+
+    def stream_chat(self, payload: dict):
+        """
+        Start a streaming chat completion.
+
+        Returns:
+            An async context manager yielding the ``aiohttp.ClientResponse``.
+        """
+        return self.session.post(f"{self.base_url}/chat/completions", json=payload)
+
+
+def parse_stream_line(line: str) -> tuple[list[str], bool]:
+    """
+    Parse one chunk of a streaming chat completion (server-sent events).
+
+    Args:
+        line (str): Decoded chunk; may hold several ``data:`` lines.
+
+    Returns:
+        tuple: The text deltas it carries, and whether ``[DONE]`` was reached.
+    """
+    deltas = []
+    for part in line.splitlines():
+        part = part.strip()
+        if not part or not part.startswith("data: "):
+            continue
+
+        data_str = part[len("data: "):]
+        if data_str == "[DONE]":
+            return deltas, True
+
+        try:
+            chunk_data = json.loads(data_str)
+        except json.JSONDecodeError:
+            continue
+        choices = chunk_data.get("choices", [])
+        if choices:
+            delta = choices[0].get("delta", {}).get("content")
+            if delta is None:
+                delta = choices[0].get("text")
+            if delta:
+                deltas.append(delta)
+    return deltas, False
+
+
+_client = None
+
+
+def get_openai_client() -> AsyncOpenAIClient:
+    """
+    Return the process-wide async client for the running event loop, creating it if needed.
+
+    Must be called from a coroutine. Creation does not await, so no lock is needed.
+    """
+    global _client
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.loop is not loop or _client.closed:
+        _client = AsyncOpenAIClient(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_API_BASE,
+            pool_size=settings.RAG_OPENAI_POOL_SIZE,
+            keepalive=settings.RAG_OPENAI_KEEPALIVE,
+            connect_timeout=settings.RAG_OPENAI_CONNECT_TIMEOUT,
+            read_timeout=settings.RAG_OPENAI_READ_TIMEOUT,
+        )
+        logger.info("Opened shared OpenAI connection pool")
+    return _client
+
+
+async def close_openai_client():
+    """Close the shared client, if one is open on the running loop."""
+    global _client
+    if _client is not None and _client.loop is asyncio.get_running_loop():
+        await _client.close()
+        _client = None
@@ -0,0 +1,209 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+from .text_processing import chunk_pages
+from .vector_store import embed_texts
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def stream_stage(iterable, maxsize: int, name: str = "rag-stage"):
+    """
+    Drive an iterable in a background thread and yield its items through a bounded queue.
+
+    The producer blocks when ``maxsize`` items are waiting, so memory held
+    between two stages is bounded. Exceptions raised by the producer are
+    re-raised in the consumer, and closing the returned generator early stops
+    the producer.
+
+    Args:
+        iterable (iterable): Source of items; consumed in the background thread.
+        maxsize (int): Maximum number of items buffered between the stages.
+        name (str): Thread name, for debugging.
+
+    Yields:
+        Items of ``iterable`` in order.
+    """
+    buffer = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as exc:
+            put(_StageError(exc))
+        finally:
+            # Close generator sources from this thread so upstream stages stop too
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+
+def batched(iterable, size: int):
+    """
+    Group an iterable into lists of at most ``size`` items.
+
+    Yields:
+        list: Consecutive batches, the last one possibly shorter.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batches(batches, concurrency: int, embed=embed_texts):
+    """
+    Embed a stream of chunk batches with up to ``concurrency`` requests in flight.
+
+    Results are yielded in input order; at most ``concurrency`` batches are
+    held waiting for their embeddings at any time.
+
+    Yields:
+        tuple of (list, list): The chunk batch and its embeddings.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="rag-embed") as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(embed, batch)))
+                if len(pending) >= concurrency:
+                    done_batch, future = pending.popleft()
+                    yield done_batch, future.result()
+            while pending:
+                done_batch, future = pending.popleft()
+                yield done_batch, future.result()
+    finally:
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+
+
+class _TimedIterator:
+    """Iterator wrapper adding the time spent producing each item to ``seconds``."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def close(self):
+        close = getattr(self._iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def run_ingestion_pipeline(pages, store_batch, batch_size: int = None, queue_size: int = None, user=None,
+                           timings: dict = None):
+    """
+    Stream pages through chunking, embedding and storage with bounded buffers.
+
+    Extraction and chunking run in one background thread, embedding in
+    another (with its own request concurrency) and storage in the calling
+    thread, so each batch is searchable as soon as it is written and memory
+    does not grow with document size.
+
+    Args:
+        pages (iterable): Lazy ``(page_number, text)`` pairs, e.g. ``iter_pdf_pages(path)``.
+        store_batch (callable): ``store_batch(start_index, chunks, embeddings)`` persisting one
+            batch of ``Chunk`` objects.
+        batch_size (int): Chunks per embedding/storage batch, defaults to ``RAG_INGESTION_BATCH_SIZE``.
+        queue_size (int): Batches buffered between stages, defaults to ``RAG_INGESTION_STAGE_QUEUE_SIZE``.
+        user: Owner of the document, used for fair queuing of embedding calls.
+        timings (dict): If given, filled with the seconds spent in each stage (``extract``,
+            ``chunk``, ``embed``, ``store``). Embedding time is summed over concurrent requests.
+
+    Returns:
+        int: Total number of chunks stored.
+    """
+    batch_size = batch_size or settings.RAG_INGESTION_BATCH_SIZE
+    queue_size = queue_size or settings.RAG_INGESTION_STAGE_QUEUE_SIZE
+
+    extracted = _TimedIterator(pages)
+    chunked = _TimedIterator(chunk_pages(extracted))
+    embed_seconds = []
+
+    def embed(chunks):
+        started = time.perf_counter()
+        try:
+            return embed_texts([chunk.text for chunk in chunks], user=user)
+        finally:
+            embed_seconds.append(time.perf_counter() - started)
+
+    chunk_batches = stream_stage(batched(chunked, batch_size), queue_size, name="rag-chunk")
+    embedded = stream_stage(
+        embed_batches(chunk_batches, settings.RAG_EMBEDDING_CONCURRENCY, embed=embed),
+        queue_size,
+        name="rag-embed-stage",
+    )
+
+    stored = 0
+    store_seconds = 0.0
+    try:
+        for chunks, embeddings in embedded:
+            started = time.perf_counter()
+            store_batch(stored, chunks, embeddings)
+            store_seconds += time.perf_counter() - started
+            stored += len(chunks)
+    finally:
+        embedded.close()
+        if timings is not None:
+            # Chunking pulls pages, so its clock includes extraction
+            timings.update(
+                extract=extracted.seconds,
+                chunk=max(0.0, chunked.seconds - extracted.seconds),
+                embed=sum(embed_seconds),
+                store=store_seconds,
+            )
+    return stored
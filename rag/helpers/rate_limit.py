@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Upstream statuses worth retrying; anything else (bad request, auth) fails immediately
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def retry_delay(attempt: int, headers=None) -> float:
+    """
+    Seconds to wait before retry number ``attempt`` (1-based).
+
+    Honours ``Retry-After`` (seconds or HTTP date) and ``retry-after-ms`` from
+    the failed response, otherwise backs off exponentially; both are capped
+    at ``RAG_UPSTREAM_MAX_BACKOFF``.
+    """
+    cap = settings.RAG_UPSTREAM_MAX_BACKOFF
+    if headers:
+        value = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+        if value:
+            try:
+                return min(float(value) / 1000, cap)
+            except ValueError:
+                pass
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        if value:
+            try:
+                return min(max(0.0, float(value)), cap)
+            except ValueError:
+                try:
+                    return min(max(0.0, parsedate_to_datetime(value).timestamp() - time.time()), cap)
+                except (TypeError, ValueError):
+                    pass
+    return min(2 ** attempt, cap)
+
+
+class _Ticket:
+    __slots__ = ("user", "tokens", "priority", "enqueued", "depth", "admitted", "event", "loop", "future")
+
+    def __init__(self, user, tokens: int, priority: int, loop=None):
+        self.user = user
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.depth = 0
+        self.admitted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.future = loop.create_future()
+
+    @property
+    def waited_ms(self) -> int:
+        return int((time.monotonic() - self.enqueued) * 1000)
+
+    def wake(self):
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Admits upstream API calls under a concurrency limit and a tokens-per-minute budget.
+
+    Callers wait in one queue per priority (interactive before background);
+    within a priority, users are served round robin so one heavy user cannot
+    starve the others. Tokens come from a bucket refilled at
+    ``tokens_per_minute / 60`` per second; ``0`` disables the token budget.
+    ``pause()`` stops all admissions for a while, e.g. after a 429.
+
+    Usable from threads (``acquire``) and coroutines (``aacquire``) at the same time.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, tokens_per_minute: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BACKGROUND: OrderedDict()}
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._timer = None
+
+    @contextmanager
+    def acquire(self, user=None, tokens: int = 1, priority: int = PRIORITY_BACKGROUND):
+        """
+        Block the calling thread until the call is admitted.
+
+        Yields:
+            int: Milliseconds spent waiting.
+        """
+        ticket = self._submit(_Ticket(user, tokens, priority))
+        if not ticket.admitted:
+            ticket.event.wait()
+        try:
+            yield ticket.waited_ms
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aacquire(self, user=None, tokens: int = 1, priority: int = PRIORITY_INTERACTIVE, on_queued=None):
+        """
+        Wait without blocking the event loop until the call is admitted.
+
+        Args:
+            user: Identity used for fair queuing, e.g. a user id.
+            tokens (int): Estimated tokens the call consumes.
+            priority (int): ``PRIORITY_INTERACTIVE`` or ``PRIORITY_BACKGROUND``.
+            on_queued (callable): Coroutine function ``on_queued(queue_depth, waited_ms)``, awaited
+                when the call has to wait and again (with ``queue_depth=0``) once it is admitted.
+
+        Yields:
+            int: Milliseconds spent waiting.
+        """
+        ticket = self._submit(_Ticket(user, tokens, priority, asyncio.get_running_loop()))
+        if not ticket.admitted:
+            try:
+                if on_queued is not None:
+                    await on_queued(ticket.depth, 0)
+                await ticket.future
+            except BaseException:
+                self._abandon(ticket)
+                raise
+            if on_queued is not None:
+                await on_queued(0, ticket.waited_ms)
+        try:
+            yield ticket.waited_ms
+        finally:
+            self._release()
+
+    def pause(self, seconds: float):
+        """Hold back all admissions for ``seconds``."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._schedule(seconds)
+        logger.warning(f"Upstream {self.name} calls paused for {seconds:.1f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"active": self._active, "waiting": self._waiting}
+
+    def _submit(self, ticket: _Ticket) -> _Ticket:
+        if self.tokens_per_minute:
+            ticket.tokens = min(ticket.tokens, self.tokens_per_minute)
+        with self._lock:
+            queue = self._queues[ticket.priority]
+            queue.setdefault(ticket.user, deque()).append(ticket)
+            self._waiting += 1
+            ticket.depth = self._waiting
+            woken = self._dispatch()
+        for other in woken:
+            if other is not ticket:
+                other.wake()
+        return ticket
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            woken = self._dispatch()
+        for ticket in woken:
+            ticket.wake()
+
+    def _abandon(self, ticket: _Ticket):
+        """Withdraw a waiter that gave up; frees its slot if it was admitted meanwhile."""
+        with self._lock:
+            admitted = ticket.admitted
+            if not admitted:
+                queue = self._queues[ticket.priority]
+                waiters = queue.get(ticket.user)
+                if waiters is not None and ticket in waiters:
+                    waiters.remove(ticket)
+                    self._waiting -= 1
+                    if not waiters:
+                        del queue[ticket.user]
+        if admitted:
+            self._release()
+
+    def _dispatch(self) -> list:
+        """Admit waiters while capacity allows; caller holds the lock and wakes the result."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._schedule(self._paused_until - now)
+            return []
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute / 60
+            self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled) * rate)
+            self._refilled = now
+
+        woken = []
+        while self._active < self.max_concurrency:
+            queue = next((q for q in self._queues.values() if q), None)
+            if queue is None:
+                break
+            user, waiters = next(iter(queue.items()))
+            ticket = waiters[0]
+            if self.tokens_per_minute and self._tokens < ticket.tokens:
+                self._schedule((ticket.tokens - self._tokens) / rate)
+                break
+            waiters.popleft()
+            if waiters:
+                queue.move_to_end(user)
+            else:
+                del queue[user]
+            self._waiting -= 1
+            self._active += 1
+            if self.tokens_per_minute:
+                self._tokens -= ticket.tokens
+            ticket.admitted = True
+            woken.append(ticket)
+        return woken
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            woken = self._dispatch()
+        for ticket in woken:
+            ticket.wake()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(kind: str) -> AdmissionController:
+    """
+    Return the process-wide admission controller for ``"chat"`` or ``"embedding"`` calls.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(kind)
+        if limiter is None:
+            if kind == "chat":
+                limiter = AdmissionController(
+                    "chat",
+                    max_concurrency=settings.RAG_UPSTREAM_CHAT_CONCURRENCY,
+                    tokens_per_minute=settings.RAG_UPSTREAM_CHAT_TPM,
+                )
+            elif kind == "embedding":
+                limiter = AdmissionController(
+                    "embedding",
+                    max_concurrency=settings.RAG_UPSTREAM_EMBEDDING_CONCURRENCY,
+                    tokens_per_minute=settings.RAG_UPSTREAM_EMBEDDING_TPM,
+                )
+            else:
+                raise ValueError(f"Unknown limiter {kind}")
+            _limiters[kind] = limiter
+        return limiter
+
+
+def _collect_stats() -> dict:
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    values = {}
+    for kind, limiter in limiters:
+        for state, value in limiter.stats().items():
+            values[(kind, state)] = value
+    return values
+
+
+gauge(
+    "rag_upstream_calls",
+    "OpenAI calls admitted (active) or queued (waiting) by each admission controller.",
+    _collect_stats,
+    labels=("limiter", "state"),
+)
\ No newline at end of file
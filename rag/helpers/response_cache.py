@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("deltas", "pdf_ids", "size", "expires")
+
+    def __init__(self, deltas: tuple, pdf_ids: frozenset, expires: float):
+        self.deltas = deltas
+        self.pdf_ids = pdf_ids
+        self.size = sum(len(delta.encode()) for delta in deltas)
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    In-memory cache of streamed answers, replayed delta by delta on a hit.
+
+    Entries expire after ``ttl`` seconds and are evicted least recently used
+    once either ``max_entries`` or ``max_bytes`` (UTF-8 size of the recorded
+    deltas) is exceeded. Each entry remembers the PDFs its context came from
+    so re-indexing or deleting a PDF drops every answer built on it.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_pdf = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, which records it for its PDF; an answer
+        # is not stored if one of its own PDFs was invalidated while it streamed
+        self.generation = 0
+        self._invalidated = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query: str, chunk_ids: list[str], model: str, prompt_version: int) -> str:
+        """
+        Build a cache key from everything that determines the answer.
+
+        Args:
+            query (str): The user's question; case and whitespace are normalised.
+            chunk_ids (list of str): Ids of the chunks placed in the prompt, in prompt order.
+            model (str): Chat model.
+            prompt_version (int): Version of the prompt template.
+
+        Returns:
+            str: Hex digest.
+        """
+        normalised = " ".join(query.casefold().split())
+        material = "\0".join([normalised, ",".join(chunk_ids), model, str(prompt_version)])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key: str):
+        """Return the recorded deltas for ``key``, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.deltas
+
+    def put(self, key: str, deltas: list[str], pdf_ids, generation: int = None):
+        """
+        Record a completed answer.
+
+        Args:
+            key (str): Key from ``make_key``.
+            deltas (list of str): Text deltas in the order they were streamed.
+            pdf_ids (iterable of int): PDFs whose chunks were in the prompt.
+            generation (int): ``self.generation`` read before the answer was produced; the
+                answer is discarded if one of ``pdf_ids`` was invalidated since.
+        """
+        entry = _Entry(tuple(deltas), frozenset(pdf_ids), time.monotonic() + self.ttl)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and any(self._invalidated.get(pdf_id, 0) > generation for pdf_id in entry.pdf_ids):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for pdf_id in entry.pdf_ids:
+                self._by_pdf.setdefault(pdf_id, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_pdf(self, pdf_id: int) -> int:
+        """
+        Drop every answer whose context included ``pdf_id``.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        with self._lock:
+            self.generation += 1
+            self._invalidated[pdf_id] = self.generation
+            keys = self._by_pdf.pop(pdf_id, set())
+            for key in keys:
+                self._remove(key)
+        if keys:
+            logger.info(f"Invalidated {len(keys)} cached answers for PDF {pdf_id}")
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for pdf_id in entry.pdf_ids:
+            keys = self._by_pdf.get(pdf_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_pdf[pdf_id]
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache, or None when caching is disabled.
+    """
+    global _response_cache
+    if not settings.RAG_RESPONSE_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                ttl=settings.RAG_RESPONSE_CACHE_TTL,
+                max_entries=settings.RAG_RESPONSE_CACHE_MAX_ENTRIES,
+                max_bytes=settings.RAG_RESPONSE_CACHE_MAX_BYTES,
+            )
+        return _response_cache
+
+
+def _collect_stats() -> dict:
+    cache = _response_cache
+    stats = cache.stats() if cache is not None else {"entries": 0, "bytes": 0, "hits": 0, "misses": 0}
+    return {(name,): value for name, value in stats.items()}
+
+
+gauge("rag_response_cache", "Cached answers: entries, bytes, and hits and misses since start.", _collect_stats, labels=("stat",))
+
+
+def invalidate_pdf_responses(pdf_id: int):
+    """Drop cached answers built on ``pdf_id``, if response caching is enabled."""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate_pdf(pdf_id)
\ No newline at end of file
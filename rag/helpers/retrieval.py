@@ -0,0 +1,195 @@
+import logging
+import numpy as np
+from django.conf import settings
+
+from .centroids import select_documents
+from .lexical_index import get_lexical_index
+from .vector_store import VectorStore, owner_filter
+
+logger = logging.getLogger(__name__)
+
+# Standard RRF damping constant; larger values flatten the influence of top ranks
+RRF_K = 60
+
+# Lexical hits scoring below this fraction of the best hit only matched common terms
+LEXICAL_MIN_SCORE_RATIO = 0.1
+
+RETRIEVAL_FLAT = "flat"
+RETRIEVAL_HIERARCHICAL = "hierarchical"
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = RRF_K) -> list[tuple[str, float]]:
+    """
+    Merge ranked id lists with reciprocal rank fusion.
+
+    Args:
+        rankings (list of list of str): Ranked ids from each retriever, best first.
+        k (int): Damping constant.
+
+    Returns:
+        list of tuple: ``(id, fused_score)`` for every id, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def mmr_select(embeddings, relevance, k: int, lambda_mult: float) -> list[int]:
+    """
+    Pick ``k`` candidates by maximal marginal relevance.
+
+    Each step takes the candidate maximising
+    ``lambda * relevance - (1 - lambda) * max_similarity_to_already_selected``,
+    so near-duplicates of chosen chunks are pushed down. Candidate-to-candidate
+    similarities are computed once as a matrix and the running maximum is
+    updated with one vector operation per step.
+
+    Args:
+        embeddings (numpy.ndarray): Unit-normalised candidate vectors, shape ``(n, dim)``.
+        relevance (numpy.ndarray): Relevance of each candidate to the query, shape ``(n,)``.
+        k (int): Number of candidates to select.
+        lambda_mult (float): 1.0 ranks purely by relevance, 0.0 purely by diversity.
+
+    Returns:
+        list of int: Indices of the selected candidates in selection order.
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    similarity = embeddings @ embeddings.T
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = []
+    for _ in range(min(k, n)):
+        penalty = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def _rescale(values, low: float, high: float):
+    span = values.max() - values.min()
+    if span == 0:
+        return np.full_like(values, high)
+    return low + (values - values.min()) / span * (high - low)
+
+
+def retrieve(store: VectorStore, query: str, query_embedding: list[float], owner_id: int,
+             pdf_ids: list[int] = None, top_k: int = 3, fetch_k: int = None, lambda_mult: float = None) -> dict:
+    """
+    Retrieve an owner's most relevant, mutually diverse chunks for a query.
+
+    Over-fetches ``fetch_k`` vector candidates (fused with BM25 hits when
+    ``RAG_HYBRID_SEARCH`` is on), drops candidates whose cosine similarity to
+    the query is below ``RAG_MIN_SIMILARITY`` (lexical matches are kept), then
+    selects ``top_k`` of them with maximal marginal relevance.
+
+    With ``RAG_RETRIEVAL_MODE=hierarchical`` and no explicit ``pdf_ids``, the
+    chunk search is first narrowed to the ``RAG_HIERARCHICAL_DOCUMENTS`` PDFs
+    whose centroids are closest to the query, plus the PDFs of the top
+    lexical hits so exact identifiers are still found anywhere.
+
+    Args:
+        store (VectorStore): Store holding the owner's chunks.
+        query (str): Query text.
+        query_embedding (list of float): Embedding of ``query``.
+        owner_id (int): Owner whose documents are searched.
+        pdf_ids (list of int): Optionally restrict to these PDFs.
+        top_k (int): Number of chunks to return.
+        fetch_k (int): Candidates considered before MMR, defaults to ``RAG_FETCH_K``.
+        lambda_mult (float): MMR relevance/diversity trade-off, defaults to ``RAG_MMR_LAMBDA``.
+
+    Returns:
+        dict: ``ids``, ``documents``, ``metadatas`` and ``similarities`` lists, best first.
+    """
+    fetch_k = max(fetch_k or settings.RAG_FETCH_K, top_k)
+    lambda_mult = settings.RAG_MMR_LAMBDA if lambda_mult is None else lambda_mult
+    include = ("documents", "metadatas", "embeddings")
+
+    lexical_hits = []
+    if settings.RAG_HYBRID_SEARCH:
+        lexical_hits = get_lexical_index().search(query, owner_id, pdf_ids, limit=fetch_k)
+
+    if settings.RAG_RETRIEVAL_MODE == RETRIEVAL_HIERARCHICAL and not pdf_ids:
+        selected = select_documents(owner_id, query_embedding, settings.RAG_HIERARCHICAL_DOCUMENTS)
+        # Owners without centroids yet (indexed before this mode existed) get a flat search
+        if selected:
+            # Chunk ids are "<pdf_id>_<chunk_index>"
+            lexical_pdfs = [int(chunk_id.split("_", 1)[0]) for chunk_id, _ in lexical_hits[:top_k]]
+            pdf_ids = list(dict.fromkeys(selected + lexical_pdfs))
+            lexical_hits = [hit for hit in lexical_hits if int(hit[0].split("_", 1)[0]) in pdf_ids]
+    where = owner_filter(owner_id, pdf_ids)
+
+    vector_hits = store.query(
+        query_embeddings=[query_embedding],
+        n_results=fetch_k,
+        where=where,
+        include=include,
+    )
+    rows = {
+        chunk_id: (document, metadata, embedding)
+        for chunk_id, document, metadata, embedding in zip(
+            vector_hits["ids"][0], vector_hits["documents"][0],
+            vector_hits["metadatas"][0], vector_hits["embeddings"][0],
+        )
+    }
+
+    lexical_ids = set()
+    if settings.RAG_HYBRID_SEARCH:
+        if lexical_hits:
+            floor = lexical_hits[0][1] * LEXICAL_MIN_SCORE_RATIO
+            lexical_ids = {chunk_id for chunk_id, score in lexical_hits if score >= floor}
+            lexical_ranking = [chunk_id for chunk_id, _ in lexical_hits if chunk_id in lexical_ids]
+        else:
+            lexical_ranking = []
+        fused = reciprocal_rank_fusion([vector_hits["ids"][0], lexical_ranking])[:fetch_k]
+
+        lexical_only = [chunk_id for chunk_id, _ in fused if chunk_id not in rows]
+        if lexical_only:
+            found = store.get(ids=lexical_only, where=where, include=include)
+            rows.update(zip(found["ids"], zip(found["documents"], found["metadatas"], found["embeddings"])))
+        candidates = [(chunk_id, score) for chunk_id, score in fused if chunk_id in rows]
+    else:
+        candidates = [(chunk_id, None) for chunk_id in vector_hits["ids"][0]]
+
+    if not candidates:
+        return {"ids": [], "documents": [], "metadatas": [], "similarities": []}
+
+    ids = [chunk_id for chunk_id, _ in candidates]
+    embeddings = _normalize([rows[chunk_id][2] for chunk_id in ids])
+    similarities = embeddings @ _normalize(query_embedding)
+
+    # Similarity floor: prune chunks that are unrelated to the query unless they matched lexically
+    keep = (similarities >= settings.RAG_MIN_SIMILARITY) | np.array([chunk_id in lexical_ids for chunk_id in ids])
+    if not keep.any():
+        return {"ids": [], "documents": [], "metadatas": [], "similarities": []}
+    ids = [chunk_id for chunk_id, kept in zip(ids, keep) if kept]
+    embeddings, similarities = embeddings[keep], similarities[keep]
+
+    if settings.RAG_HYBRID_SEARCH:
+        # RRF scores only carry the fused order; spread them over the candidates' cosine range so
+        # MMR weighs them against its cosine redundancy penalty on the same scale
+        fused_scores = np.array([score for (chunk_id, score), kept in zip(candidates, keep) if kept], dtype=np.float32)
+        relevance = _rescale(fused_scores, similarities.min(), similarities.max())
+    else:
+        relevance = similarities
+
+    order = mmr_select(embeddings, relevance, top_k, lambda_mult)
+    return {
+        "ids": [ids[i] for i in order],
+        "documents": [rows[ids[i]][0] for i in order],
+        "metadatas": [rows[ids[i]][1] for i in order],
+        "similarities": [float(similarities[i]) for i in order],
+    }
@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import logging
+import aiohttp
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .openai_client import get_openai_client, parse_stream_line
+from .rate_limit import PRIORITY_INTERACTIVE, RETRYABLE_STATUSES, get_limiter, retry_delay
+
+logger = logging.getLogger(__name__)
+
+FLIGHT_MESSAGE_TYPE = "chat.flight"
+
+_flight_numbers = itertools.count(1)
+
+
+class Flight:
+    """
+    One upstream chat stream shared by every socket asking the same question.
+
+    Events (``queued`` and ``delta``, then ``done`` or ``error``) are numbered from 1, kept
+    in ``events`` for late joiners and fanned out to the flight's channel
+    layer group as ``chat.flight`` messages. Subscribers replay ``events``
+    after joining the group, drop group messages they have already seen and
+    take events skipped by a dropped group message from ``events``.
+    The upstream stream is cancelled when the last subscriber leaves.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        # Unique per flight, so a later flight for the same key never receives stale events
+        self.group = f"rag.flight.{key[:32]}.{next(_flight_numbers)}"
+        self.events = []
+        self.subscribers = set()
+        self.finished = False
+        self.task = None
+
+    async def publish(self, event: dict):
+        event = {**event, "seq": len(self.events) + 1}
+        self.events.append(event)
+        if event["event"] in ("done", "error"):
+            self.finished = True
+        await get_channel_layer().group_send(self.group, {"type": FLIGHT_MESSAGE_TYPE, "flight": self.group, **event})
+
+
+# In-flight streams of this process, by request key
+_flights = {}
+
+
+def join_flight(key: str, payload: dict, channel_name: str, on_complete=None,
+                user=None, tokens: int = 1) -> tuple[Flight, bool]:
+    """
+    Subscribe to the running stream for ``key``, starting one if there is none.
+
+    Must be called from the event loop. The stream runs in its own task, so
+    it outlives the socket that started it as long as others are subscribed.
+
+    Args:
+        key (str): Request key; identical questions over identical context share it.
+        payload (dict): Chat completion request body, used only when a new stream starts.
+        channel_name (str): Channel of the subscribing consumer.
+        on_complete (callable): ``on_complete(deltas)`` called once the stream reaches ``[DONE]``.
+        user: Identity used for fair queuing by the chat limiter.
+        tokens (int): Estimated tokens of the request (prompt plus answer budget).
+
+    Returns:
+        tuple: The flight, and whether this call started it.
+    """
+    flight = _flights.get(key)
+    started = flight is None or flight.finished
+    if started:
+        flight = Flight(key)
+        _flights[key] = flight
+        flight.task = asyncio.create_task(_run_flight(flight, payload, on_complete, user, tokens))
+    flight.subscribers.add(channel_name)
+    return flight, started
+
+
+def leave_flight(flight: Flight, channel_name: str):
+    """
+    Unsubscribe a consumer, cancelling the upstream stream if nobody else is listening.
+
+    Args:
+        flight (Flight): Flight returned by ``join_flight``.
+        channel_name (str): Channel of the leaving consumer.
+    """
+    flight.subscribers.discard(channel_name)
+    if not flight.subscribers and not flight.finished:
+        flight.finished = True
+        flight.task.cancel()
+        logger.info(f"Cancelled abandoned answer stream {flight.group}")
+
+
+async def _run_flight(flight: Flight, payload: dict, on_complete, user, tokens: int):
+    deltas = []
+    completed = False
+    response = None
+    limiter = get_limiter("chat")
+
+    async def on_queued(queue_depth, waited_ms):
+        await flight.publish({"event": "queued", "stage": "chat", "queue_depth": queue_depth, "waited_ms": waited_ms})
+
+    try:
+        client = get_openai_client()
+        attempt = 0
+        while True:
+            retry_in = None
+            async with limiter.aacquire(user, tokens, PRIORITY_INTERACTIVE, on_queued):
+                try:
+                    async with client.stream_chat(payload) as response:
+                        if response.status != 200:
+                            body = await response.text()
+                            if response.status in RETRYABLE_STATUSES and attempt < settings.RAG_UPSTREAM_MAX_RETRIES:
+                                attempt += 1
+                                retry_in = retry_delay(attempt, response.headers)
+                                logger.warning(f"OpenAI stream failed: {response.status}, retry {attempt} in {retry_in}s")
+                            else:
+                                logger.error(f"OpenAI stream failed: {response.status} {body}")
+                                await flight.publish({
+                                    "event": "error",
+                                    "error": "LLM service error",
+                                    "details": f"External AI service returned error {response.status}",
+                                })
+                                return
+                        else:
+                            async for raw_chunk in response.content:
+                                if not raw_chunk:
+                                    continue
+                                try:
+                                    line = raw_chunk.decode("utf-8").strip()
+                                except Exception:
+                                    continue
+
+                                texts, completed = parse_stream_line(line)
+                                for text in texts:
+                                    deltas.append(text)
+                                    await flight.publish({"event": "delta", "text": text})
+                                if completed:
+                                    break
+
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    # Nothing was sent yet, so the request can be replayed transparently
+                    if deltas or attempt >= settings.RAG_UPSTREAM_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    retry_in = retry_delay(attempt)
+                    logger.warning(f"OpenAI stream failed ({e}), retry {attempt} in {retry_in}s")
+
+            if retry_in is None:
+                break
+            if response is not None and response.status == 429:
+                limiter.pause(retry_in)
+            else:
+                await asyncio.sleep(retry_in)
+            response = None
+
+        await flight.publish({"event": "done"})
+        if completed and on_complete is not None:
+            on_complete(deltas)
+
+    except asyncio.CancelledError:
+        # Drop the upstream connection instead of draining the rest of the answer
+        if response is not None:
+            response.close()
+        raise
+    except Exception:
+        logger.exception("OpenAI streaming error")
+        if not flight.finished:
+            await flight.publish({
+                "event": "error",
+                "error": "Streaming error",
+                "details": "An error occurred while streaming the response",
+            })
+    finally:
+        flight.finished = True
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
\ No newline at end of file
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+STREAM_RAW = "raw"
+STREAM_BATCHED = "batched"
+STREAM_MODES = (STREAM_RAW, STREAM_BATCHED)
+
+
+class DeltaBuffer:
+    """
+    Coalesces answer deltas into fewer WebSocket frames.
+
+    The first delta of an answer is sent at once so time to first token is
+    unchanged; later deltas are joined and sent when ``interval`` seconds have
+    passed since the first of them or ``max_bytes`` characters are waiting,
+    whichever comes first. Call ``flush()`` before sending anything that must
+    follow the buffered text (e.g. the ``done`` message) and ``reset()`` when
+    an answer ends.
+    """
+
+    def __init__(self, send, interval: float, max_bytes: int):
+        """
+        Args:
+            send (callable): Coroutine function sending one delta text as a frame.
+            interval (float): Longest time a delta waits in the buffer, in seconds.
+            max_bytes (int): Buffered characters that trigger an immediate flush.
+        """
+        self._send = send
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._parts = []
+        self._size = 0
+        self._timer = None
+        self._started = False
+        # Held while a frame is being sent so timer flushes and explicit flushes keep their order
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str):
+        if not self._started:
+            self._started = True
+            async with self._lock:
+                await self._send(text)
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._on_timer)
+
+    async def flush(self):
+        """Send everything buffered as one frame."""
+        self._cancel_timer()
+        async with self._lock:
+            if not self._parts:
+                return
+            text = "".join(self._parts)
+            self._parts = []
+            self._size = 0
+            await self._send(text)
+
+    def reset(self):
+        """Forget buffered text and treat the next delta as the start of a new answer."""
+        self._cancel_timer()
+        self._parts = []
+        self._size = 0
+        self._started = False
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush buffered deltas")
\ No newline at end of file
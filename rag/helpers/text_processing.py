@@ -1,51 +1,249 @@
 import logging
+import multiprocessing
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 import PyPDF2
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+# Rough characters-per-token ratio for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
 
-def extract_text_from_pdf(file_path):
+
+def estimate_tokens(text):
     """
-    Extract text from a PDF file.
+    Estimate the number of tokens in a text without calling a tokenizer.
 
     Args:
-        file_path (str): Path to the PDF file.
-    
+        text (str): The text to measure.
+
     Returns:
-        str: Extracted text from the PDF.
+        int: Approximate token count (at least 1).
+    """
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def _extract_page_range(file_path, start, end):
+    """Extract pages ``[start, end)`` (0-based); runs inside extraction worker processes."""
+    with open(file_path, 'rb') as pdf_file:
+        reader = PyPDF2.PdfReader(pdf_file)
+        pages = []
+        for index in range(start, end):
+            content = reader.pages[index].extract_text()
+            if content:
+                pages.append((index + 1, content))
+        return pages
+
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    """Return the shared process pool used for parallel PDF extraction."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            # Spawn rather than fork: the server process is multi-threaded
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=settings.RAG_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extraction_pool
+
+
+def _iter_pages_parallel(file_path, num_pages, pages_per_task):
+    """Extract page ranges across the process pool, yielding pages in order."""
+    pool = get_extraction_pool()
+    ranges = iter(
+        (start, min(start + pages_per_task, num_pages))
+        for start in range(0, num_pages, pages_per_task)
+    )
+    # Keep a bounded window of ranges in flight so memory does not grow with page count
+    window = settings.RAG_EXTRACTION_WORKERS * 2
+    pending = deque()
+    try:
+        for start, end in ranges:
+            pending.append(pool.submit(_extract_page_range, file_path, start, end))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_pdf_pages(file_path, parallel=None):
+    """
+    Lazily extract text from a PDF one page at a time.
+
+    PDFs with at least ``RAG_PARALLEL_EXTRACTION_MIN_PAGES`` pages are split
+    into page ranges extracted by a process pool; smaller files are read in
+    this process to avoid the pool overhead. Pages are yielded in order either way.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        parallel (bool): Force (True) or disable (False) parallel extraction; None decides by page count.
+
+    Yields:
+        tuple of (int, str): 1-based page number and the page's text, for pages with text.
     """
-    text = []
-    
     try:
         with open(file_path, 'rb') as pdf_file:
             reader = PyPDF2.PdfReader(pdf_file)
-            
-            for page in reader.pages:
-                content = page.extract_text()
-                if content:
-                    text.append(content)
-        
-        return "\n".join(text)
-        
+            num_pages = len(reader.pages)
+
+            if parallel is None:
+                parallel = (
+                    settings.RAG_EXTRACTION_WORKERS > 1
+                    and num_pages >= settings.RAG_PARALLEL_EXTRACTION_MIN_PAGES
+                )
+
+            if not parallel:
+                for page_number, page in enumerate(reader.pages, start=1):
+                    content = page.extract_text()
+                    if content:
+                        yield page_number, content
+                return
+
+        yield from _iter_pages_parallel(file_path, num_pages, settings.RAG_EXTRACTION_PAGES_PER_TASK)
+
     except Exception as e:
         logger.error(f"Error extracting text from PDF {file_path}: {str(e)}", exc_info=True)
         raise
 
 
-def chunk_text(text, chunk_size=500):
+@dataclass
+class Chunk:
+    """A chunk of document text with its location in the source PDF."""
+    text: str
+    page: int
+    page_end: int
+    char_start: int
+    char_end: int
+    tokens: int
+
+    def metadata(self) -> dict:
+        return {
+            "page": self.page,
+            "page_end": self.page_end,
+            "char_start": self.char_start,
+            "char_end": self.char_end,
+        }
+
+
+# A sentence ends at terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, or at CJK terminal punctuation, which needs no whitespace after it;
+# a blank line ends a paragraph.
+_SEGMENT_BOUNDARY = re.compile(
+    r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+'
+    r'|(?:(?<=[。！？])|(?<=[。！？][」』）]))(?![」』）])\s*'
+    r'|\n\s*\n'
+)
+_WORD = re.compile(r'\S+')
+
+
+def _iter_segments(pages, max_tokens):
+    """
+    Split pages into sentence/paragraph segments with document-level character offsets.
+
+    Offsets index into the page texts joined with newlines. Segments longer
+    than ``max_tokens`` are split at word boundaries, and words longer than
+    that (URLs, text without spaces) are cut by characters.
     """
-    Chunk text into smaller pieces. 
-    
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    page_offset = 0
+    for page_number, content in pages:
+        position = 0
+        for match in _SEGMENT_BOUNDARY.finditer(content):
+            yield from _split_segment(content, position, match.start(), page_number, page_offset, max_chars)
+            position = match.end()
+        yield from _split_segment(content, position, len(content), page_number, page_offset, max_chars)
+        page_offset += len(content) + 1
+
+
+def _segment(content, start, end, page_number, page_offset):
+    words = _WORD.findall(content, start, end)
+    if words:
+        text = " ".join(words)
+        yield text, page_number, page_offset + start, page_offset + end
+
+
+def _split_segment(content, start, end, page_number, page_offset, max_chars):
+    if end - start <= max_chars:
+        yield from _segment(content, start, end, page_number, page_offset)
+        return
+
+    # Oversized sentence: fall back to word windows of at most max_chars
+    piece_start = piece_end = None
+    for word in _WORD.finditer(content, start, end):
+        word_start, word_end = word.span()
+        if piece_start is not None and word_end - piece_start > max_chars:
+            yield from _segment(content, piece_start, piece_end, page_number, page_offset)
+            piece_start = None
+        # A single word over the budget is cut into max_chars pieces
+        while word_end - word_start > max_chars:
+            yield from _segment(content, word_start, word_start + max_chars, page_number, page_offset)
+            word_start += max_chars
+        if piece_start is None:
+            piece_start = word_start
+        piece_end = word_end
+    if piece_start is not None:
+        yield from _segment(content, piece_start, piece_end, page_number, page_offset)
+
+
+def chunk_pages(pages, max_tokens=None, overlap_tokens=None):
+    """
+    Chunk a stream of pages into sentence-aligned, token-budgeted, overlapping chunks.
+
+    Runs in a single pass over the text: sentences are appended to a sliding
+    window which is emitted once the next sentence would exceed the budget,
+    then trimmed from the front to at most ``overlap_tokens``. Both budgets
+    apply to the window's joined text, separators included, so every chunk's
+    ``tokens`` is at most ``max_tokens``.
+
     Args:
-        text (str): The text to chunk.
-        chunk_size (int): The size of each chunk.
-    
-    Returns:
-        list of str: List of text chunks.
-    """
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunks.append(" ".join(words[i:i + chunk_size])) 
-    
-    return chunks
\ No newline at end of file
+        pages (iterable): ``(page_number, text)`` pairs, e.g. from ``iter_pdf_pages``.
+        max_tokens (int): Estimated token budget per chunk, defaults to ``RAG_CHUNK_TOKENS``.
+        overlap_tokens (int): Tokens repeated between consecutive chunks,
+            defaults to ``RAG_CHUNK_OVERLAP_TOKENS``.
+
+    Yields:
+        Chunk: Chunks in document order.
+    """
+    max_tokens = max_tokens or settings.RAG_CHUNK_TOKENS
+    overlap_tokens = settings.RAG_CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    window = deque()
+    # Length of the window's segments joined with spaces, plus one
+    window_chars = 0
+    has_new = False
+
+    def emit():
+        first, last = window[0], window[-1]
+        text = " ".join(segment[0] for segment in window)
+        return Chunk(text, first[1], last[1], first[2], last[3], estimate_tokens(text))
+
+    for segment in _iter_segments(pages, max_tokens):
+        length = len(segment[0])
+        if window and window_chars + length > max_chars:
+            if has_new:
+                yield emit()
+                has_new = False
+            while window and (window_chars - 1 > overlap_chars or window_chars + length > max_chars):
+                window_chars -= len(window.popleft()[0]) + 1
+        window.append(segment)
+        window_chars += length + 1
+        has_new = True
+
+    if window and has_new:
+        yield emit()
\ No newline at end of file
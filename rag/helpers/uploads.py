@@ -0,0 +1,46 @@
+import hashlib
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Upload handler computing the SHA-256 of each uploaded file while it streams in.
+
+    Install it first in ``request.upload_handlers``: every chunk is passed on
+    unchanged, so the memory/temporary-file handlers behind it still build
+    the file, and hashing costs no second read of the upload.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.hashes = {}
+        self._digest = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.hashes[self.field_name] = self._digest.hexdigest()
+        return None
+
+
+def file_sha256(file) -> str:
+    """
+    SHA-256 of an already received file, for uploads the handler did not see.
+
+    Args:
+        file: A Django ``File``; it is rewound afterwards.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
\ No newline at end of file
@@ -1,39 +1,311 @@
+import asyncio
 import logging
-import openai
-from chromadb import PersistentClient
-from chromadb.config import Settings
-from chromadb.api.models import Collection
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import aiohttp
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
+from .embedding_cache import get_embedding_cache
+from .metrics import VECTOR_UPSERT_BATCH_SECONDS
+from .openai_client import OpenAIHTTPError, get_openai_client
+from .rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RETRYABLE_STATUSES, get_limiter, retry_delay
+from .text_processing import estimate_tokens
+
+if TYPE_CHECKING:
+    from chromadb.api.models.Collection import Collection
+
 logger = logging.getLogger(__name__)
-openai.api_key = settings.OPENAI_API_KEY
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def _embedding_params() -> dict:
+    """Extra embeddings API parameters: ``dimensions`` when ``RAG_EMBEDDING_DIMENSIONS`` shortens the vectors."""
+    dimensions = settings.RAG_EMBEDDING_DIMENSIONS
+    return {"dimensions": dimensions} if dimensions else {}
+
+
+def _cache_model() -> str:
+    """Model name used in embedding cache keys, so vectors of different sizes are never mixed."""
+    dimensions = settings.RAG_EMBEDDING_DIMENSIONS
+    return f"{EMBEDDING_MODEL}@{dimensions}" if dimensions else EMBEDDING_MODEL
+
+
+def _retryable_errors(openai) -> tuple:
+    """Errors worth retrying; anything else (bad request, auth) fails the batch immediately."""
+    return (
+        openai.error.RateLimitError,
+        openai.error.APIError,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+
+
+def plan_embedding_batches(texts: list[str], max_items: int, max_tokens: int) -> list[tuple[int, int]]:
+    """
+    Split texts into contiguous batches bounded by item count and estimated tokens.
+
+    Args:
+        texts (list of str): Texts to embed.
+        max_items (int): Maximum number of inputs per request.
+        max_tokens (int): Maximum estimated tokens per request.
+
+    Returns:
+        list of tuple: ``(start, end)`` slice bounds into ``texts``, in order.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (i - start >= max_items or tokens + cost > max_tokens):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += cost
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _embed_batch(texts: list[str], user=None, priority: int = PRIORITY_BACKGROUND) -> list[list[float]]:
+    """
+    Embed a single batch once admitted by the embedding limiter.
+
+    Transient API failures are retried with exponential backoff; a rate limit
+    error honours ``Retry-After`` and pauses all embedding calls meanwhile.
+    """
+    # Imported on first use: the SDK is slow to import and only this thread-based path needs it
+    import openai
+
+    limiter = get_limiter("embedding")
+    tokens = sum(estimate_tokens(text) for text in texts)
+    attempt = 0
+    while True:
+        try:
+            with limiter.acquire(user, tokens, priority):
+                response = openai.Embedding.create(
+                    model=EMBEDDING_MODEL,
+                    input=texts,
+                    api_key=settings.OPENAI_API_KEY,
+                    api_base=settings.OPENAI_API_BASE,
+                    **_embedding_params(),
+                )
+            data = sorted(response['data'], key=lambda r: r['index'])
+            return [r['embedding'] for r in data]
+
+        except _retryable_errors(openai) as e:
+            attempt += 1
+            if attempt > settings.RAG_EMBEDDING_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, getattr(e, "headers", None))
+            logger.warning(f"Embedding batch of {len(texts)} failed ({e}), retry {attempt} in {delay}s")
+            if isinstance(e, openai.error.RateLimitError):
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+def _embed_uncached(texts: list[str], user=None, priority: int = PRIORITY_BACKGROUND) -> list[list[float]]:
+    """Embed texts through the API in concurrent, size-bounded batches."""
+    batches = plan_embedding_batches(
+        texts,
+        max_items=settings.RAG_EMBEDDING_BATCH_SIZE,
+        max_tokens=settings.RAG_EMBEDDING_BATCH_TOKENS,
+    )
+    if len(batches) == 1:
+        return _embed_batch(texts, user, priority)
+
+    workers = max(1, min(settings.RAG_EMBEDDING_CONCURRENCY, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-embed") as executor:
+        results = executor.map(lambda bounds: _embed_batch(texts[bounds[0]:bounds[1]], user, priority), batches)
+        return [embedding for batch in results for embedding in batch]
 
 
-def embed_texts(texts: list[str]) -> list[list[float]]:
+def embed_texts(texts: list[str], user=None, priority: int = PRIORITY_BACKGROUND) -> list[list[float]]:
     """
     Embed a list of texts using OpenAI's embedding model.
+
+    Previously seen texts are served from the embedding cache. The rest are
+    split into batches by item count and estimated tokens which are sent
+    concurrently; a failed batch is retried on its own. Vectors have
+    ``RAG_EMBEDDING_DIMENSIONS`` entries when it is set, else the model's default.
     
     Args:
         texts (list of str): List of texts to embed.
+        user: Identity for fair queuing in the embedding limiter, e.g. the document owner id.
+        priority (int): Limiter priority; ingestion runs in the background.
 
     Returns:
         list of list of float: List of embeddings corresponding to the input texts.
     """
+    if not texts:
+        return []
+
     try:
-        response = openai.Embedding.create(
-            model="text-embedding-3-small", 
-            input=texts
-        )
-        return [r['embedding'] for r in response['data']]
+        cache = get_embedding_cache()
+        if cache is None:
+            return _embed_uncached(texts, user, priority)
+
+        keys = [cache.make_key(_cache_model(), text) for text in texts]
+        found = cache.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, even if it repeats in the input
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            embeddings = _embed_uncached(list(missing.values()), user, priority)
+            fresh = dict(zip(missing.keys(), embeddings))
+            cache.put_memory(fresh)
+            try:
+                cache.put_disk(fresh)
+            except Exception:
+                # The disk tier is an optimisation: losing these rows must not fail the embedding call
+                logger.warning(f"Could not write {len(fresh)} embeddings to the disk cache", exc_info=True)
+            found.update(fresh)
+
+        return [found[key] for key in keys]
         
     except Exception as e:
         logger.error(f"Error generating embeddings: {str(e)}", exc_info=True)
         raise
 
 
-def get_chroma_collection(collection_name: str = "pdf_chunks", persist_dir: str = "chroma_db") -> Collection:
+async def _aembed_batch(client, texts: list[str], user=None, priority: int = PRIORITY_INTERACTIVE,
+                        on_queued=None) -> list[list[float]]:
+    """Async counterpart of ``_embed_batch`` over the shared connection pool."""
+    limiter = get_limiter("embedding")
+    tokens = sum(estimate_tokens(text) for text in texts)
+    attempt = 0
+    while True:
+        try:
+            async with limiter.aacquire(user, tokens, priority, on_queued):
+                return await client.embed(texts, EMBEDDING_MODEL, **_embedding_params())
+
+        except (OpenAIHTTPError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if isinstance(e, OpenAIHTTPError) and e.status not in RETRYABLE_STATUSES:
+                raise
+            attempt += 1
+            if attempt > settings.RAG_EMBEDDING_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, getattr(e, "headers", None))
+            logger.warning(f"Embedding batch of {len(texts)} failed ({e}), retry {attempt} in {delay}s")
+            if isinstance(e, OpenAIHTTPError) and e.status == 429:
+                limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+
+def _log_cache_write_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Error writing embeddings to the disk cache", exc_info=future.exception())
+
+
+async def aembed_texts(texts: list[str], user=None, priority: int = PRIORITY_INTERACTIVE,
+                       on_queued=None) -> list[list[float]]:
+    """
+    Embed a list of texts from async code without blocking the event loop.
+
+    Same caching and batching behaviour as ``embed_texts``, but requests go
+    through the shared async OpenAI client instead of a worker thread. Only the
+    in-memory cache tier is read on the event loop; SQLite lookups run in a
+    worker thread and new embeddings are written to it in the background.
+
+    Args:
+        texts (list of str): List of texts to embed.
+        user: Identity for fair queuing in the embedding limiter.
+        priority (int): Limiter priority; chat queries are interactive.
+        on_queued (callable): Passed to ``AdmissionController.aacquire`` to report queueing.
+
+    Returns:
+        list of list of float: List of embeddings corresponding to the input texts.
+    """
+    if not texts:
+        return []
+
+    try:
+        client = get_openai_client()
+        # Opening the cache reads SQLite, so even the lookup of it runs off the event loop
+        cache = await sync_to_async(get_embedding_cache, thread_sensitive=False)()
+        keys = [cache.make_key(_cache_model(), text) for text in texts] if cache else list(range(len(texts)))
+        found = {}
+        if cache:
+            unique = list(dict.fromkeys(keys))
+            found = cache.get_memory(unique)
+            on_disk = [key for key in unique if key not in found]
+            if on_disk:
+                found.update(await sync_to_async(cache.get_disk, thread_sensitive=False)(on_disk))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            pending = list(missing.values())
+            batches = plan_embedding_batches(
+                pending,
+                max_items=settings.RAG_EMBEDDING_BATCH_SIZE,
+                max_tokens=settings.RAG_EMBEDDING_BATCH_TOKENS,
+            )
+            semaphore = asyncio.Semaphore(max(1, settings.RAG_EMBEDDING_CONCURRENCY))
+
+            async def run(start, end):
+                async with semaphore:
+                    return await _aembed_batch(client, pending[start:end], user, priority, on_queued)
+
+            results = await asyncio.gather(*(run(start, end) for start, end in batches))
+            fresh = dict(zip(missing.keys(), (embedding for batch in results for embedding in batch)))
+            if cache:
+                cache.put_memory(fresh)
+                write = asyncio.get_running_loop().run_in_executor(None, cache.put_disk, fresh)
+                write.add_done_callback(_log_cache_write_error)
+            found.update(fresh)
+
+        return [found[key] for key in keys]
+
+    except Exception as e:
+        logger.error(f"Error generating embeddings: {str(e)}", exc_info=True)
+        raise
+
+
+_chroma_clients = {}
+_chroma_collections = {}
+_chroma_lock = threading.Lock()
+
+
+def get_chroma_client(persist_dir: str = "chroma_db"):
+    """
+    Return the process-wide Chroma PersistentClient for a directory, creating it on first use.
+
+    Opening a client loads the tenant's system database, and concurrent first
+    opens of the same directory can fail, so creation is serialised.
+    """
+    client = _chroma_clients.get(persist_dir)
+    if client is not None:
+        return client
+    with _chroma_lock:
+        client = _chroma_clients.get(persist_dir)
+        if client is None:
+            from chromadb import PersistentClient
+            from chromadb.config import Settings
+
+            client = _chroma_clients[persist_dir] = PersistentClient(path=persist_dir, settings=Settings())
+        return client
+
+
+def get_chroma_collection(collection_name: str = "pdf_chunks", persist_dir: str = "chroma_db") -> "Collection":
     """
-    Initialize Chroma PersistentClient and get or create a collection.
+    Get or create a Chroma collection on the process-wide client.
+
+    Collections are cached per process, so the HNSW index Chroma loads for a
+    collection is reused by every upload and query.
 
     Args:
         collection_name (str): Name of the collection to use.
@@ -43,11 +315,265 @@ def get_chroma_collection(collection_name: str = "pdf_chunks", persist_dir: str
         chromadb.api.models.Collection.Collection: 
         A Chroma collection object used to store and query embeddings.
     """
-    try:
-        client = PersistentClient(path=persist_dir, settings=Settings())
-        collection = client.get_or_create_collection(collection_name)
+    key = (persist_dir, collection_name)
+    collection = _chroma_collections.get(key)
+    if collection is not None:
         return collection
+    try:
+        client = get_chroma_client(persist_dir)
+        with _chroma_lock:
+            collection = _chroma_collections.get(key)
+            if collection is None:
+                collection = _chroma_collections[key] = client.get_or_create_collection(collection_name)
+            return collection
         
     except Exception as e:
         logger.error(f"Error initializing Chroma collection: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+def upsert_chunks(collection: "Collection", ids: list[str], documents: list[str], embeddings: list[list[float]],
+                  metadatas: list[dict], batch_size: int = None, on_batch=None) -> list[float]:
+    """
+    Write chunks to a Chroma collection in bulk.
+
+    Uses ``upsert`` so re-indexing a document with the same ids overwrites its
+    chunks instead of failing on duplicates. Batches are capped at the client's
+    maximum batch size.
+
+    Args:
+        collection (Collection): Target Chroma collection.
+        ids (list of str): Chunk ids.
+        documents (list of str): Chunk texts.
+        embeddings (list of list of float): Chunk embeddings.
+        metadatas (list of dict): Chunk metadata.
+        batch_size (int): Maximum records per write, defaults to ``RAG_CHROMA_BATCH_SIZE``.
+        on_batch (callable): Optional ``on_batch(written_so_far)`` progress callback.
+
+    Returns:
+        list of float: Seconds spent on each batch write.
+    """
+    size = batch_size or settings.RAG_CHROMA_BATCH_SIZE
+    try:
+        size = min(size, collection._client.get_max_batch_size())
+    except Exception:
+        pass
+
+    timings = []
+    try:
+        for start in range(0, len(ids), size):
+            end = start + size
+            began = time.perf_counter()
+            collection.upsert(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end],
+            )
+            elapsed = time.perf_counter() - began
+            timings.append(elapsed)
+            logger.debug(f"Upserted {min(end, len(ids)) - start} chunks into {collection.name} in {elapsed * 1000:.1f}ms")
+            if on_batch is not None:
+                on_batch(min(end, len(ids)))
+        return timings
+
+    except Exception as e:
+        logger.error(f"Error upserting chunks into Chroma: {str(e)}", exc_info=True)
+        raise
+
+class VectorStore:
+    """
+    Backend-neutral interface over a collection of chunk vectors.
+
+    Query results use Chroma's shape (one list per query embedding) so callers
+    do not depend on the backend; ``where`` filters use Chroma's syntax.
+    """
+
+    backend = None
+    name = None
+
+    def upsert(self, ids: list[str], documents: list[str], embeddings: list[list[float]],
+               metadatas: list[dict]) -> list[float]:
+        """
+        Insert or overwrite chunks.
+
+        Returns:
+            list of float: Seconds spent on each batch write, also recorded in
+            ``rag_vector_upsert_batch_seconds``.
+        """
+        raise NotImplementedError
+
+    def _record_batches(self, timings: list[float]) -> list[float]:
+        series = VECTOR_UPSERT_BATCH_SECONDS.labels(self.backend)
+        for seconds in timings:
+            series.observe(seconds)
+        return timings
+
+    def query(self, query_embeddings: list[list[float]], n_results: int, where: dict = None,
+              include=("documents", "metadatas", "distances")) -> dict:
+        raise NotImplementedError
+
+    def get(self, ids: list[str] = None, where: dict = None, include=("documents", "metadatas")) -> dict:
+        raise NotImplementedError
+
+    def delete(self, ids: list[str] = None, where: dict = None):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Load the index into memory ahead of the first query; a no-op by default."""
+
+
+class ChromaVectorStore(VectorStore):
+    """VectorStore over a Chroma collection."""
+
+    backend = "chroma"
+
+    def __init__(self, collection: "Collection"):
+        self.collection = collection
+        self.name = collection.name
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        return self._record_batches(upsert_chunks(self.collection, ids, documents, embeddings, metadatas))
+
+    def query(self, query_embeddings, n_results, where=None, include=("documents", "metadatas", "distances")):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=list(include),
+        )
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        return self.collection.get(ids=ids, where=where, include=list(include))
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def warm_up(self):
+        # A query with a stored vector makes Chroma load the collection's HNSW index
+        sample = self.collection.peek(1)
+        embeddings = sample.get("embeddings")
+        if embeddings is not None and len(embeddings):
+            self.collection.query(query_embeddings=[embeddings[0]], n_results=1, include=[])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def collection_name_for(owner_id: int = None, base_name: str = "pdf_chunks") -> str:
+    """
+    Name of the collection holding an owner's chunks.
+
+    With ``RAG_TENANT_SHARDING`` every owner gets their own collection, so a
+    search only scans that owner's vectors; otherwise all owners share ``base_name``.
+    """
+    if settings.RAG_TENANT_SHARDING and owner_id is not None:
+        return f"{base_name}_u{owner_id}"
+    return base_name
+
+
+def owner_filter(owner_id: int, pdf_ids: list[int] = None) -> dict:
+    """Chroma-style ``where`` filter restricting results to an owner's (selected) PDFs."""
+    where = {"owner_id": owner_id}
+    if pdf_ids:
+        where = {"$and": [where, {"pdf_id": {"$in": list(pdf_ids)}}]}
+    return where
+
+
+def get_vector_store(collection_name: str = None, backend: str = None, owner_id: int = None) -> VectorStore:
+    """
+    Return the process-wide vector store for a collection using the configured backend.
+
+    Stores are created once per backend and collection and shared by all
+    threads; callers should not cache them themselves.
+
+    Args:
+        collection_name (str): Name of the collection to use, defaults to the owner's collection.
+        backend (str): ``"chroma"`` or ``"numpy"``, defaults to ``RAG_VECTOR_BACKEND``.
+        owner_id (int): Owner whose collection to use when ``collection_name`` is not given.
+
+    Returns:
+        VectorStore: Store wrapping the collection.
+    """
+    collection_name = collection_name or collection_name_for(owner_id)
+    backend = backend or settings.RAG_VECTOR_BACKEND
+    key = (backend, collection_name)
+    store = _stores.get(key)
+    if store is not None:
+        return store
+
+    if backend == "chroma":
+        collection = get_chroma_collection(collection_name)
+        with _stores_lock:
+            return _stores.setdefault(key, ChromaVectorStore(collection))
+
+    if backend == "numpy":
+        from .numpy_index import NumpyVectorStore
+
+        # Loading an index maps its segments, so it is opened under the lock exactly once
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = NumpyVectorStore(
+                    settings.RAG_NUMPY_INDEX_DIR,
+                    collection_name,
+                    max_segments=settings.RAG_NUMPY_MAX_SEGMENTS,
+                    dtype=settings.RAG_NUMPY_VECTOR_DTYPE,
+                    rescore_factor=settings.RAG_NUMPY_RESCORE_FACTOR,
+                )
+            return store
+
+    raise ValueError(f"Unknown vector store backend {backend!r}")
+
+
+def _warm_up_collection_names(backend: str) -> list[str]:
+    if not settings.RAG_TENANT_SHARDING:
+        return [collection_name_for()]
+    if backend == "chroma":
+        return [getattr(c, "name", c) for c in get_chroma_client().list_collections()]
+    from pathlib import Path
+
+    return sorted(p.name for p in Path(settings.RAG_NUMPY_INDEX_DIR).glob("*") if p.is_dir())
+
+
+_warmed_up = False
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_vector_store():
+    """
+    Open the configured backend's collections and load their indexes, once per process.
+
+    Concurrent callers wait for the first one to finish, so an ASGI lifespan
+    startup that calls this after ``RagConfig.ready()`` began it still only
+    completes once the index is warm. Failures are logged, not raised: a cold
+    index only makes the first query slower.
+    """
+    global _warmed_up
+    with _warm_up_lock:
+        if _warmed_up:
+            return
+        _warmed_up = True
+        began = time.perf_counter()
+        backend = settings.RAG_VECTOR_BACKEND
+        try:
+            names = _warm_up_collection_names(backend)
+            for name in names:
+                get_vector_store(name, backend).warm_up()
+        except Exception as e:
+            logger.error(f"Vector store warm-up failed: {str(e)}", exc_info=True)
+            return
+        logger.info(f"Warmed up {len(names)} {backend} collections in {time.perf_counter() - began:.2f}s")
+
+
+def warm_up_in_background() -> threading.Thread:
+    """Run ``warm_up_vector_store`` in a daemon thread so server startup does not wait for it."""
+    thread = threading.Thread(target=warm_up_vector_store, name="rag-warm-up", daemon=True)
+    thread.start()
+    return thread
\ No newline at end of file
@@ -0,0 +1,50 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .helpers.openai_client import get_openai_client, close_openai_client
+from .helpers.vector_store import warm_up_vector_store
+
+logger = logging.getLogger(__name__)
+
+
+async def on_startup():
+    """Open process-wide resources before the first request is served."""
+    get_openai_client()
+    if settings.RAG_WARMUP:
+        # Waits for a warm-up RagConfig.ready() already started
+        await sync_to_async(warm_up_vector_store, thread_sensitive=False)()
+
+
+async def on_shutdown():
+    """Release process-wide resources."""
+    await close_openai_client()
+
+
+class LifespanApp:
+    """
+    ASGI lifespan handler for servers that send startup/shutdown events (e.g. uvicorn).
+
+    Servers without lifespan support (e.g. daphne) never call this; resources
+    are then created lazily on first use.
+    """
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await on_startup()
+                except Exception as exc:
+                    logger.exception("Lifespan startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await on_shutdown()
+                except Exception:
+                    logger.exception("Lifespan shutdown failed")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
\ No newline at end of file
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from rag.models import UploadedPDF
+from rag.helpers.vector_store import get_vector_store, collection_name_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Tag chunks indexed before per-owner scoping with owner_id/pdf_id, "
+        "moving them into tenant collections when RAG_TENANT_SHARDING is on."
+    )
+
+    def handle(self, *args, **options):
+        source = get_vector_store("pdf_chunks")
+        updated = 0
+
+        for pdf in UploadedPDF.objects.filter(is_indexed=True).iterator():
+            found = source.get(where={"pdf_name": pdf.file.name}, include=("documents", "metadatas", "embeddings"))
+            rows = [
+                (chunk_id, document, metadata, embedding)
+                for chunk_id, document, metadata, embedding in zip(
+                    found["ids"], found["documents"], found["metadatas"], found["embeddings"]
+                )
+                if "owner_id" not in metadata
+            ]
+            if not rows:
+                continue
+
+            target = get_vector_store(collection_name_for(pdf.owner_id))
+            target.upsert(
+                ids=[row[0] for row in rows],
+                documents=[row[1] for row in rows],
+                metadatas=[{**row[2], "owner_id": pdf.owner_id, "pdf_id": pdf.id} for row in rows],
+                embeddings=[list(row[3]) for row in rows],
+            )
+            if target.name != source.name:
+                source.delete(ids=[row[0] for row in rows])
+
+            updated += len(rows)
+            self.stdout.write(f"PDF {pdf.id}: tagged {len(rows)} chunks in {target.name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} chunks"))
\ No newline at end of file
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+import numpy as np
+from chromadb import PersistentClient
+from chromadb.config import Settings
+from django.core.management.base import BaseCommand
+
+from rag.helpers.numpy_index import NumpyVectorStore
+from rag.helpers.vector_store import ChromaVectorStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare insert and query latency of the Chroma and NumPy vector store backends on synthetic data, "
+        "and with --profiles the memory and recall of reduced-dimension and quantized NumPy indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=20000)
+        parser.add_argument('--dim', type=int, default=1536)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--profiles', action='store_true',
+                            help="Also benchmark embedding profiles (dimensions x storage dtype) on the NumPy backend")
+        parser.add_argument('--dimensions', default='1536,1024,512,256',
+                            help="Comma-separated reduced dimensions for --profiles")
+        parser.add_argument('--dtypes', default='float32,float16,int8',
+                            help="Comma-separated NumPy storage dtypes for --profiles")
+        parser.add_argument('--rescore-factor', type=int, default=4)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        n, dim, top_k = options['vectors'], options['dim'], options['top_k']
+
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = rng.standard_normal((options['queries'], dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        ids = [f"{i // 100}_{i % 100}" for i in range(n)]
+        metadatas = [{"pdf_id": i // 100, "chunk_index": i % 100} for i in range(n)]
+        documents = [f"chunk {i}" for i in range(n)]
+        exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :top_k]
+
+        self.stdout.write(f"{n} vectors x {dim} dims, {len(queries)} queries, top_k={top_k}")
+        with tempfile.TemporaryDirectory() as tmp:
+            stores = {
+                "chroma": ChromaVectorStore(
+                    PersistentClient(path=f"{tmp}/chroma", settings=Settings(anonymized_telemetry=False))
+                    .get_or_create_collection("benchmark")
+                ),
+                "numpy": NumpyVectorStore(f"{tmp}/numpy", "benchmark"),
+            }
+            for backend, store in stores.items():
+                began = time.perf_counter()
+                for start in range(0, n, options['batch_size']):
+                    end = start + options['batch_size']
+                    store.upsert(ids[start:end], documents[start:end], vectors[start:end].tolist(), metadatas[start:end])
+                insert_seconds = time.perf_counter() - began
+
+                latencies = []
+                hits = 0
+                for q, expected in zip(queries, exact):
+                    began = time.perf_counter()
+                    result = store.query([q.tolist()], n_results=top_k, include=("distances",))
+                    latencies.append((time.perf_counter() - began) * 1000)
+                    expected_ids = {ids[i] for i in expected}
+                    hits += len(expected_ids.intersection(result["ids"][0]))
+
+                began = time.perf_counter()
+                for q in queries[:50]:
+                    store.query([q.tolist()], n_results=top_k, where={"pdf_id": {"$in": [1, 2, 3]}}, include=("distances",))
+                filtered_ms = (time.perf_counter() - began) * 1000 / min(50, len(queries))
+
+                self.stdout.write(
+                    f"{backend:>7}: insert {insert_seconds:.2f}s | query p50 {np.percentile(latencies, 50):.2f}ms "
+                    f"p95 {np.percentile(latencies, 95):.2f}ms | filtered {filtered_ms:.2f}ms | "
+                    f"recall@{top_k} {hits / (len(queries) * top_k):.3f}"
+                )
+
+        if options['profiles']:
+            self._benchmark_profiles(rng, options)
+
+    def _benchmark_profiles(self, rng, options):
+        """
+        Memory vs recall of shortened, quantized vectors, against exact full-size float32 search.
+
+        The corpus mimics embeddings trained to allow shortening (as text-embedding-3
+        models are): variance decays across dimensions, so the leading ones carry
+        most of the signal. Queries are perturbed corpus vectors, so each has
+        genuine near neighbours. Shortened vectors are truncated and renormalised,
+        as the API does for ``dimensions``.
+        """
+        n, dim, top_k = options['vectors'], options['dim'], options['top_k']
+        vectors = rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(np.arange(1, dim + 1, dtype=np.float32))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = vectors[rng.choice(n, options['queries'], replace=False)]
+        queries = queries + 0.5 * rng.standard_normal(queries.shape).astype(np.float32) * np.abs(queries).mean()
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        ids = [f"{i // 100}_{i % 100}" for i in range(n)]
+        metadatas = [{"pdf_id": i // 100, "chunk_index": i % 100} for i in range(n)]
+        documents = [""] * n
+        exact = [{ids[i] for i in row} for row in np.argsort(-(queries @ vectors.T), axis=1)[:, :top_k]]
+
+        dimensions = [d for d in (int(v) for v in options['dimensions'].split(',')) if d <= dim]
+        dtypes = options['dtypes'].split(',')
+        rescore_factors = sorted({0, options['rescore_factor']})
+        self.stdout.write(
+            f"\nEmbedding profiles: {n} vectors, {len(queries)} queries, recall@{top_k} against {dim}-dim float32"
+        )
+        self.stdout.write(f"{'dims':>5} {'dtype':>8} {'rescore':>7} {'scan MB':>8} {'disk MB':>8} "
+                          f"{'p50 ms':>7} {'recall':>7}")
+        for d in dimensions:
+            shortened = vectors[:, :d] / np.linalg.norm(vectors[:, :d], axis=1, keepdims=True)
+            shortened_queries = queries[:, :d] / np.linalg.norm(queries[:, :d], axis=1, keepdims=True)
+            for dtype in dtypes:
+                for rescore_factor in (rescore_factors if dtype != "float32" else [0]):
+                    with tempfile.TemporaryDirectory() as tmp:
+                        store = NumpyVectorStore(tmp, "profile", dtype=dtype, rescore_factor=rescore_factor)
+                        for start in range(0, n, options['batch_size']):
+                            end = start + options['batch_size']
+                            store.upsert(ids[start:end], documents[start:end], shortened[start:end], metadatas[start:end])
+
+                        latencies = []
+                        hits = 0
+                        for q, expected in zip(shortened_queries, exact):
+                            began = time.perf_counter()
+                            result = store.query([q], n_results=top_k, include=("distances",))
+                            latencies.append((time.perf_counter() - began) * 1000)
+                            hits += len(expected.intersection(result["ids"][0]))
+
+                        files = [os.path.join(tmp, "profile", f) for f in os.listdir(os.path.join(tmp, "profile"))]
+                        disk = sum(os.path.getsize(f) for f in files if not f.endswith(".json"))
+                        scan = sum(os.path.getsize(f) for f in files if f.endswith((".f16", ".i8", ".scale")))
+                        scan = scan if dtype != "float32" else disk
+
+                    self.stdout.write(
+                        f"{d:>5} {dtype:>8} {rescore_factor or '-':>7} {scan / 2**20:>8.1f} {disk / 2**20:>8.1f} "
+                        f"{np.percentile(latencies, 50):>7.2f} {hits / (len(queries) * top_k):>7.3f}"
+                    )
\ No newline at end of file
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from rag.models import UploadedPDF
+from rag.helpers.ingestion import index_pdf
+
+
+class Command(BaseCommand):
+    help = (
+        "Index PDFs left without a running ingestion job, e.g. still pending after a restart "
+        "emptied the in-process queue, or failed. Runs in this process, one PDF at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--status', action='append', choices=[choice for choice, _ in UploadedPDF.Status.choices],
+            help="Job status to pick up; repeat for several (default: pending)",
+        )
+
+    def handle(self, *args, **options):
+        statuses = options['status'] or [UploadedPDF.Status.PENDING]
+        indexed = failed = 0
+
+        for pdf_id in UploadedPDF.objects.filter(status__in=statuses).order_by('pk').values_list('pk', flat=True):
+            index_pdf(pdf_id)
+            status = UploadedPDF.objects.filter(pk=pdf_id).values_list('status', flat=True).first()
+            if status == UploadedPDF.Status.INDEXED:
+                indexed += 1
+            else:
+                failed += 1
+            self.stdout.write(f"PDF {pdf_id}: {status}")
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} PDFs, {failed} failed"))
\ No newline at end of file
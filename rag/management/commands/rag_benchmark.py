@@ -0,0 +1,346 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from rag.benchmark.mock_openai import serve
+from rag.benchmark.pdf import make_pdf
+from rag.helpers.openai_client import close_openai_client
+
+UPLOAD_URL = "/api/v1/rag/upload/"
+JOB_URL = "/api/v1/rag/jobs/{}/"
+CHAT_URL = "/api/v1/ws/chat/"
+
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=float)
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _words(rng, count: int) -> list[str]:
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return ["".join(rng.choice(letters, size=int(rng.integers(4, 9)))) for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test PDF uploads and WebSocket chat end to end against a local mock OpenAI server "
+        "and write a JSON report (throughput, time to first token, latency, CPU and memory per stream)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help="Concurrent WebSocket clients")
+        parser.add_argument('--queries', type=int, default=3, help="Questions asked by each client, one after another")
+        parser.add_argument('--owners', type=int, default=4, help="Users owning documents; clients are spread over them")
+        parser.add_argument('--uploads', type=int, default=4, help="Extra uploads running in parallel with the chat load")
+        parser.add_argument('--pages', type=int, default=20, help="Pages per uploaded PDF")
+        parser.add_argument('--token-rate', type=float, default=50.0, help="Mock answer tokens per second")
+        parser.add_argument('--first-token-ms', type=float, default=300.0, help="Mock latency before the first token")
+        parser.add_argument('--answer-tokens', type=int, default=100, help="Mock tokens per answer")
+        parser.add_argument('--embedding-ms', type=float, default=20.0, help="Mock embedding request latency")
+        parser.add_argument('--stream', choices=("raw", "batched"), default="batched", help="WebSocket delta framing")
+        parser.add_argument('--backend', choices=("chroma", "numpy"), default=None, help="Vector store backend")
+        parser.add_argument('--response-cache', action='store_true', help="Keep the answer cache enabled")
+        parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for any single step")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='-', help="Report path, or - for stdout")
+
+    def handle(self, *args, **options):
+        if options['owners'] < 1 or options['clients'] < 1:
+            raise CommandError("--owners and --clients must be at least 1")
+
+        workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        mock = multiprocessing.get_context("spawn").Process(
+            target=serve,
+            kwargs={
+                "port": port,
+                "embedding_latency": options['embedding_ms'] / 1000,
+                "first_token_latency": options['first_token_ms'] / 1000,
+                "token_rate": options['token_rate'],
+                "answer_tokens": options['answer_tokens'],
+            },
+            daemon=True,
+        )
+        mock.start()
+
+        previous_cwd = os.getcwd()
+        test_db = None
+        overrides = {
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+            "OPENAI_API_BASE": f"{base_url}/v1",
+            "MEDIA_ROOT": os.path.join(workdir, "media"),
+            "RAG_NUMPY_INDEX_DIR": os.path.join(workdir, "numpy_index"),
+            "RAG_LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical_index"),
+            "RAG_EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+            "RAG_RESPONSE_CACHE_ENABLED": options['response_cache'],
+        }
+        if options['backend']:
+            overrides["RAG_VECTOR_BACKEND"] = options['backend']
+
+        try:
+            self._wait_for_mock(base_url, mock)
+            # Chroma persists relative to the working directory
+            os.chdir(workdir)
+            os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+            with override_settings(**overrides):
+                connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(workdir, "db.sqlite3")
+                test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                report = self._run(options)
+            report["upstream"] = json.loads(urllib.request.urlopen(f"{base_url}/stats", timeout=5).read())
+        finally:
+            if test_db is not None:
+                connection.creation.destroy_test_db(test_db, verbosity=0)
+            os.chdir(previous_cwd)
+            mock.terminate()
+            mock.join(timeout=5)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], "w") as report_file:
+                report_file.write(output + "\n")
+            self.stderr.write(f"Report written to {options['output']}")
+
+    def _wait_for_mock(self, base_url: str, process):
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            if not process.is_alive():
+                raise CommandError("Mock OpenAI server exited during startup")
+            try:
+                urllib.request.urlopen(f"{base_url}/stats", timeout=1)
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError("Mock OpenAI server did not start")
+
+    def _run(self, options) -> dict:
+        rng = np.random.default_rng(options['seed'])
+        User = get_user_model()
+        owners = [
+            User.objects.create_user(username=f"bench{i}", password="benchmark-password")
+            for i in range(options['owners'])
+        ]
+        vocabulary = _words(rng, 2000)
+        documents = {owner.pk: self._document(rng, vocabulary, options['pages']) for owner in owners}
+
+        self.stderr.write(f"Indexing {len(owners)} documents of {options['pages']} pages")
+        seeded = self._run_uploads([(owner, documents[owner.pk]) for owner in owners], options['timeout'])
+
+        extra = [(owners[i % len(owners)], self._document(rng, vocabulary, options['pages']))
+                 for i in range(options['uploads'])]
+        questions = [
+            [" ".join(rng.choice(documents[owners[c % len(owners)].pk][0].split(), size=6))
+             for _ in range(options['queries'])]
+            for c in range(options['clients'])
+        ]
+
+        self.stderr.write(
+            f"Running {options['clients']} chat clients x {options['queries']} questions "
+            f"with {len(extra)} concurrent uploads"
+        )
+        uploads_result = {}
+        uploader = threading.Thread(
+            target=lambda: uploads_result.update(self._run_uploads(extra, options['timeout'])),
+            name="rag-benchmark-uploads",
+        )
+        rss_before = _rss_mb()
+        cpu_before = _cpu_seconds()
+        began = time.perf_counter()
+        uploader.start()
+        streams = asyncio.run(self._run_chat(owners, questions, options))
+        duration = time.perf_counter() - began
+        cpu = _cpu_seconds() - cpu_before
+        rss_after = _rss_mb()
+        uploader.join()
+
+        completed = [s for s in streams if s["ok"]]
+        tokens = sum(s["deltas"] for s in completed)
+        return {
+            "config": {
+                key: options[key] for key in (
+                    "clients", "queries", "owners", "uploads", "pages", "token_rate", "first_token_ms",
+                    "answer_tokens", "embedding_ms", "stream", "response_cache", "seed",
+                )
+            } | {"backend": options['backend'] or settings.RAG_VECTOR_BACKEND},
+            "uploads": {"seed": seeded, "during_chat": uploads_result},
+            "chat": {
+                "streams": len(streams),
+                "completed": len(completed),
+                "errors": len(streams) - len(completed),
+                "queued": sum(1 for s in streams if s["queued"]),
+                "duration_s": round(duration, 3),
+                "streams_per_second": round(len(completed) / duration, 3) if duration else None,
+                "frames_per_stream": round(float(np.mean([s["frames"] for s in completed])), 1) if completed else None,
+                "ttft_ms": _percentiles([s["ttft_ms"] for s in completed if s["ttft_ms"] is not None]),
+                "total_ms": _percentiles([s["total_ms"] for s in completed]),
+                "connect_ms": _percentiles([s["connect_ms"] for s in streams if s["connect_ms"] is not None]),
+                "frames_received_per_second": round(sum(s["frames"] for s in completed) / duration, 1) if duration else None,
+                "answer_fragments": tokens,
+            },
+            "resources": {
+                # Whole process during the chat phase, including the concurrent uploads
+                "cpu_seconds": round(cpu, 3),
+                "cpu_ms_per_stream": round(cpu * 1000 / max(1, len(completed)), 2),
+                "rss_mb_before": round(rss_before, 1),
+                "rss_mb_after": round(rss_after, 1),
+                "rss_mb_peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "rss_kb_per_stream": round((rss_after - rss_before) * 1024 / max(1, len(streams)), 1),
+            },
+        }
+
+    def _document(self, rng, vocabulary, pages: int) -> list[str]:
+        result = []
+        for _ in range(pages):
+            lines = [" ".join(rng.choice(vocabulary, size=10)) + "." for _ in range(40)]
+            result.append("\n".join(lines))
+        return result
+
+    def _run_uploads(self, uploads, timeout: float) -> dict:
+        if not uploads:
+            return {"count": 0}
+
+        def upload(item):
+            owner, pages = item
+            client = APIClient()
+            client.force_authenticate(owner)
+            began = time.perf_counter()
+            response = client.post(
+                UPLOAD_URL,
+                {"file": SimpleUploadedFile("benchmark.pdf", make_pdf(pages), "application/pdf"), "title": "benchmark"},
+                format="multipart",
+            )
+            accepted = time.perf_counter()
+            if response.status_code != 202:
+                return {"ok": False, "accept_ms": (accepted - began) * 1000, "index_s": None}
+            job_url = JOB_URL.format(response.data["data"]["job_id"])
+            deadline = accepted + timeout
+            while time.perf_counter() < deadline:
+                status = client.get(job_url).data["data"]["status"]
+                if status in ("indexed", "failed"):
+                    return {
+                        "ok": status == "indexed",
+                        "accept_ms": (accepted - began) * 1000,
+                        "index_s": time.perf_counter() - began,
+                    }
+                time.sleep(0.05)
+            return {"ok": False, "accept_ms": (accepted - began) * 1000, "index_s": None}
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+            results = list(executor.map(upload, uploads))
+        duration = time.perf_counter() - began
+        indexed = [r for r in results if r["ok"]]
+        pages = sum(len(pages) for _, pages in uploads)
+        return {
+            "count": len(results),
+            "indexed": len(indexed),
+            "failed": len(results) - len(indexed),
+            "duration_s": round(duration, 3),
+            "pages_per_second": round(pages / duration, 2) if duration else None,
+            "accept_ms": _percentiles([r["accept_ms"] for r in results]),
+            "index_s": _percentiles([r["index_s"] for r in indexed]),
+        }
+
+    async def _run_chat(self, owners, questions, options) -> list[dict]:
+        from channels.testing import WebsocketCommunicator
+        from project.asgi import application
+
+        timeout = options['timeout']
+
+        async def client(number: int) -> list[dict]:
+            owner = owners[number % len(owners)]
+            token = str(RefreshToken.for_user(owner).access_token)
+            communicator = WebsocketCommunicator(application, f"{CHAT_URL}?stream={options['stream']}&token={token}")
+            began = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=timeout)
+            connect_ms = (time.perf_counter() - began) * 1000
+            results = []
+            if not connected:
+                return [{"ok": False, "connect_ms": None, "queued": False} for _ in questions[number]]
+            await communicator.receive_json_from(timeout=timeout)
+
+            for question in questions[number]:
+                stream = {"ok": False, "connect_ms": connect_ms, "queued": False, "ttft_ms": None,
+                          "total_ms": None, "frames": 0, "deltas": 0}
+                began = time.perf_counter()
+                await communicator.send_json_to({"query": question})
+                try:
+                    while True:
+                        message = await communicator.receive_json_from(timeout=timeout)
+                        kind = message.get("type")
+                        if kind == "delta":
+                            if stream["ttft_ms"] is None:
+                                stream["ttft_ms"] = (time.perf_counter() - began) * 1000
+                            stream["frames"] += 1
+                            stream["deltas"] += len(message["text"].split())
+                        elif kind == "queued":
+                            stream["queued"] = True
+                        elif kind == "done":
+                            stream["ok"] = True
+                            break
+                        elif "error" in message:
+                            stream["error"] = message["error"]
+                            break
+                except asyncio.TimeoutError:
+                    stream["error"] = "timeout"
+                stream["total_ms"] = (time.perf_counter() - began) * 1000
+                results.append(stream)
+                if not stream["ok"] and stream.get("error") == "timeout":
+                    break
+            await communicator.disconnect()
+            return results
+
+        try:
+            per_client = await asyncio.gather(*(client(n) for n in range(len(questions))))
+        finally:
+            await close_openai_client()
+        return [stream for streams in per_client for stream in streams]
\ No newline at end of file
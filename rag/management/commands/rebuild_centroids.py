@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from rag.models import UploadedPDF
+from rag.helpers.centroids import CentroidBuilder, store_centroid
+from rag.helpers.vector_store import get_vector_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the per-document centroid vectors used by RAG_RETRIEVAL_MODE=hierarchical "
+        "from the stored chunk embeddings of every indexed PDF."
+    )
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+
+        for pdf in UploadedPDF.objects.filter(status=UploadedPDF.Status.INDEXED).iterator():
+            found = get_vector_store(owner_id=pdf.owner_id).get(where={"pdf_id": pdf.id}, include=("embeddings",))
+            if not len(found["ids"]):
+                continue
+
+            centroid = CentroidBuilder()
+            centroid.add(found["embeddings"])
+            store_centroid(pdf.id, pdf.owner_id, pdf.file.name, centroid)
+
+            rebuilt += 1
+            self.stdout.write(f"PDF {pdf.id}: centroid of {centroid.count} chunks")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} centroids"))
\ No newline at end of file
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+def mark_indexed_pdfs(apps, schema_editor):
+    UploadedPDF = apps.get_model('rag', 'UploadedPDF')
+    UploadedPDF.objects.filter(is_indexed=True).update(status='indexed')
+    # No ingestion job exists for older unindexed uploads, so they would stay pending forever
+    UploadedPDF.objects.filter(is_indexed=False).update(
+        status='failed',
+        error="Not indexed before background ingestion was introduced; "
+              "run `python manage.py index_pdfs --status failed` or upload it again",
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='chunks_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='chunks_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('indexed', 'Indexed'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.RunPython(mark_indexed_pdfs, migrations.RunPython.noop),
+    ]
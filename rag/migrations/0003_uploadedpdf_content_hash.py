@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:40
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_pdfs(apps, schema_editor):
+    UploadedPDF = apps.get_model('rag', 'UploadedPDF')
+    for pdf in UploadedPDF.objects.filter(content_hash='').iterator():
+        digest = hashlib.sha256()
+        try:
+            with pdf.file.open('rb') as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+        except (OSError, ValueError):
+            continue
+        UploadedPDF.objects.filter(pk=pdf.pk).update(content_hash=digest.hexdigest())
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0002_ingestion_job_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedpdf',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_pdfs, migrations.RunPython.noop),
+    ]
@@ -3,10 +3,22 @@ from django.conf import settings
 
 
 class UploadedPDF(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        INDEXED = 'indexed', 'Indexed'
+        FAILED = 'failed', 'Failed'
+
     title = models.CharField(max_length=75, blank=True)
     file = models.FileField(upload_to='documents/pdfs/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_indexed = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    chunks_done = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # SHA-256 of the file, used to reuse the vectors of an identical upload
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -14,4 +26,4 @@ class UploadedPDF(models.Model):
     )
 
     def __str__(self):
-        return self.title or self.file.name
\ No newline at end of file
+        return self.title or self.file.name
@@ -11,4 +11,13 @@ class UploadedPDFSerializer(serializers.ModelSerializer):
     def validate_file(self, value):
         if not value.name.endswith('.pdf'):
             raise serializers.ValidationError("Only PDF files are allowed.")
-        return value
\ No newline at end of file
+        return value
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    pdf_id = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta:
+        model = UploadedPDF
+        fields = ['job_id', 'pdf_id', 'title', 'status', 'chunks_done', 'chunks_total', 'error', 'uploaded_at']
\ No newline at end of file
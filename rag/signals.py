@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .helpers.ingestion import delete_pdf_index
+from .helpers.response_cache import invalidate_pdf_responses
+from .models import UploadedPDF
+
+
+@receiver(pre_delete, sender=UploadedPDF)
+def drop_pdf_chunks(sender, instance, **kwargs):
+    """Remove a PDF's chunks before its row goes, so a failed removal aborts the delete."""
+    delete_pdf_index(instance.pk, instance.owner_id)
+
+
+@receiver(post_delete, sender=UploadedPDF)
+def drop_cached_responses(sender, instance, **kwargs):
+    """Forget cached answers that quoted a deleted PDF, and delete its file once the row is gone."""
+    invalidate_pdf_responses(instance.pk)
+    if instance.file:
+        transaction.on_commit(lambda: instance.file.delete(save=False))
\ No newline at end of file
@@ -1,3 +1,1061 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+import numpy as np
+from aiohttp.test_utils import TestServer
+from channels.layers import InMemoryChannelLayer
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
 
-# Create your tests here.
+from .benchmark.mock_openai import MockOpenAI, hashed_embedding
+from .benchmark.pdf import make_pdf
+from .consumers import ChatConsumer
+from .helpers import ingestion, text_processing
+from .helpers.context import CONTEXT_SEPARATOR, MIN_TRUNCATED_TOKENS, context_budget, pack_context
+from .helpers.embedding_cache import EmbeddingCache
+from .helpers.lexical_index import LexicalIndex, LexicalSegmentBuilder, tokenize
+from .helpers.metrics import VECTOR_UPSERT_BATCH_SECONDS, Counter, Histogram, StageTimer
+from .helpers.numpy_index import NumpyVectorStore, _quantize_int8
+from .helpers.openai_client import close_openai_client, get_openai_client, parse_stream_line
+from .helpers.rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AdmissionController, _Ticket, retry_delay
+from .helpers.response_cache import ResponseCache
+from .helpers.retrieval import mmr_select, reciprocal_rank_fusion, retrieve
+from .helpers.single_flight import FLIGHT_MESSAGE_TYPE, Flight, leave_flight
+from .helpers.streaming import DeltaBuffer
+from .helpers.text_processing import CHARS_PER_TOKEN, chunk_pages, estimate_tokens, iter_pdf_pages
+from .helpers.uploads import HashingUploadHandler, file_sha256
+from .helpers.vector_store import (
+    _embed_uncached, aembed_texts, collection_name_for, embed_texts, owner_filter, plan_embedding_batches, upsert_chunks,
+)
+from .management.commands.rag_benchmark import _percentiles
+from .models import UploadedPDF
+from .views import metrics_view
+
+
+class ChunkPagesTests(SimpleTestCase):
+    max_tokens = 50
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    def chunk(self, pages, overlap_tokens=0):
+        return list(chunk_pages(pages, max_tokens=self.max_tokens, overlap_tokens=overlap_tokens))
+
+    def test_sentences_are_packed_within_budget(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = self.chunk([(1, text)])
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.tokens, self.max_tokens)
+            self.assertTrue(chunk.text.endswith("."))
+        self.assertEqual(" ".join(chunk.text for chunk in chunks), text)
+
+    def test_short_sentences_count_their_separators(self):
+        text = " ".join(["Abc."] * 200)
+
+        chunks = self.chunk([(1, text)], overlap_tokens=10)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.tokens, self.max_tokens)
+            self.assertLessEqual(len(chunk.text), self.max_chars)
+
+    def test_offsets_point_into_joined_pages(self):
+        pages = [(1, "First page sentence."), (2, "Second page sentence.")]
+        joined = "\n".join(content for _, content in pages)
+
+        chunks = self.chunk(pages)
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual((chunks[0].page, chunks[0].page_end), (1, 2))
+        self.assertEqual(joined[chunks[0].char_start:chunks[0].char_end], joined)
+
+    def test_overlap_repeats_trailing_sentences(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = self.chunk([(1, text)], overlap_tokens=10)
+
+        for previous, current in zip(chunks, chunks[1:]):
+            last_sentence = previous.text.rsplit(". ", 1)[-1]
+            self.assertTrue(current.text.startswith(last_sentence.rstrip(".")))
+
+    def test_oversized_word_is_cut_by_characters(self):
+        url = "https://example.com/" + "a" * (self.max_chars * 3 + 17)
+        text = f"See {url} for details."
+
+        chunks = self.chunk([(1, text)])
+
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.text), self.max_chars)
+        self.assertEqual("".join(chunk.text for chunk in chunks).replace(" ", ""), text.replace(" ", ""))
+
+    def test_cjk_text_without_spaces(self):
+        text = "这是一个没有空格的很长的句子" * 200
+
+        chunks = self.chunk([(1, text)])
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.text), self.max_chars)
+        self.assertEqual("".join(chunk.text for chunk in chunks), text)
+
+    def test_cjk_sentence_punctuation_ends_segments(self):
+        sentence = "这是一个句子" * 10 + "。"
+        text = sentence * 5
+
+        chunks = self.chunk([(1, text)])
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertTrue(chunk.text.endswith("。"))
+            self.assertLessEqual(chunk.tokens, self.max_tokens)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache.sqlite3")
+        self.cache = EmbeddingCache(self.path, memory_items=10, disk_items=100, busy_timeout_ms=50)
+        self.addCleanup(self.cache._conn.close)
+
+    def test_disk_hits_are_promoted_to_memory(self):
+        self.cache.put_disk({b"a": [1.0, 2.0]})
+
+        self.assertEqual(self.cache.get_memory([b"a"]), {})
+        self.assertEqual(self.cache.get_disk([b"a", b"b"]), {b"a": [1.0, 2.0]})
+        self.assertEqual(self.cache.get_memory([b"a"]), {b"a": [1.0, 2.0]})
+        stats = self.cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["disk_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_failed_disk_write_is_rolled_back(self):
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.cache.put_disk({b"a": [1.0]})
+        other.execute("ROLLBACK")
+        other.close()
+
+        self.assertFalse(self.cache._conn.in_transaction)
+        self.cache.put_disk({b"b": [2.0]})
+        self.assertEqual(self.cache.get_disk([b"b"]), {b"b": [2.0]})
+        self.assertEqual(self.cache.stats()["disk_items"], 1)
+
+    def test_embed_texts_survives_disk_write_failure(self):
+        self.cache.put_disk = mock.Mock(side_effect=sqlite3.OperationalError("database is locked"))
+        with mock.patch("rag.helpers.vector_store.get_embedding_cache", return_value=self.cache), \
+                mock.patch("rag.helpers.vector_store._embed_uncached", return_value=[[0.5, 0.5]]), \
+                self.assertLogs("rag.helpers.vector_store", level="WARNING"):
+            self.assertEqual(embed_texts(["hello"]), [[0.5, 0.5]])
+        self.assertEqual(len(self.cache.get_memory(list(self.cache._memory))), 1)
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def store(self, **kwargs):
+        return NumpyVectorStore(self.dir, "chunks", **kwargs)
+
+    def upsert(self, store, *ids):
+        store.upsert(
+            ids=list(ids),
+            documents=[f"doc {chunk_id}" for chunk_id in ids],
+            embeddings=[[float(i + 1), 1.0] for i, _ in enumerate(ids)],
+            metadatas=[{"pdf_id": int(chunk_id.split("_")[0])} for chunk_id in ids],
+        )
+
+    def test_upsert_overwrites_existing_ids(self):
+        store = self.store()
+        self.upsert(store, "1_0", "1_1")
+        store.upsert(["1_0"], ["new"], [[0.0, 5.0]], [{"pdf_id": 1}])
+
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(store.get(ids=["1_0"])["documents"], ["new"])
+        self.assertEqual(store.query([[0.0, 5.0]], n_results=1)["ids"], [["1_0"]])
+
+    def test_delete_tombstones_rows_and_filters_apply(self):
+        store = self.store()
+        self.upsert(store, "1_0", "1_1", "2_0")
+        store.delete(where={"pdf_id": 1})
+
+        self.assertEqual(store.get()["ids"], ["2_0"])
+        self.assertEqual(store.query([[1.0, 1.0]], n_results=3)["ids"], [["2_0"]])
+        self.assertEqual(store.get(where={"pdf_id": {"$in": [1, 2]}})["ids"], ["2_0"])
+
+    def test_compaction_keeps_live_rows_only(self):
+        store = self.store(max_segments=2)
+        for n in range(5):
+            self.upsert(store, f"{n}_0")
+        store.delete(ids=["0_0"])
+
+        self.assertLessEqual(len(store._segments), 2)
+        self.assertEqual(sorted(store.get()["ids"]), ["1_0", "2_0", "3_0", "4_0"])
+
+    def test_reopen_restores_rows_and_tombstones(self):
+        store = self.store()
+        self.upsert(store, "1_0", "1_1")
+        store.delete(ids=["1_1"])
+
+        reopened = self.store()
+
+        self.assertEqual(reopened.get(include=("documents", "embeddings"))["documents"], ["doc 1_0"])
+        self.assertEqual(reopened.count(), 1)
+
+    def test_stores_sharing_a_directory_do_not_lose_writes(self):
+        first, second = self.store(), self.store()
+        self.upsert(first, "1_0")
+        self.upsert(second, "2_0")
+        second.delete(ids=["1_0"])
+        self.upsert(first, "3_0")
+
+        self.assertEqual(sorted(self.store().get()["ids"]), ["2_0", "3_0"])
+        self.assertEqual(sorted(second.get()["ids"]), ["2_0", "3_0"])
+
+
+class ConsumerTestCase(SimpleTestCase):
+    """A ChatConsumer with the state ``connect`` sets up, recording what it sends."""
+
+    def setUp(self):
+        self.sent = []
+        consumer = self.consumer = ChatConsumer()
+        consumer.channel_layer = InMemoryChannelLayer()
+        consumer.channel_name = "test.channel"
+        consumer._flight = None
+        consumer._flight_seen = 0
+        consumer._flight_watch = None
+        consumer._flight_lock = asyncio.Lock()
+        consumer._timing = None
+        consumer._awaiting_first_token = False
+        consumer._deltas = None
+        consumer._send_json = mock.AsyncMock(side_effect=self.sent.append)
+
+    def flight(self):
+        flight = Flight("key")
+        flight.task = asyncio.get_running_loop().create_future()
+        flight.subscribers.add(self.consumer.channel_name)
+        return flight
+
+    def record(self, flight, **event):
+        """Add an event to the flight's log without delivering its group message."""
+        event = {"type": FLIGHT_MESSAGE_TYPE, "flight": flight.group, **event, "seq": len(flight.events) + 1}
+        flight.events.append(event)
+        return event
+
+
+class FlightFollowerTests(ConsumerTestCase):
+    async def test_late_joiner_replays_buffered_events(self):
+        flight = self.flight()
+        self.record(flight, event="delta", text="a")
+        self.record(flight, event="done")
+
+        await self.consumer._subscribe(flight)
+
+        self.assertEqual(self.sent, [{"type": "delta", "text": "a"}, {"type": "done"}])
+        self.assertIsNone(self.consumer._flight)
+        self.assertIsNone(self.consumer._flight_watch)
+
+    async def test_seq_gap_is_filled_from_flight_events(self):
+        flight = self.flight()
+        await self.consumer._subscribe(flight)
+        self.record(flight, event="delta", text="a")
+        self.record(flight, event="delta", text="b")
+        message = self.record(flight, event="delta", text="c")
+
+        await self.consumer.chat_flight(message)
+        await self.consumer.chat_flight(message)
+
+        self.assertEqual([m["text"] for m in self.sent], ["a", "b", "c"])
+        await self.consumer._leave_flight()
+
+    async def test_follower_finishes_when_done_message_is_dropped(self):
+        flight = self.flight()
+        await self.consumer._subscribe(flight)
+        watch = self.consumer._flight_watch
+        self.record(flight, event="delta", text="a")
+        self.record(flight, event="done")
+
+        flight.task.set_result(None)
+        await watch
+
+        self.assertEqual(self.sent, [{"type": "delta", "text": "a"}, {"type": "done"}])
+        self.assertIsNone(self.consumer._flight)
+
+    async def test_follower_gets_error_when_stream_ends_without_final_event(self):
+        flight = self.flight()
+        await self.consumer._subscribe(flight)
+        watch = self.consumer._flight_watch
+        self.record(flight, event="delta", text="a")
+
+        flight.task.set_result(None)
+        await watch
+
+        self.assertEqual(self.sent[0], {"type": "delta", "text": "a"})
+        self.assertEqual(self.sent[-1]["error"], "Streaming error")
+        self.assertIsNone(self.consumer._flight)
+
+    async def test_leaving_cancels_the_watch(self):
+        flight = self.flight()
+        await self.consumer._subscribe(flight)
+        watch = self.consumer._flight_watch
+
+        await self.consumer._leave_flight()
+        await asyncio.wait([watch])
+
+        self.assertTrue(watch.cancelled())
+        self.assertTrue(flight.task.cancelled())
+        self.assertEqual(self.sent, [])
+
+
+class IndexPdfFailureTests(SimpleTestCase):
+    def setUp(self):
+        self.pdf = mock.Mock(pk=7, owner_id=3, content_hash="abc")
+        for target, kwargs in (
+            ("UploadedPDF.objects", {}),
+            ("get_vector_store", {}),
+            ("iter_pdf_pages", {}),
+            ("invalidate_pdf_responses", {}),
+            ("_update_job", {}),
+            ("delete_pdf_index", {}),
+            ("_find_indexed_copy", {"return_value": None}),
+        ):
+            patcher = mock.patch(f"rag.helpers.ingestion.{target}", **kwargs)
+            self.addCleanup(patcher.stop)
+            setattr(self, target.split(".")[-1], patcher.start())
+        self.objects.get.return_value = self.pdf
+
+    def test_failed_indexing_removes_stored_chunks(self):
+        with mock.patch("rag.helpers.ingestion.run_ingestion_pipeline", side_effect=RuntimeError("upstream")), \
+                self.assertLogs("rag.helpers.ingestion", level="ERROR"):
+            ingestion.index_pdf(7)
+
+        self.delete_pdf_index.assert_called_once_with(7, 3)
+        self.assertEqual(self._update_job.call_args.kwargs["status"], UploadedPDF.Status.FAILED)
+
+    def test_failed_copy_is_removed_before_reindexing(self):
+        self._find_indexed_copy.return_value = mock.Mock(pk=5)
+        with mock.patch("rag.helpers.ingestion._copy_chunks", side_effect=RuntimeError("store")), \
+                mock.patch("rag.helpers.ingestion.run_ingestion_pipeline", return_value=0) as pipeline, \
+                self.assertLogs("rag.helpers.ingestion", level="WARNING"):
+            ingestion.index_pdf(7)
+
+        self.delete_pdf_index.assert_called_once_with(7, 3)
+        pipeline.assert_called_once()
+
+    def test_cleanup_failure_still_marks_job_failed(self):
+        self.delete_pdf_index.side_effect = RuntimeError("store down")
+        with mock.patch("rag.helpers.ingestion.run_ingestion_pipeline", side_effect=RuntimeError("upstream")), \
+                self.assertLogs("rag.helpers.ingestion", level="WARNING"):
+            ingestion.index_pdf(7)
+
+        self.assertEqual(self._update_job.call_args.kwargs["status"], UploadedPDF.Status.FAILED)
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.index = LexicalIndex(self.dir)
+
+    def segment(self, pdf_id, texts, owner_id=1):
+        builder = LexicalSegmentBuilder(pdf_id, owner_id)
+        builder.add([f"{pdf_id}_{i}" for i in range(len(texts))], texts)
+        return builder.build()
+
+    def test_tokenize_any_script(self):
+        self.assertEqual(tokenize("Straße ISO/IEC café"), ["strasse", "iso/iec", "iso", "iec", "café"])
+        self.assertEqual(tokenize("Привет, МИР"), ["привет", "мир"])
+        self.assertEqual(tokenize("東京タワー"), ["東", "京", "タ", "ワ", "ー"])
+
+    def test_rare_terms_outrank_common_ones(self):
+        self.index.add_segment(self.segment(1, [
+            "the pump manual",
+            "the valve manual",
+            "the manual for the pump and the valve",
+            "pressure relief valve PN-1203",
+        ]))
+
+        hits = self.index.search("PN-1203 manual", owner_id=1)
+
+        self.assertEqual(hits[0][0], "1_3")
+        self.assertEqual([score for _, score in hits], sorted((score for _, score in hits), reverse=True))
+        self.assertEqual(self.index.search("Ventil", owner_id=1), [])
+
+    def test_search_is_scoped_to_owner_and_pdfs(self):
+        self.index.add_segment(self.segment(1, ["shared term"]))
+        self.index.add_segment(self.segment(2, ["shared term"]))
+        self.index.add_segment(self.segment(3, ["shared term"], owner_id=2))
+
+        self.assertEqual(sorted(chunk_id for chunk_id, _ in self.index.search("shared", owner_id=1)), ["1_0", "2_0"])
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("shared", owner_id=1, pdf_ids=[2])], ["2_0"])
+
+    def test_segments_written_by_another_instance_are_loaded(self):
+        other = LexicalIndex(self.dir)
+        self.assertEqual(self.index.search("gasket", owner_id=1), [])
+
+        other.add_segment(self.segment(1, ["gasket size"]))
+        self.assertEqual([chunk_id for chunk_id, _ in self.index.search("gasket", owner_id=1)], ["1_0"])
+
+        other.remove_pdf(1)
+        self.assertEqual(self.index.search("gasket", owner_id=1), [])
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_items_ranked_by_both_retrievers_come_first(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "a"]], k=60)
+
+        self.assertEqual([item for item, _ in fused][:2], ["a", "c"])
+        self.assertAlmostEqual(dict(fused)["a"], 1 / 61 + 1 / 63)
+        self.assertAlmostEqual(dict(fused)["d"], 1 / 62)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60, max_entries=3, max_bytes=1000)
+
+    def test_put_and_get_replay_deltas(self):
+        self.cache.put("k", ["Hel", "lo"], {1})
+
+        self.assertEqual(self.cache.get("k"), ("Hel", "lo"))
+        self.assertIsNone(self.cache.get("other"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_invalidating_a_pdf_drops_answers_built_on_it(self):
+        self.cache.put("a", ["a"], {1})
+        self.cache.put("b", ["b"], {1, 2})
+        self.cache.put("c", ["c"], {3})
+
+        self.assertEqual(self.cache.invalidate_pdf(1), 2)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), ("c",))
+
+    def test_answer_streamed_across_its_pdf_invalidation_is_not_stored(self):
+        generation = self.cache.generation
+        self.cache.invalidate_pdf(1)
+
+        self.cache.put("stale", ["x"], {1, 2}, generation)
+
+        self.assertIsNone(self.cache.get("stale"))
+
+    def test_invalidating_another_pdf_keeps_the_answer(self):
+        generation = self.cache.generation
+        self.cache.invalidate_pdf(9)
+
+        self.cache.put("fresh", ["x"], {1, 2}, generation)
+
+        self.assertEqual(self.cache.get("fresh"), ("x",))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in "abc":
+            self.cache.put(key, [key], {1})
+        self.cache.get("a")
+        self.cache.put("d", ["d"], {1})
+
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["entries"], 3)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("test_seconds", "Test.", labels=("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.labels("embed").observe(value)
+
+        self.assertEqual(histogram.render(), [
+            "# HELP test_seconds Test.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="embed",le="0.1"} 1',
+            'test_seconds_bucket{stage="embed",le="1.0"} 3',
+            'test_seconds_bucket{stage="embed",le="+Inf"} 4',
+            'test_seconds_sum{stage="embed"} 6.25',
+            'test_seconds_count{stage="embed"} 4',
+        ])
+
+    def test_stage_timer_records_stages_and_outcome_once(self):
+        histogram = Histogram("test_stage_seconds", "Test.", labels=("stage",))
+        outcomes = Counter("test_total", "Test.", labels=("outcome",))
+        timer = StageTimer("query", histogram, outcomes)
+
+        timer.mark("embed")
+        timer.record("retrieve", 0.2)
+        timer.finish("answered")
+        timer.finish("error")
+
+        self.assertEqual(sorted(values for values, in histogram._children), ["embed", "retrieve", "total"])
+        self.assertEqual(outcomes.render()[2:], ['test_total{outcome="answered"} 1'])
+
+
+class MetricsViewTests(SimpleTestCase):
+    def get(self, **headers):
+        return metrics_view(RequestFactory().get("/metrics", headers=headers))
+
+    @override_settings(RAG_METRICS_TOKEN="")
+    def test_disabled_without_token(self):
+        with self.assertRaises(Http404):
+            self.get()
+
+    @override_settings(RAG_METRICS_TOKEN="secret")
+    def test_requires_bearer_token(self):
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(Authorization="Bearer wrong").status_code, 401)
+        response = self.get(Authorization="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE rag_queries_total counter", response.content)
+
+
+class MmrSelectTests(SimpleTestCase):
+    embeddings = np.array([[1.0, 0.0], [0.995, 0.0998], [0.0, 1.0]], dtype=np.float32)
+    relevance = np.array([0.9, 0.85, 0.5], dtype=np.float32)
+
+    def test_lambda_one_ranks_by_relevance(self):
+        self.assertEqual(mmr_select(self.embeddings, self.relevance, 3, 1.0), [0, 1, 2])
+
+    def test_near_duplicates_are_pushed_down(self):
+        self.assertEqual(mmr_select(self.embeddings, self.relevance, 2, 0.5), [0, 2])
+
+    def test_k_larger_than_candidates(self):
+        self.assertEqual(len(mmr_select(self.embeddings, self.relevance, 10, 0.7)), 3)
+        self.assertEqual(mmr_select(self.embeddings[:0], self.relevance[:0], 3, 0.7), [])
+
+
+@override_settings(RAG_HYBRID_SEARCH=True, RAG_RETRIEVAL_MODE="flat", RAG_MIN_SIMILARITY=0.2)
+class HybridRetrieveTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = NumpyVectorStore(os.path.join(tmp.name, "vectors"), "chunks")
+        self.lexical = LexicalIndex(os.path.join(tmp.name, "lexical"))
+        patcher = mock.patch("rag.helpers.retrieval.get_lexical_index", return_value=self.lexical)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        chunks = {
+            "1_0": ("pump maintenance schedule", [1.0, 0.0, 0.0]),
+            "1_1": ("pump maintenance schedule, repeated", [0.99, 0.14, 0.0]),
+            "1_2": ("seal kit PN-1203", [0.0, 0.0, 1.0]),
+        }
+        self.store.upsert(
+            ids=list(chunks),
+            documents=[text for text, _ in chunks.values()],
+            embeddings=[vector for _, vector in chunks.values()],
+            metadatas=[{"owner_id": 1, "pdf_id": 1} for _ in chunks],
+        )
+        builder = LexicalSegmentBuilder(1, 1)
+        builder.add(list(chunks), [text for text, _ in chunks.values()])
+        self.lexical.add_segment(builder.build())
+
+    def retrieve(self, query, embedding, top_k, lambda_mult):
+        return retrieve(self.store, query, embedding, 1, top_k=top_k, fetch_k=10, lambda_mult=lambda_mult)
+
+    def test_lexical_match_is_kept_below_similarity_floor(self):
+        results = self.retrieve("PN-1203", [1.0, 0.0, 0.0], top_k=3, lambda_mult=1.0)
+
+        self.assertIn("1_2", results["ids"])
+        self.assertAlmostEqual(results["similarities"][results["ids"].index("1_2")], 0.0)
+
+    def test_diversity_prefers_distinct_chunk_over_duplicate(self):
+        results = self.retrieve("pump PN-1203", [1.0, 0.0, 0.2], top_k=2, lambda_mult=0.5)
+
+        self.assertEqual(results["ids"][0], "1_0")
+        self.assertEqual(results["ids"][1], "1_2")
+
+
+class PlanEmbeddingBatchesTests(SimpleTestCase):
+    def test_batches_are_bounded_by_items(self):
+        self.assertEqual(plan_embedding_batches(["a"] * 5, max_items=2, max_tokens=100), [(0, 2), (2, 4), (4, 5)])
+
+    def test_batches_are_bounded_by_tokens(self):
+        texts = ["x" * 8 * CHARS_PER_TOKEN, "x" * 4 * CHARS_PER_TOKEN, "x" * 4 * CHARS_PER_TOKEN]
+
+        self.assertEqual(plan_embedding_batches(texts, max_items=10, max_tokens=10), [(0, 1), (1, 3)])
+
+    def test_oversized_text_gets_its_own_batch(self):
+        texts = ["a", "x" * 50 * CHARS_PER_TOKEN, "b"]
+
+        self.assertEqual(plan_embedding_batches(texts, max_items=10, max_tokens=10), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(plan_embedding_batches([], max_items=10, max_tokens=10), [])
+
+    @override_settings(RAG_EMBEDDING_BATCH_SIZE=2, RAG_EMBEDDING_BATCH_TOKENS=1000, RAG_EMBEDDING_CONCURRENCY=4)
+    def test_concurrent_batches_keep_input_order(self):
+        def embed_batch(texts, user, priority):
+            # Later batches finish first
+            time.sleep(0.01 * (10 - int(texts[0])))
+            return [[float(text)] for text in texts]
+
+        texts = [str(i) for i in range(9)]
+        with mock.patch("rag.helpers.vector_store._embed_batch", side_effect=embed_batch) as batch:
+            self.assertEqual(_embed_uncached(texts), [[float(i)] for i in range(9)])
+        self.assertEqual(batch.call_count, 5)
+
+
+class UpsertChunksTests(SimpleTestCase):
+    def collection(self, max_batch_size):
+        collection = mock.Mock()
+        collection.name = "chunks"
+        collection._client.get_max_batch_size.return_value = max_batch_size
+        return collection
+
+    def upsert(self, collection, count, **kwargs):
+        ids = [str(i) for i in range(count)]
+        return upsert_chunks(collection, ids, ids, [[0.0]] * count, [{}] * count, **kwargs)
+
+    def test_batches_are_capped_by_the_client(self):
+        collection = self.collection(max_batch_size=3)
+        progress = []
+
+        timings = self.upsert(collection, 7, batch_size=5, on_batch=progress.append)
+
+        self.assertEqual([len(call.kwargs["ids"]) for call in collection.upsert.call_args_list], [3, 3, 1])
+        self.assertEqual(progress, [3, 6, 7])
+        self.assertEqual(len(timings), 3)
+
+    def test_errors_are_logged_and_raised(self):
+        collection = self.collection(max_batch_size=10)
+        collection.upsert.side_effect = RuntimeError("disk full")
+
+        with self.assertRaises(RuntimeError), self.assertLogs("rag.helpers.vector_store", level="ERROR"):
+            self.upsert(collection, 2)
+
+    def test_store_upsert_reports_batch_timings(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = NumpyVectorStore(path, "chunks")
+            series = VECTOR_UPSERT_BATCH_SECONDS.labels("numpy")
+            before = series.snapshot()[2]
+
+            timings = store.upsert(["a", "b"], ["a", "b"], [[1.0, 0.0], [0.0, 1.0]], [{}, {}])
+
+            self.assertEqual(len(timings), 1)
+            self.assertEqual(series.snapshot()[2], before + 1)
+            self.assertEqual(store.upsert([], [], [], []), [])
+
+
+@override_settings(RAG_EXTRACTION_WORKERS=2, RAG_EXTRACTION_PAGES_PER_TASK=2, RAG_PARALLEL_EXTRACTION_MIN_PAGES=4)
+class IterPdfPagesTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "doc.pdf")
+        pages = [f"Page {n} text" if n != 3 else "" for n in range(1, 8)]
+        with open(self.path, "wb") as file:
+            file.write(make_pdf(pages))
+
+    def tearDown(self):
+        pool, text_processing._extraction_pool = text_processing._extraction_pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def test_parallel_extraction_matches_serial_order(self):
+        serial = list(iter_pdf_pages(self.path, parallel=False))
+        parallel = list(iter_pdf_pages(self.path, parallel=True))
+
+        self.assertEqual([number for number, _ in serial], [1, 2, 4, 5, 6, 7])
+        self.assertEqual(parallel, serial)
+        self.assertIn("Page 7 text", serial[-1][1])
+
+    def test_small_pdf_is_read_in_process(self):
+        with override_settings(RAG_PARALLEL_EXTRACTION_MIN_PAGES=100):
+            list(iter_pdf_pages(self.path))
+
+        self.assertIsNone(text_processing._extraction_pool)
+
+
+class ParseStreamLineTests(SimpleTestCase):
+    def test_several_events_in_one_chunk(self):
+        line = 'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\ndata: {"choices": [{"delta": {"content": "lo"}}]}'
+
+        self.assertEqual(parse_stream_line(line), (["Hel", "lo"], False))
+
+    def test_done_stops_parsing(self):
+        line = 'data: {"choices": [{"delta": {"content": "end"}}]}\ndata: [DONE]\ndata: {"choices": [{"delta": {"content": "x"}}]}'
+
+        self.assertEqual(parse_stream_line(line), (["end"], True))
+
+    def test_ignores_noise_and_empty_deltas(self):
+        line = '\n'.join([
+            ": keep-alive",
+            "data: {not json",
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            'data: {"choices": []}',
+            'data: {"choices": [{"text": "legacy"}]}',
+        ])
+
+        self.assertEqual(parse_stream_line(line), (["legacy"], False))
+
+
+class OpenAIClientTests(SimpleTestCase):
+    async def test_client_is_shared_and_embeds_in_input_order(self):
+        mock_api = MockOpenAI(dim=8, embedding_latency=0)
+        async with TestServer(mock_api.app()) as server:
+            with override_settings(OPENAI_API_BASE=str(server.make_url("/v1"))):
+                client = get_openai_client()
+                try:
+                    self.assertIs(get_openai_client(), client)
+                    texts = ["alpha", "beta gamma", "delta"]
+                    embeddings = await client.embed(texts, model="m", dimensions=4)
+                finally:
+                    await close_openai_client()
+
+        self.assertEqual(embeddings, [hashed_embedding(text, 4).tolist() for text in texts])
+        self.assertTrue(client.closed)
+        self.assertEqual(mock_api.stats["embedding_requests"], 1)
+
+    async def test_aembed_texts_embeds_each_missing_text_once(self):
+        mock_api = MockOpenAI(dim=8, embedding_latency=0)
+        with tempfile.TemporaryDirectory() as path:
+            cache = EmbeddingCache(os.path.join(path, "cache.sqlite3"), memory_items=10, disk_items=100)
+            async with TestServer(mock_api.app()) as server:
+                with override_settings(OPENAI_API_BASE=str(server.make_url("/v1"))), \
+                        mock.patch("rag.helpers.vector_store.get_embedding_cache", return_value=cache):
+                    try:
+                        first = await aembed_texts(["pump seal", "valve", "pump seal"])
+                        second = await aembed_texts(["valve"])
+                    finally:
+                        await close_openai_client()
+            # New embeddings reach the disk tier in the background
+            for _ in range(100):
+                if cache.stats()["disk_items"] == 2:
+                    break
+                await asyncio.sleep(0.01)
+            cache._conn.close()
+
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(second, [first[1]])
+        self.assertEqual((mock_api.stats["embedding_requests"], mock_api.stats["embedding_inputs"]), (1, 2))
+        self.assertEqual(cache.stats()["disk_items"], 2)
+
+
+class OwnerScopingTests(SimpleTestCase):
+    def test_collection_name_for(self):
+        with override_settings(RAG_TENANT_SHARDING=False):
+            self.assertEqual(collection_name_for(7), "pdf_chunks")
+        with override_settings(RAG_TENANT_SHARDING=True):
+            self.assertEqual(collection_name_for(7), "pdf_chunks_u7")
+            self.assertEqual(collection_name_for(None), "pdf_chunks")
+            self.assertEqual(collection_name_for(7, base_name="pdf_centroids"), "pdf_centroids_u7")
+
+    def test_owner_filter(self):
+        self.assertEqual(owner_filter(7), {"owner_id": 7})
+        self.assertEqual(owner_filter(7, [1, 2]), {"$and": [{"owner_id": 7}, {"pdf_id": {"$in": [1, 2]}}]})
+
+    @override_settings(RAG_HYBRID_SEARCH=False, RAG_RETRIEVAL_MODE="flat", RAG_MIN_SIMILARITY=0.0)
+    def test_retrieve_never_returns_other_owners_chunks(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = NumpyVectorStore(path, "pdf_chunks")
+            store.upsert(
+                ids=["1_0", "2_0", "3_0"],
+                documents=["mine", "theirs", "mine too"],
+                embeddings=[[0.9, 0.1], [1.0, 0.0], [0.5, 0.5]],
+                metadatas=[{"owner_id": 7, "pdf_id": 1}, {"owner_id": 8, "pdf_id": 2}, {"owner_id": 7, "pdf_id": 3}],
+            )
+
+            results = retrieve(store, "q", [1.0, 0.0], 7, top_k=3, fetch_k=3, lambda_mult=1.0)
+            selected = retrieve(store, "q", [1.0, 0.0], 7, pdf_ids=[3], top_k=3, fetch_k=3, lambda_mult=1.0)
+
+        self.assertEqual(results["ids"], ["1_0", "3_0"])
+        self.assertEqual(selected["ids"], ["3_0"])
+
+
+class PackContextTests(SimpleTestCase):
+    def words(self, tokens):
+        return " ".join(["word"] * (tokens * CHARS_PER_TOKEN // 5))
+
+    def test_everything_fits(self):
+        documents = ["first chunk", "second chunk"]
+
+        self.assertEqual(pack_context(documents, budget=100), documents)
+
+    def test_chunk_over_budget_is_truncated_and_rest_dropped(self):
+        documents = [self.words(100), self.words(200), self.words(10)]
+
+        packed = pack_context(documents, budget=200)
+
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(packed[0], documents[0])
+        self.assertTrue(packed[1].endswith(" …"))
+        self.assertLessEqual(estimate_tokens(CONTEXT_SEPARATOR.join(packed)), 200)
+
+    def test_too_little_room_left_drops_the_chunk(self):
+        documents = [self.words(100), self.words(100)]
+
+        packed = pack_context(documents, budget=100 + MIN_TRUNCATED_TOKENS - 1)
+
+        self.assertEqual(packed, documents[:1])
+
+    @override_settings(RAG_ANSWER_MAX_TOKENS=1000, RAG_CONTEXT_MAX_TOKENS=6000)
+    def test_context_budget_depends_on_model_window(self):
+        self.assertEqual(context_budget("gpt-4o-mini", 200), 6000)
+        self.assertEqual(context_budget("gpt-3.5-turbo", 10000), 16385 - 1000 - 10000)
+        self.assertLessEqual(context_budget("unknown-model", 8000), 0)
+
+
+class DeltaBufferTests(SimpleTestCase):
+    def buffer(self, interval=60.0, max_bytes=10):
+        self.frames = []
+
+        async def send(text):
+            self.frames.append(text)
+
+        return DeltaBuffer(send, interval=interval, max_bytes=max_bytes)
+
+    async def test_first_delta_is_sent_at_once(self):
+        buffer = self.buffer()
+
+        await buffer.add("Hi")
+        await buffer.add(" there")
+
+        self.assertEqual(self.frames, ["Hi"])
+        await buffer.flush()
+        self.assertEqual(self.frames, ["Hi", " there"])
+
+    async def test_size_threshold_flushes_joined_deltas(self):
+        buffer = self.buffer(max_bytes=6)
+
+        for text in ("a", "bcd", "efg", "h"):
+            await buffer.add(text)
+
+        self.assertEqual(self.frames, ["a", "bcdefg"])
+        buffer.reset()
+
+    async def test_interval_flushes_waiting_deltas(self):
+        buffer = self.buffer(interval=0.01)
+
+        await buffer.add("a")
+        await buffer.add("b")
+        await buffer.add("c")
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.frames, ["a", "bc"])
+
+    async def test_reset_drops_buffer_and_starts_a_new_answer(self):
+        buffer = self.buffer()
+        await buffer.add("a")
+        await buffer.add("stale")
+
+        buffer.reset()
+        await buffer.add("next")
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.frames, ["a", "next"])
+        self.assertIsNone(buffer._timer)
+
+
+class CancellationTests(ConsumerTestCase):
+    async def test_upstream_is_cancelled_when_last_subscriber_leaves(self):
+        flight = self.flight()
+        flight.subscribers.add("other.channel")
+
+        leave_flight(flight, "other.channel")
+        self.assertFalse(flight.task.cancelled())
+
+        leave_flight(flight, self.consumer.channel_name)
+        self.assertTrue(flight.task.cancelled())
+        self.assertTrue(flight.finished)
+
+    async def test_cancel_stops_query_and_leaves_flight(self):
+        flight = self.flight()
+        await self.consumer._subscribe(flight)
+        self.consumer._query_task = asyncio.create_task(asyncio.sleep(60))
+        query_task = self.consumer._query_task
+
+        await self.consumer._cancel_query(notify=True)
+
+        self.assertTrue(query_task.cancelled())
+        self.assertTrue(flight.task.cancelled())
+        self.assertIsNone(self.consumer._flight)
+        self.assertEqual(self.sent, [{"type": "cancelled"}])
+
+    async def test_cancel_without_running_query_sends_nothing(self):
+        self.consumer._query_task = None
+
+        await self.consumer._cancel_query(notify=True)
+
+        self.assertEqual(self.sent, [])
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def submit(self, controller, user, tokens=1, priority=PRIORITY_BACKGROUND):
+        return controller._submit(_Ticket(user, tokens, priority))
+
+    def admission_order(self, controller, tickets):
+        order = []
+        for _ in tickets:
+            controller._release()
+            order.extend(t for t in tickets if t.admitted and t not in order)
+        return order
+
+    def test_users_are_served_round_robin(self):
+        controller = AdmissionController("test", max_concurrency=1, tokens_per_minute=0)
+        self.assertTrue(self.submit(controller, "a").admitted)
+        tickets = [self.submit(controller, user) for user in "aaab"]
+
+        self.assertEqual([t.user for t in self.admission_order(controller, tickets)], ["a", "b", "a", "a"])
+        self.assertEqual(controller.stats(), {"active": 1, "waiting": 0})
+
+    def test_interactive_calls_go_first(self):
+        controller = AdmissionController("test", max_concurrency=1, tokens_per_minute=0)
+        self.submit(controller, "a")
+        background = self.submit(controller, "b", priority=PRIORITY_BACKGROUND)
+        interactive = self.submit(controller, "c", priority=PRIORITY_INTERACTIVE)
+
+        self.assertEqual(self.admission_order(controller, [background, interactive]), [interactive, background])
+
+    def test_token_budget_holds_back_calls(self):
+        controller = AdmissionController("test", max_concurrency=5, tokens_per_minute=600)
+        self.addCleanup(lambda: controller._timer and controller._timer.cancel())
+
+        self.assertTrue(self.submit(controller, "a", tokens=590).admitted)
+        waiting = self.submit(controller, "b", tokens=100)
+
+        self.assertFalse(waiting.admitted)
+        self.assertIsNotNone(controller._timer)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = AdmissionController("test", max_concurrency=1, tokens_per_minute=0)
+        self.submit(controller, "a")
+
+        async def wait():
+            async with controller.aacquire("b"):
+                pass
+
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0)
+        self.assertEqual(controller.stats()["waiting"], 1)
+        task.cancel()
+        await asyncio.wait([task])
+
+        self.assertEqual(controller.stats(), {"active": 1, "waiting": 0})
+
+    @override_settings(RAG_UPSTREAM_MAX_BACKOFF=30)
+    def test_retry_delay(self):
+        self.assertEqual(retry_delay(1, {"Retry-After": "3"}), 3.0)
+        self.assertEqual(retry_delay(1, {"retry-after-ms": "250"}), 0.25)
+        self.assertEqual(retry_delay(1, {"Retry-After": "3600"}), 30)
+        self.assertEqual([retry_delay(n) for n in (1, 2, 6)], [2, 4, 30])
+
+
+class BenchmarkHelpersTests(SimpleTestCase):
+    def test_make_pdf_round_trips_text(self):
+        pages = ["Clause (4.2) applies\nSecond line", "Page two"]
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, "doc.pdf")
+            with open(file, "wb") as out:
+                out.write(make_pdf(pages))
+
+            extracted = list(iter_pdf_pages(file, parallel=False))
+
+        self.assertEqual([number for number, _ in extracted], [1, 2])
+        self.assertIn("Clause (4.2) applies", extracted[0][1])
+        self.assertIn("Page two", extracted[1][1])
+
+    def test_hashed_embedding_is_deterministic_and_word_based(self):
+        first = hashed_embedding("pump seal kit", 64)
+
+        self.assertTrue(np.array_equal(first, hashed_embedding("Pump seal kit", 64)))
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertGreater(float(first @ hashed_embedding("seal kit", 64)), float(first @ hashed_embedding("invoice", 64)))
+
+    async def test_mock_chat_streams_up_to_max_tokens(self):
+        mock_api = MockOpenAI(first_token_latency=0, token_rate=0, answer_tokens=10)
+        async with TestServer(mock_api.app()) as server:
+            with override_settings(OPENAI_API_BASE=str(server.make_url("/v1"))):
+                try:
+                    async with get_openai_client().stream_chat({"max_tokens": 3, "stream": True}) as response:
+                        body = (await response.read()).decode()
+                finally:
+                    await close_openai_client()
+
+        self.assertEqual(parse_stream_line(body), (["token0 ", "token1 ", "token2 "], True))
+        self.assertEqual(mock_api.stats["chat_completed"], 1)
+
+    def test_percentiles(self):
+        summary = _percentiles(list(range(1, 101)))
+
+        self.assertEqual((summary["count"], summary["p50"], summary["max"]), (100, 50.5, 100.0))
+        self.assertEqual(_percentiles([]), {"count": 0})
+
+
+class HashingUploadHandlerTests(SimpleTestCase):
+    content = bytes(range(256)) * 1000
+
+    def test_digest_is_computed_while_streaming(self):
+        request = RequestFactory().post("/upload/", {"file": SimpleUploadedFile("a.pdf", self.content)})
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers = [hasher, MemoryFileUploadHandler(request)]
+
+        received = request.FILES["file"].read()
+
+        self.assertEqual(received, self.content)
+        self.assertEqual(hasher.hashes, {"file": hashlib.sha256(self.content).hexdigest()})
+
+    def test_file_sha256_rewinds(self):
+        file = SimpleUploadedFile("a.pdf", self.content)
+
+        self.assertEqual(file_sha256(file), hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(file.read(), self.content)
+
+
+class QuantizedNumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((600, 32)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.queries = self.vectors[:20] + 0.3 * rng.standard_normal((20, 32)).astype(np.float32) / np.sqrt(32)
+        self.ids = [f"{i // 100}_{i % 100}" for i in range(len(self.vectors))]
+
+    def store(self, **kwargs):
+        store = NumpyVectorStore(self.dir, "chunks", **kwargs)
+        if not store.count():
+            store.upsert(self.ids, self.ids, self.vectors.tolist(), [{"pdf_id": i // 100} for i in range(len(self.ids))])
+        return store
+
+    def recall(self, store, k=5):
+        truth = np.argsort(-(self.queries @ self.vectors.T), axis=1)[:, :k]
+        hits = 0
+        for query, expected in zip(self.queries, truth):
+            found = store.query([query.tolist()], k, include=("distances",))["ids"][0]
+            hits += len({self.ids[i] for i in expected} & set(found))
+        return hits / truth.size
+
+    def test_quantize_int8_round_trip(self):
+        quantized, scales = _quantize_int8(self.vectors)
+
+        self.assertEqual(quantized.dtype, np.int8)
+        error = np.abs(quantized * scales[:, None] - self.vectors).max(axis=1)
+        self.assertTrue(np.all(error <= scales / 2 + 1e-6))
+
+    def test_int8_with_rescore_matches_exact_search(self):
+        store = self.store(dtype="int8", rescore_factor=4)
+
+        self.assertEqual(self.recall(store), 1.0)
+        result = store.query([self.queries[0].tolist()], 1, include=("embeddings",))
+        np.testing.assert_array_equal(np.asarray(result["embeddings"][0][0], dtype=np.float32), self.vectors[0])
+
+    def test_compact_dtypes_keep_high_recall_without_rescore(self):
+        for dtype in ("float16", "int8"):
+            with self.subTest(dtype=dtype):
+                self.assertGreaterEqual(self.recall(self.store(dtype=dtype, rescore_factor=0)), 0.9)
+                NumpyVectorStore(self.dir, "chunks").delete(where={"pdf_id": {"$in": list(range(6))}})
+
+    def test_reopened_segments_keep_their_dtype(self):
+        self.store(dtype="int8", rescore_factor=0)
+
+        reopened = NumpyVectorStore(self.dir, "chunks", dtype="float32")
+
+        self.assertEqual(reopened._segments[0].vectors.dtype, np.int8)
+        self.assertIsNone(reopened._segments[0].exact)
+        self.assertEqual(reopened.count(), len(self.ids))
+
+    def test_unknown_dtype_is_rejected(self):
+        with self.assertRaises(ValueError):
+            NumpyVectorStore(self.dir, "chunks", dtype="bfloat16")
\ No newline at end of file
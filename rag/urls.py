@@ -5,4 +5,6 @@ from . import views
 
 urlpatterns = [
     path('upload/', views.PDFUploadView.as_view()),
+    path('jobs/<int:job_id>/', views.IngestionJobView.as_view()),
+    path('pdfs/<int:pdf_id>/', views.PDFDetailView.as_view()),
 ]
\ No newline at end of file
@@ -1,4 +1,9 @@
+import hmac
 import logging
+import queue
+import time
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.views import APIView
@@ -6,9 +11,11 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
 
-from .serializers import UploadedPDFSerializer
-from .helpers.text_processing import extract_text_from_pdf, chunk_text
-from .helpers.vector_store import embed_texts, get_chroma_collection
+from .models import UploadedPDF
+from .serializers import UploadedPDFSerializer, IngestionJobSerializer
+from .helpers.ingestion import get_ingestion_queue
+from .helpers.metrics import REGISTRY, UPLOAD_SECONDS
+from .helpers.uploads import HashingUploadHandler, file_sha256
 
 logger = logging.getLogger(__name__)
 
@@ -17,52 +24,120 @@ class PDFUploadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        started = time.perf_counter()
+        # Hash the file as it streams in; must be installed before request.data is parsed
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
+
         serializer = UploadedPDFSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(
                 {"error": "Invalid data", "details": serializer.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        pdf_instance = serializer.save(owner=request.user)
+
+        content_hash = hasher.hashes.get("file") or file_sha256(serializer.validated_data["file"])
+        existing = (
+            UploadedPDF.objects.filter(owner=request.user, content_hash=content_hash)
+            .exclude(status=UploadedPDF.Status.FAILED)
+            .order_by("pk")
+            .first()
+        )
+        if existing is not None:
+            return Response({
+                "success": True,
+                "message": "PDF already uploaded",
+                "duplicate": True,
+                "data": IngestionJobSerializer(existing).data
+            }, status=status.HTTP_200_OK)
+
+        pdf_instance = serializer.save(owner=request.user, content_hash=content_hash)
 
         try:
-            text = extract_text_from_pdf(pdf_instance.file.path)
-
-            if not text.strip():
-                return Response(
-                    {"error": "The uploaded PDF is empty", "details": "No text content found in the PDF file"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Chunk & Embed
-            chunks = chunk_text(text)
-            embeddings = embed_texts(chunks)
-            
-            # Store in Chroma
-            collection = get_chroma_collection()
-
-            for i, chunk in enumerate(chunks):
-                collection.add(
-                    documents=[chunk],
-                    metadatas=[{"pdf_name": pdf_instance.file.name, "chunk_index": i}],
-                    embeddings=[embeddings[i]],
-                    ids=[f"{pdf_instance.id}_{i}"],
-                )
-
-            # Mark PDF as indexed
-            pdf_instance.is_indexed = True
-            pdf_instance.save()
+            get_ingestion_queue().submit(pdf_instance.id)
+
+        except queue.Full:
+            logger.warning(f"Ingestion queue full, rejecting PDF {pdf_instance.id}")
+            pdf_instance.file.delete(save=False)
+            pdf_instance.delete()
+            return Response(
+                {"error": "Server busy", "details": "Too many documents are being indexed, please retry shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "30"}
+            )
+
+        UPLOAD_SECONDS.observe(time.perf_counter() - started)
+        return Response({
+            "success": True,
+            "message": "PDF uploaded and queued for indexing",
+            "data": IngestionJobSerializer(pdf_instance).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class IngestionJobView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        pdf_instance = UploadedPDF.objects.filter(pk=job_id, owner=request.user).first()
+        if pdf_instance is None:
+            return Response(
+                {"error": "Not found", "details": "No ingestion job with this id"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response({
+            "success": True,
+            "data": IngestionJobSerializer(pdf_instance).data
+        })
 
-            return Response({
-                "success": True, 
-                "message": "PDF uploaded and indexed successfully",
-                "data": {"pdf_id": pdf_instance.id, "chunks_count": len(chunks)}
-            })
 
+
+class PDFDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, pdf_id):
+        """Delete a PDF, its file, and all of its chunks from the vector store and lexical index."""
+        pdf_instance = UploadedPDF.objects.filter(pk=pdf_id, owner=request.user).first()
+        if pdf_instance is None:
+            return Response(
+                {"error": "Not found", "details": "No PDF with this id"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if pdf_instance.status == UploadedPDF.Status.PROCESSING:
+            return Response(
+                {"error": "PDF is being indexed", "details": "Retry once indexing has finished"},
+                status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "10"}
+            )
+
+        try:
+            pdf_instance.delete()
         except Exception as e:
-            logger.error(f"Error processing PDF {pdf_instance.id}: {str(e)}", exc_info=True)
+            logger.error(f"Error deleting PDF {pdf_id}: {str(e)}", exc_info=True)
             return Response(
-                {"error": "Internal server error", "details": "Failed to process the PDF file"},
+                {"error": "Internal server error", "details": "Failed to delete the PDF"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+        return Response({
+            "success": True,
+            "message": "PDF deleted",
+            "data": {"pdf_id": pdf_id}
+        })
+
+
+def metrics_view(request):
+    """
+    Expose the process's RAG metrics in the Prometheus text format.
+
+    Scrapers must send ``RAG_METRICS_TOKEN`` as ``Authorization: Bearer <token>``.
+    Returns 404 when ``RAG_METRICS_ENABLED`` is off or no token is configured,
+    so the endpoint is never served unauthenticated.
+    """
+    if not settings.RAG_METRICS_ENABLED or not settings.RAG_METRICS_TOKEN:
+        raise Http404()
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), settings.RAG_METRICS_TOKEN.encode()):
+        return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
\ No newline at end of file